@@ -14,59 +14,50 @@ See the License for the specific language governing permissions and
 limitations under the License.
 '''
 
+import time
+# Start of the poecli startup, see "show -d"
+startup_begin = time.time()
+
 from poe_common import *
-from datetime import datetime, date
-from time import sleep
 from poe_version import *
+from poe_registry import PoePlatformRegistry
 
-import binascii
 import re
-import imp
 import sys
-import subprocess
 import os
 import argparse
-import time
 import collections
 import json
-import pathlib
 
-bootcmd_path   = "/proc/cmdline"
 pa_root_path   = os.getcwd() + "/../"
 plat_root_path = pa_root_path + "platforms"
 
 PORTLIST_VALIDATION1 = "^([1-9]{0,1}[0-9]{1})-([1-9]{0,1}[0-9]{1})$"
 PORTLIST_VALIDATION2 = "^([1-9]{0,1}[0-9]{1})$"
+
+# Diagnostic dumps run under the shared POE access lock, never in the
+# middle of poed restoring or flushing the chip, and in the bulk bus
+# priority class: their reads are rate limited, sent in chunks and give
+# the bus to set commands and poed between chunks
+def PoeBulkAccess(func):
+    @PoeAccessSharedLock
+    def wrap_cmd(*args, **kwargs):
+        with args[0].poe_plat.bus_priority(BUS_PRIO_BULK):
+            return func(*args, **kwargs)
+    return wrap_cmd
+
 class PoeCLI(object):
     TIME_FMT = "%Y/%m/%d %H:%M:%S"
 
     def __init__(self):
         self.log = PoeLog()
+        self.import_time = time.time() - startup_begin
+        plat_begin = time.time()
         self.poe_plat = self.load_poe_platform()
-
-    # Get platform model name from boot cmd
-    def platform_model(self, file_path=bootcmd_path):
-        try:
-            with open(file_path, 'r') as f:
-                d = dict(i.split('=') for i in f.read().split(' '))
-                return d.get("onl_platform").rstrip()
-        except Exception as e:
-            print_stderr("Failed to get model name from %s. err: %s" % (bootcmd_path, str(e)))
-            return "Unknown"
-
-    def platform_src_path(self):
-        try:
-            # dentOS platform format: <arch>-<manufacturer>-<model>-<revision>
-            [arch, manufacturer, model_revision] = self.platform_model().split('-', 2)
-            return "/".join([plat_root_path, manufacturer,
-                             model_revision, "poe_platform.py"])
-        except Exception as e:
-            print_stderr("Failed to get platform path. err: %s" % str(e))
+        self.plat_load_time = time.time() - plat_begin
 
     def load_poe_platform(self):
-        plat_src = imp.load_source("poe_plat", self.platform_src_path())
-        poe_plat = plat_src.get_poe_platform()
-        return poe_plat
+        return PoePlatformRegistry(plat_root_path).load_platform()
 
     def valid_ports(self, data):
         portList = []
@@ -123,6 +114,9 @@ class PoeCLI(object):
                                  help="Show more Information for debugging\n")
         show_parser.add_argument("-j", "--json", action="store_true",
                                  help="Display information in JSON format\n")
+        show_parser.add_argument("-w", "--watch", metavar="<sec>", type=float,
+                                 help="Refresh the ports information (-p) every <sec> seconds,\n"
+                                 "from poed when it is running\n")
         show_group = show_parser.add_mutually_exclusive_group()
         show_group.add_argument("-p", "--ports", metavar="<val>", type=self.valid_ports,
                                 help="Show PoE Ports Information\n"
@@ -170,6 +164,9 @@ class PoeCLI(object):
                                 help="Save current runtime settings to persistent file.\n")
         cfg_parser.add_argument("-l", "--load", action="store_true",
                                 help="Load settings from persistent file.\n")
+        cfg_parser.add_argument("-d", "--desired", action="store_true",
+                                help="Keep ports reconciled to the desired state in the\n"
+                                "file given by -c, without -c stop reconciling.\n")
         cfg_parser.add_argument("-c", "--config",
                                 metavar="<val>",
                                 help="Assign file path for save/load operation,\n"
@@ -203,16 +200,29 @@ class PoeCLI(object):
     def get_system_running_state(self):
         return self.poe_plat.get_system_information()
 
+    # System status published by poed, used while it is running: reading
+    # it from the chip would clear the events latched for poed
+    def load_poed_system_status(self):
+        try:
+            with open(POED_SYSTEM_STATUS_PATH, 'r') as f:
+                return json.loads(f.read())
+        except Exception:
+            raise RuntimeError("system status not published by poed yet")
+
     def get_ports_running_state(self, portList):
         return self.poe_plat.get_ports_information(portList)
 
     def get_individual_masks(self):
+        return self.poe_plat.get_individual_masks(list(range(0x54)))
+
+    def get_bus_stats(self):
         data = collections.OrderedDict()
-        masks = list(range(0x54))
-        for mask in masks:
-            val = self.poe_plat.get_individual_mask(mask).get(ENDIS)
-            key = "0x{:02x}".format(mask)
-            data[key] = val
+        try:
+            with open(POED_BUS_STATS_PATH, 'r') as f:
+                data["poed"] = json.loads(f.read())
+        except Exception:
+            data["poed"] = None
+        data["poecli"] = self.poe_plat.get_bus_stats()
         return data
 
     def print_poe_version(self, versions):
@@ -220,28 +230,37 @@ class PoeCLI(object):
         print("PoE Agent Version: %s" % versions[POE_AGT_VER])
         print("PoE Config Version: %s" % versions[POE_CFG_VER])
 
-    def print_ports_information(self, ports_info, debug):
-        print("")
+    # Cell formats of a port row, then of the debug columns
+    PORT_CELLS = [(PORT_ID, "{:<4d}"), (STATUS, "{:17s}"), (ENDIS, "{:7s}"),
+                  (PRIORITY, "{:^8s}"), (PROTOCOL, "{:14s}"), (CLASS, "{:^5s}"),
+                  (POWER_CONSUMP, "{:6d} (mW)"), (POWER_LIMIT, "{:6d} (mW)"),
+                  (VOLTAGE, "{:5.1f} (V)"), (CURRENT, "{:3d} (mA)")]
+    PORT_DEBUG_CELLS = [(LATCH, "0x{:02x} "), (EN_4PAIR, "{:4d}")]
+
+    def print_ports_header(self, debug):
         if debug:
             print("Port  Status             En/Dis   Priority  Protocol        Class  PWR Consump  PWR Limit    Voltage    Current   Latch  En4Pair")
             print("----  -----------------  -------  --------  --------------  -----  -----------  -----------  ---------  --------  -----  -------")
         else:
             print("Port  Status             En/Dis   Priority  Protocol        Class  PWR Consump  PWR Limit    Voltage    Current ")
             print("----  -----------------  -------  --------  --------------  -----  -----------  -----------  ---------  --------")
+
+    # highlight: fields whose cells are shown in reverse video
+    def format_port_row(self, info, debug, highlight=()):
+        cells = self.PORT_CELLS + (self.PORT_DEBUG_CELLS if debug else [])
+        output = []
+        for field, fmt in cells:
+            cell = fmt.format(info.get(field))
+            if field in highlight:
+                cell = "\033[7m" + cell + "\033[0m"
+            output.append(cell)
+        return "  ".join(output)
+
+    def print_ports_information(self, ports_info, debug):
+        print("")
+        self.print_ports_header(debug)
         for info in ports_info:
-            if debug:
-                output = "{:<4d}  {:17s}  {:7s}  {:^8s}  {:14s}  {:^5s}  {:6d} (mW)  {:6d} (mW)  {:5.1f} (V)  {:3d} (mA)  {:5s}  {:4d}".format(
-                         info.get(PORT_ID), info.get(STATUS), info.get(ENDIS),
-                         info.get(PRIORITY), info.get(PROTOCOL), info.get(CLASS),
-                         info.get(POWER_CONSUMP), info.get(POWER_LIMIT), info.get(VOLTAGE),
-                         info.get(CURRENT), "0x{:02x}".format(info.get(LATCH)), info.get(EN_4PAIR))
-            else:
-                output = "{:<4d}  {:17s}  {:7s}  {:^8s}  {:14s}  {:^5s}  {:6d} (mW)  {:6d} (mW)  {:5.1f} (V)  {:3d} (mA)".format(
-                         info.get(PORT_ID), info.get(STATUS), info.get(ENDIS),
-                         info.get(PRIORITY), info.get(PROTOCOL), info.get(CLASS),
-                         info.get(POWER_CONSUMP), info.get(POWER_LIMIT), info.get(VOLTAGE),
-                         info.get(CURRENT))
-            print(output)
+            print(self.format_port_row(info, debug))
         print("")
 
     def print_system_information(self, system_info, debug):
@@ -287,7 +306,38 @@ class PoeCLI(object):
             print(" {:s}:{:2d}".format(key, masks[key]))
         print("")
 
-    @PoeAccessExclusiveLock
+    def print_bus_stats(self, bus_stats):
+        for owner in bus_stats:
+            stats = bus_stats[owner]
+            print("")
+            print("==============================")
+            print(" PoE Bus Statistics (%s)" % owner)
+            print("==============================")
+            if stats is None:
+                print(" Not available")
+                continue
+            print(" Since: %s" % time.strftime(
+                self.TIME_FMT, time.localtime(stats[BUS_STAT_SINCE])))
+            print("")
+            print(" Command                       Trans  Retry  Fail    TX (B)    RX (B)   I2C (ms)  Sleep (ms)")
+            print(" ----------------------------  -----  -----  ----  --------  --------  ---------  ----------")
+            rows = list(stats[BUS_STAT_COMMANDS].items())
+            rows.append((BUS_STAT_TOTAL, stats[BUS_STAT_TOTAL]))
+            for cmd_type, entry in rows:
+                print(" {:28s}  {:5d}  {:5d}  {:4d}  {:8d}  {:8d}  {:9.1f}  {:10.1f}".format(
+                      cmd_type, entry[BUS_STAT_TRANS], entry[BUS_STAT_RETRIES],
+                      sum(entry[BUS_STAT_FAILURES].values()),
+                      entry[BUS_STAT_TX_BYTES], entry[BUS_STAT_RX_BYTES],
+                      entry[BUS_STAT_I2C_TIME] * 1000,
+                      entry[BUS_STAT_SLEEP_TIME] * 1000))
+            failures = stats[BUS_STAT_TOTAL][BUS_STAT_FAILURES]
+            if len(failures) > 0:
+                print("")
+                print(" Failures: %s" % ", ".join(
+                    "{0}={1}".format(k, v) for k, v in failures.items()))
+        print("")
+
+    @PoeBulkAccess
     def show_versions(self, json):
         try:
             data = collections.OrderedDict()
@@ -299,20 +349,24 @@ class PoeCLI(object):
         except Exception as e:
             print_stderr("Failed to show poe versions! (%s)" % str(e))
 
-    @PoeAccessExclusiveLock
+    @PoeBulkAccess
     def show_system_information(self, debug, json):
         try:
             data = collections.OrderedDict()
             data[SYS_INFO] = self.get_system_running_state()
+            if debug:
+                data[BUS_STATS] = self.get_bus_stats()
             if json:
                 self.json_output(data)
             else:
                 self.print_system_information(data[SYS_INFO], debug)
+                if debug:
+                    self.print_bus_stats(data[BUS_STATS])
         except Exception as e:
             print_stderr(
                 "Failed to show poe system information! (%s)" % str(e))
 
-    @PoeAccessExclusiveLock
+    @PoeBulkAccess
     def show_ports_information(self, portList, debug, json):
         try:
             data = collections.OrderedDict()
@@ -325,7 +379,98 @@ class PoeCLI(object):
             print_stderr(
                 "Failed to show poe ports information! (%s)" % str(e))
 
-    @PoeAccessExclusiveLock
+    # Ask poed to publish its port information until the next refresh
+    def request_ports_info(self, interval):
+        until = time.time() + interval + POED_PORTS_WATCH_GRACE
+        try:
+            with open(POED_PORTS_WATCH_PATH, 'a'):
+                os.utime(POED_PORTS_WATCH_PATH, (until, until))
+        except OSError as e:
+            print_stderr("Fail to touch: " + POED_PORTS_WATCH_PATH + ",err: " + str(e))
+
+    # (ports information, publish time) from poed, None when not fresh
+    def read_ports_info(self, portList):
+        try:
+            with open(POED_PORTS_CACHE_PATH, 'r') as f:
+                data = json.loads(f.read())
+            if time.time() - data[POED_STATE_TIME] > POED_PORTS_CACHE_INTVL * 5:
+                return None
+            ports_info = data[PORT_INFO]
+            return ([ports_info[port] for port in portList],
+                    data[POED_STATE_TIME])
+        except Exception:
+            return None
+
+    # Port information from poed when it is running, else read from the
+    # chip. Returns the ports information and the publish time (None when
+    # read from the chip). first: poed may not be publishing yet, give it
+    # one publish interval.
+    def get_watch_ports_info(self, portList, interval, first=False):
+        if self.is_poed_alive():
+            self.request_ports_info(interval)
+            result = self.read_ports_info(portList)
+            deadline = time.time() + POED_PORTS_CACHE_INTVL + 1
+            while result is None and first and time.time() < deadline:
+                time.sleep(0.2)
+                result = self.read_ports_info(portList)
+            if result is not None:
+                return result
+        return self.read_chip_ports_information(portList), None
+
+    # One --watch refresh read from the chip, the watch loop itself must
+    # not hold the POE access lock
+    @PoeBulkAccess
+    def read_chip_ports_information(self, portList):
+        return self.get_ports_running_state(portList)
+
+    # Refresh the ports information every interval in place: only the rows
+    # that changed are rewritten, with the changed cells highlighted until
+    # the next refresh. Without a terminal, the changed rows are printed.
+    def watch_ports_information(self, portList, debug, interval):
+        tty = sys.stdout.isatty()
+        prev = None
+        marked = [False] * len(portList)
+        try:
+            while True:
+                ports_info, cache_time = self.get_watch_ports_info(
+                    portList, interval, prev is None)
+                if cache_time is None:
+                    title = "Every {0}s, from the PoE chip: {1}".format(
+                        interval, self.get_current_time())
+                else:
+                    title = "Every {0}s, from poed: {1}".format(
+                        interval, time.strftime(self.TIME_FMT,
+                                                time.localtime(cache_time)))
+                if prev is None:
+                    print(title)
+                    self.print_ports_information(ports_info, debug)
+                else:
+                    changes = [set(key for key in info if info.get(key) != old.get(key))
+                               for info, old in zip(ports_info, prev)]
+                    if tty:
+                        # Back to the title line, skip the blank and header lines
+                        output = ["\033[{0}A\r\033[2K".format(len(ports_info) + 5),
+                                  title, "\n\n\n\n"]
+                        for idx, info in enumerate(ports_info):
+                            if len(changes[idx]) > 0 or marked[idx]:
+                                output.append("\033[2K" + self.format_port_row(
+                                    info, debug, changes[idx]))
+                            marked[idx] = len(changes[idx]) > 0
+                            output.append("\n")
+                        output.append("\n")
+                        sys.stdout.write("".join(output))
+                    elif any(len(fields) > 0 for fields in changes):
+                        print(title)
+                        for idx, info in enumerate(ports_info):
+                            if len(changes[idx]) > 0:
+                                print(self.format_port_row(info, debug))
+                    sys.stdout.flush()
+                prev = ports_info
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+    @PoeBulkAccess
     def show_individual_masks(self, json):
         try:
             data = collections.OrderedDict()
@@ -337,7 +482,7 @@ class PoeCLI(object):
         except Exception as e:
             print_stderr("Failed to show individual masks! (%s)" % str(e))
 
-    @PoeAccessExclusiveLock
+    @PoeBulkAccess
     def show_all_information(self, debug, json):
         try:
             portList = list(range(self.poe_plat.total_poe_port()))
@@ -346,6 +491,8 @@ class PoeCLI(object):
             data[SYS_INFO] = self.get_system_running_state()
             data[PORT_INFO] = self.get_ports_running_state(portList)
             data[INDV_MASKS] = self.get_individual_masks()
+            if debug:
+                data[BUS_STATS] = self.get_bus_stats()
             if json:
                 self.json_output(data)
             else:
@@ -353,47 +500,41 @@ class PoeCLI(object):
                 self.print_system_information(data[SYS_INFO], debug)
                 self.print_ports_information(data[PORT_INFO], debug)
                 self.print_indv_masks(data[INDV_MASKS])
+                if debug:
+                    self.print_bus_stats(data[BUS_STATS])
         except Exception as e:
             print_stderr("Failed to show all information! (%s)" % str(e))
 
+    # Apply all requested settings of all ports under one lock, in one
+    # verified batch
     @PoeAccessExclusiveLock
-    def set_ports_enDis(self, portList, val):
+    def set_ports_params(self, portList, enDis=None, priority=None,
+                         powerLimit=None):
         try:
+            changes = []
             for port_id in portList:
-                poe_port = self.poe_plat.get_poe_port(port_id)
-                poe_port.set_enDis(val)
-            return True
+                if enDis is not None:
+                    changes.append((port_id, ENDIS, enDis))
+                if priority is not None:
+                    changes.append((port_id, PRIORITY, priority))
+                if powerLimit is not None:
+                    changes.append((port_id, POWER_LIMIT, powerLimit))
+            failures = [item for item in self.poe_plat.set_ports_params(changes)
+                        if item[CMD_RESULT_RET] != 0]
+            for item in failures:
+                print_stderr("Failed to set port {0} {1} to {2}! (ret: {3}, read back: {4})".format(
+                    str(item["idx"] + 1), item["field"], str(item["value"]),
+                    str(item[CMD_RESULT_RET]), str(item.get("readback"))))
+            return len(failures) < len(changes)
         except Exception as e:
-            print_stderr(
-                "Failed to set ports enable/disable! (%s)" % str(e))
-        return False
-
-    @PoeAccessExclusiveLock
-    def set_ports_powerLimit(self, portList, val):
-        try:
-            for port_id in portList:
-                poe_port = self.poe_plat.get_poe_port(port_id)
-                poe_port.set_powerLimit(val)
-            return True
-        except Exception as e:
-            print_stderr("Failed to set ports power limit! (%s)" % str(e))
-        return False
-
-    @PoeAccessExclusiveLock
-    def set_ports_priority(self, portList, val):
-        try:
-            for port_id in portList:
-                poe_port = self.poe_plat.get_poe_port(port_id)
-                poe_port.set_priority(val)
-            return True
-        except Exception as e:
-            print_stderr("Failed to set ports priority! (%s)" % str(e))
+            print_stderr("Failed to set ports parameters! (%s)" % str(e))
         return False
 
     @PoeAccessExclusiveLock
     def save_system_settings(self):
         try:
-            self.poe_plat.save_system_settings()
+            with self.poe_plat.bus_priority(BUS_PRIO_CONTROL):
+                self.poe_plat.save_system_settings()
         except Exception as e:
             print_stderr(
                 "Failed to save poe system settings! (%s)" % str(e))
@@ -401,15 +542,16 @@ class PoeCLI(object):
     @PoeAccessExclusiveLock
     def restore_factory_default(self):
         try:
-            self.poe_plat.restore_factory_default()
-            self.poe_plat.init_poe()
+            with self.poe_plat.bus_priority(BUS_PRIO_CONTROL):
+                self.poe_plat.restore_factory_default()
+                self.poe_plat.init_poe()
             print("Success to restore factory default and take platform poe settings!")
         except Exception as e:
             print_stderr(
                 "Failed to restore factory default! (%s)" % str(e))
 
     def get_current_time(self):
-        return datetime.now().strftime(self.TIME_FMT)
+        return time.strftime(self.TIME_FMT)
 
     def is_poed_alive(self):
         try:
@@ -434,23 +576,37 @@ def main(argv):
         print_stderr("Failed to load poe platform! (%s)" % str(e))
         os._exit(-9)
 
-    if wait_poed_busy() == False:
-        # POED is busy within 5s, BusyID=248
-        os._exit(-8)
-
     parser = poecli._build_parser()
     args = parser.parse_args()
     cfg_action=""
     set_flag = False
     poed_alive = poecli.is_poed_alive()
+    if args.subcmd in ["set", "savechip", "restore_poe_system", "cfg"]:
+        # Wait for poed to finish restoring the chip before changing it
+        if wait_poed_bringup() == False:
+            # POED is busy within 5s, BusyID=248
+            os._exit(-8)
+    elif args.subcmd == "show" and poed_alive and is_poed_bringup():
+        print_stderr(poed_bringup_progress(load_poed_state()) +
+                     ", port settings may not be restored yet")
     if args.subcmd == "show":
+        if poed_alive:
+            poecli.poe_plat.published_system_status = poecli.load_poed_system_status
         if (args.ports is None and args.system is False and \
             args.all is False and args.mask is False and args.version is False):
             parser.error("No action requested for %s command" % args.subcmd)
 
         debug_flag = args.debug
         json_flag = args.json
-        if args.ports:
+        if args.watch is not None and (args.ports is None or json_flag or
+                                       args.watch <= 0):
+            parser.error("--watch needs -p, a positive interval and no --json")
+        if debug_flag:
+            print_stderr("Startup: imports {0:.1f} ms, platform load {1:.1f} ms".format(
+                poecli.import_time * 1000, poecli.plat_load_time * 1000))
+        if args.ports and args.watch is not None:
+            poecli.watch_ports_information(args.ports, debug_flag, args.watch)
+        elif args.ports:
             poecli.show_ports_information(args.ports, debug_flag, json_flag)
         elif args.system:
             poecli.show_system_information(debug_flag, json_flag)
@@ -463,12 +619,8 @@ def main(argv):
     elif args.subcmd == "set":
         if (args.enable is None and args.level is None and args.powerLimit is None):
             parser.error("No action requested for %s command" % args.subcmd)
-        if args.enable is not None:
-            set_flag |= poecli.set_ports_enDis(args.ports, args.enable)
-        if args.level is not None:
-            set_flag |= poecli.set_ports_priority(args.ports, args.level)
-        if args.powerLimit is not None:
-            set_flag |= poecli.set_ports_powerLimit(args.ports, args.powerLimit)
+        set_flag = poecli.set_ports_params(args.ports, args.enable,
+                                           args.level, args.powerLimit)
 
     elif args.subcmd == "guide":
         try:
@@ -492,6 +644,10 @@ def main(argv):
                 cfg_action += POED_LOAD_ACTION+","
                 if args.config is not None:
                     cfg_action += args.config+","
+            elif args.desired:
+                cfg_action += POED_DESIRED_ACTION+","
+                if args.config is not None:
+                    cfg_action += os.path.abspath(args.config)+","
             cfg_action = "".join(cfg_action.rsplit(",", 1))
             print("cfg_action: {0}".format(cfg_action))
         else:
@@ -13,11 +13,19 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 '''
+import time
+# Start of the poed startup, reported once the platform is loaded
+startup_begin = time.time()
+
 from datetime import datetime, date
 from collections import OrderedDict
 from shutil import copyfile
 from poe_common import *
 from poe_version import *
+from poe_telemetry import PoeTelemetry
+from poe_metrics import *
+from poe_registry import PoePlatformRegistry
+from poe_profiler import PoeSampler, diff_bus_stats
 
 from pathlib import Path
 import os
@@ -25,14 +33,10 @@ import sys
 import errno
 import threading
 import signal
-import imp
-import time
 import json
 import fcntl
-import binascii
 import traceback
 
-bootcmd_path   = "/proc/cmdline"
 pa_root_path   = os.getcwd() + "/../"
 plat_root_path = pa_root_path + "platforms"
 
@@ -104,6 +108,17 @@ class PoeConfig(object):
         return result_is_valid_gen_info and result_is_valid_timestamp
 
 
+    # Load once and validate, None when missing or invalid
+    def load_valid(self):
+        try:
+            if self.is_exist():
+                data = self.load()
+                if data is not None and self.is_valid_data(data):
+                    return data
+        except Exception:
+            pass
+        return None
+
     def is_valid(self):
         result_is_exist = self.is_exist()
         result_is_valid_data = False
@@ -130,18 +145,167 @@ class PoeConfig(object):
         except Exception as e:
             raise RuntimeError("Load json failed: {0}".format(str(e)))
 
+# Change detection for the autosave routine: the events latched by the chip
+# are read with one request, the platform PSU presence hook without the PoE
+# bus. Full reads are only due when an event is signalled, or every
+# full_read_intvl seconds to catch events consumed by other readers (e.g. a
+# poecli show reading the system status also clears the interrupt register).
+# Once the event thread polls the chip, check() only takes the events it
+# accumulated, so the latched register has a single reader.
+class PoeEventMonitor(object):
+    def __init__(self, poe_plat, full_read_intvl=30):
+        self.poe_plat = poe_plat
+        self.full_read_intvl = full_read_intvl
+        self.last_full_read = 0
+        self.last_psu_presence = None
+        self.lock = threading.Lock()
+        self.polled = False
+        self.pending = None
+        self.published_status = None
+
+    def no_events(self):
+        events = OrderedDict()
+        events[EVENT_PORT] = False
+        events[EVENT_SYSTEM] = False
+        events[EVENT_POWER] = False
+        events[CHIP_EVENTS] = 0
+        return events
+
+    def poll(self):
+        events = self.poe_plat.poll_chip_events()
+        self.publish_system_status()
+        with self.lock:
+            self.polled = True
+            if self.pending is None:
+                self.pending = self.no_events()
+            for name in (EVENT_PORT, EVENT_SYSTEM, EVENT_POWER):
+                self.pending[name] = self.pending[name] or events[name]
+            self.pending[CHIP_EVENTS] |= events[CHIP_EVENTS]
+        return events
+
+    def check(self):
+        with self.lock:
+            polled = self.polled
+            events = self.pending
+            self.pending = None
+        if polled == False:
+            events = self.poe_plat.poll_chip_events()
+            self.publish_system_status()
+        elif events is None:
+            events = self.no_events()
+        psu_presence = self.poe_plat.get_psu_presence()
+        if psu_presence != self.last_psu_presence:
+            self.last_psu_presence = psu_presence
+            events[EVENT_POWER] = True
+        if time.time() - self.last_full_read >= self.full_read_intvl:
+            events[EVENT_SYSTEM] = True
+            events[EVENT_POWER] = True
+        if events[EVENT_SYSTEM] or events[EVENT_POWER]:
+            self.last_full_read = time.time()
+        return events
+
+    # The system status read along with the events, for poecli which must
+    # not read (and clear) the latched events itself
+    def publish_system_status(self):
+        status = self.poe_plat.last_system_status
+        if status is None or status == self.published_status:
+            return
+        try:
+            tmp_path = POED_SYSTEM_STATUS_PATH + ".tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(status, indent = 4))
+            os.replace(tmp_path, POED_SYSTEM_STATUS_PATH)
+            self.published_status = status
+        except Exception as e:
+            print_stderr_limited("Failed to publish system status", err=str(e))
+
+# One polled data class. A sweep over the items is spread over the ticks of
+# its interval, at most budget items per tick, the next sweep starts one
+# interval after the previous one. interval 0: refreshed on demand only.
+# A sweep on demand (see request()) starts at the next tick and is not
+# spread, it runs at the budget.
+class PoePollTask(object):
+    def __init__(self, name, interval, budget, items, func):
+        self.name = name
+        self.interval = interval
+        self.budget = budget
+        self.items = items
+        self.func = func
+        self.cursor = 0
+        self.next_sweep = 0
+        self.demand = False
+        self.demanded = False
+        self.sweeps = 0
+        self.sweep_start = 0
+        # Wall time of the last completed sweep
+        self.sweep_duration = None
+
+    def chunk_size(self, tick):
+        if self.interval <= tick or self.demanded:
+            size = len(self.items)
+        else:
+            # ceil(items * tick / interval)
+            size = -(-len(self.items) * tick // self.interval)
+        return max(1, min(size, self.budget))
+
+    def due_items(self, now, tick):
+        if self.demand:
+            # Requested in the middle of a sweep: start over
+            self.cursor = 0
+        if self.cursor == 0:
+            if self.demand == False and \
+                    (self.interval == 0 or now < self.next_sweep):
+                return []
+            self.demanded = self.demand
+            self.demand = False
+            self.next_sweep = now + self.interval
+            self.sweep_start = time.time()
+        chunk = self.items[self.cursor:self.cursor + self.chunk_size(tick)]
+        self.cursor += len(chunk)
+        if self.cursor >= len(self.items):
+            self.cursor = 0
+            self.sweeps += 1
+        return chunk
+
+class PoePollScheduler(object):
+    def __init__(self, tick=1):
+        self.tick = tick
+        self.tasks = OrderedDict()
+
+    def add_task(self, name, interval, budget, items, func):
+        self.tasks[name] = PoePollTask(name, interval, budget, items, func)
+
+    def request(self, name):
+        self.tasks[name].demand = True
+
+    def run_tick(self, now=None):
+        if now is None:
+            now = time.time()
+        for task in self.tasks.values():
+            chunk = task.due_items(now, self.tick)
+            if len(chunk) > 0:
+                task.func(chunk)
+                if task.cursor == 0:
+                    task.sweep_duration = time.time() - task.sweep_start
+
 class PoeAgent(object):
     UNIX_START_TIME = "1970/01/01 0:0:0"
 
     def __init__(self):
-        self.log = PoeLog()
+        self.log = PoeLog(buffered=True)
+        self.plat_registry = PoePlatformRegistry(plat_root_path)
         self.plat_name = self.platform_model()
+        import_time = time.time() - startup_begin
+        plat_begin = time.time()
         self.poe_plat = self.load_poe_plat()
+        self.log.info("Startup: imports {0:.1f} ms, platform load {1:.1f} ms".format(
+            import_time * 1000, (time.time() - plat_begin) * 1000))
         self.plat_supported = self.is_valid_plat(self.poe_plat)
         self.poe_agent_state = PoeAgentState.CLEAN_START
 
         self.system_state = None
         self.all_port_state = None
+        self.event_monitor = PoeEventMonitor(self.poe_plat)
         self.last_cfg_save_time = self.UNIX_START_TIME
         self.prev_poe_set_time = self.UNIX_START_TIME
         self.last_poe_set_time = self.UNIX_START_TIME
@@ -161,31 +325,70 @@ class PoeAgent(object):
         self.autosave_thread = threading.Thread(target=self.autosave_main)
         self.failsafe_flag=False
 
-    # Get platform model from boot cmd
-    def platform_model(self, file_path=bootcmd_path):
+        self.bringup_stages = ["init_poe", "load_cfg", "autosave"]
+        self.bringup_start = time.time()
+        self.bringup_lock_fd = None
+        self.prepared_cfg = (None, None)
+
+        # Desired-state reconciler: desired port settings ({port_id: cfg
+        # params}) and the cached chip state they are compared with
+        self.desired_ports = None
+        self.actual_ports_state = None
+        self.actual_state_gen = 0
+        self.actual_state_time = 0
+        self.reconcile_lock = threading.Lock()
+        self.reconcile_event = threading.Event()
+        self.reconcile_check_intvl = 5
+        self.reconcile_refresh_intvl = 30
+        self.reconcile_debounce = 0.2
+        self.reconcile_min_intvl = 1
+        self.last_reconcile = 0
+        self.reconcile_thread = threading.Thread(target=self.reconcile_main)
+
+        # Port events: status byte of every port and the information of
+        # the ports whose status changed, {port_id: port info}
+        self.event_tick = 1
+        self.event_irq_timeout = 5
+        self.ports_status = None
+        self.event_thread = threading.Thread(target=self.event_main)
+
+        # Long-lived port objects refreshed by the event and poll threads
+        self.poe_ports = OrderedDict()
+        self.versions = None
+        self.poll_thread = threading.Thread(target=self.poll_main)
+        self.poll_scheduler = PoePollScheduler(tick=1)
+        # Power telemetry history of every port, one sample per power poll:
+        # 720 samples = 1 hour at the 5s refresh rate
+        self.telemetry_capacity = 720
+        self.telemetry = None
+        # Window of the port power statistics in the metrics: 5 minutes
+        self.telemetry_window = 300
+        # Metrics export of the cached state, never reads the chip
+        self.metrics_intvl = 15
+        # Port information file for "poecli show --watch" is written
+        self.ports_info_published = False
+        # Sampling profiler, SIGUSR1 starts it and SIGUSR2 dumps it to /run
+        self.profiler = PoeSampler(on_timeout=self.dump_profile)
+        self.profile_bus_stats = None
+        if self.plat_supported:
+            for port_id in range(self.poe_plat.total_poe_port()):
+                self.poe_ports[port_id] = self.poe_plat.get_poe_port(port_id)
+            self.telemetry = PoeTelemetry(self.poe_ports.keys(),
+                                          self.telemetry_capacity)
+            self.add_poll_tasks()
+
+    # Get platform model from the platform registry
+    def platform_model(self):
         try:
-            with open(file_path, 'r') as f:
-                d = dict(i.split('=') for i in f.read().split(' '))
-                return d.get("onl_platform").rstrip()
+            return self.plat_registry.platform_model()
         except Exception as e:
             self.log.alert("Failed to get model name. err: %s" % str(e))
             return "Unknown"
 
-    def platform_src_path(self):
-        try:
-            # dentOS platform format: <arch>-<manufacturer>-<model>-<revision>
-            [arch, manufacturer, model_revision] = self.plat_name.split('-', 2)
-            return "/".join([plat_root_path, manufacturer,
-                             model_revision, "poe_platform.py"])
-        except Exception as e:
-            self.log.alert("Failed to get platform path. err: %s" % str(e))
-            return ""
-
     def load_poe_plat(self):
         poe_plat = None
         try:
-            plat_src = imp.load_source("poe_plat", self.platform_src_path())
-            poe_plat = plat_src.get_poe_platform()
+            poe_plat = self.plat_registry.load_platform()
         except Exception as e:
             self.log.alert("Failed to load PoE platform. err: %s" % str(e))
         return poe_plat
@@ -207,15 +410,17 @@ class PoeAgent(object):
             self.log.err("Failed to get system power bank: %s" % str(e))
             return None
 
-    def have_psu_event(self):
+    def have_psu_event(self, events):
+        if events[EVENT_POWER] == False:
+            return False
         cur_power_bank = self.get_system_power_bank()
         if self.last_power_bank != cur_power_bank:
             self.last_power_bank = cur_power_bank
             return True
         return False
 
-    def is_state_changes(self):
-        return self.have_set_event() or self.have_psu_event()
+    def is_state_changes(self, events):
+        return self.have_set_event() or self.have_psu_event(events)
 
     def get_system_running_state(self):
         try:
@@ -237,8 +442,14 @@ class PoeAgent(object):
         result = dict({})
         all_result=None
         try:
+            # Before init_poe trusts the static cache of a previous firmware
+            self.versions = self.poe_plat.check_firmware_version()
             result = self.poe_plat.init_poe(cfg_data)
             all_result = check_init_plat_ret_result(result)
+            if INIT_SKIPPED in result:
+                self.log.info(
+                    "init_poe skipped (already on chip): {0}".format(
+                        json.dumps(result[INIT_SKIPPED])))
             if all_result[1] == 0:
                 self.log.info(
                     "init_poe all_result: {0}".format(str(all_result[1])))
@@ -278,9 +489,13 @@ class PoeAgent(object):
     @PoeAccessExclusiveLock
     def collect_running_state(self):
         try:
-            if self.is_state_changes() == True:
+            events = self.event_monitor.check()
+            if self.is_state_changes(events) == True:
                 self.all_port_state = self.get_ports_running_state()
-            self.system_state = self.get_system_running_state()
+                events[EVENT_SYSTEM] = True
+            if events[EVENT_SYSTEM] or events[EVENT_POWER] or \
+                    self.system_state is None:
+                self.system_state = self.get_system_running_state()
 
             cur_state = OrderedDict()
             cur_state[GEN_INFO] = self.collect_general_info()
@@ -307,6 +522,56 @@ class PoeAgent(object):
         return False
 
 
+    # SIGUSR1 handler
+    def start_profiling(self, sig=None, frame=None):
+        if self.profiler.start():
+            if self.plat_supported:
+                self.profile_bus_stats = self.poe_plat.get_bus_stats()
+            self.log.info("Profiling started", interval=self.profiler.interval,
+                          max_time=self.profiler.max_time)
+
+    # SIGUSR2 handler
+    def stop_profiling(self, sig=None, frame=None):
+        if self.profiler.stop():
+            self.dump_profile()
+
+    # Collapsed stacks of all threads and the bus time per driver command
+    # since start_profiling
+    def dump_profile(self):
+        try:
+            summary = OrderedDict()
+            summary[PROFILE_START] = self.profiler.start_time
+            summary[PROFILE_DURATION] = round(
+                self.profiler.stop_time - self.profiler.start_time, 3)
+            summary[PROFILE_INTVL] = self.profiler.interval
+            summary[PROFILE_SAMPLES] = self.profiler.samples
+            if self.profile_bus_stats is not None:
+                summary[BUS_STAT_COMMANDS] = diff_bus_stats(
+                    self.profile_bus_stats, self.poe_plat.get_bus_stats())
+            for path, text in ((POED_PROFILE_STACKS_PATH, self.profiler.collapsed()),
+                               (POED_PROFILE_SUMMARY_PATH, json.dumps(summary, indent = 4))):
+                tmp_path = path + ".tmp"
+                with open(tmp_path, 'w') as f:
+                    f.write(text)
+                os.replace(tmp_path, path)
+            self.log.info("Profile saved", samples=self.profiler.samples,
+                          stacks=POED_PROFILE_STACKS_PATH,
+                          summary=POED_PROFILE_SUMMARY_PATH)
+        except Exception as e:
+            self.log.err("Failed to save profile", err=str(e))
+        self.profile_bus_stats = None
+
+    def save_bus_stats(self):
+        try:
+            tmp_path = POED_BUS_STATS_PATH + ".tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(self.poe_plat.get_bus_stats(), indent = 4))
+            os.replace(tmp_path, POED_BUS_STATS_PATH)
+            return True
+        except Exception as e:
+            self.log.err("Failed to save bus statistics: %s" % str(e))
+        return False
+
     def save_curerent_runtime(self):
         if self.runtime_cfg.is_valid():
             copyfile(self.runtime_cfg.path(),
@@ -331,38 +596,51 @@ class PoeAgent(object):
                         self.log.warn(
                             "POE Agent in failsafe mode, stop saving runtime cfg")
                         self.rt_counter = 0
+                    self.save_bus_stats()
 
                 self.rt_counter += self.autosave_intvl
                 time.sleep(self.autosave_intvl)
             except Exception as e:
                 self.fail_counter += 1
-                self.log.err("An exception in autosave routine: %s, cnt: %d" %
-                             (str(e), self.fail_counter))
+                self.log.err("An exception in autosave routine",
+                             err=str(e), cnt=self.fail_counter)
                 time.sleep(1)
 
     @PoeAccessExclusiveLock
-    def flush_settings_to_chip(self, poe_cfg):
+    def flush_settings_to_chip(self, poe_cfg, data=None):
         try:
-            # Read all port enDis status
-            all_port_endis = self.poe_plat.get_all_ports_enDis()
             ret_result = True
-            data = poe_cfg.load()
+            if data is None:
+                data = poe_cfg.load()
             all_port_configs = data[PORT_CONFIGS]
             last_save_time = data[TIMESTAMP][LAST_SAVE_TIME]
+            wanted = OrderedDict()
             for params in all_port_configs:
-                port_id = params.get(PORT_ID) - 1
-                poe_port = self.poe_plat.get_poe_port(port_id)
-                set_result = poe_port.set_all_params(
-                    params,  current_enDis=all_port_endis)
-                if (set_result[ENDIS] != 0
-                        or set_result[PRIORITY] != 0
-                        or (self.poe_plat._4wire_bt == 0 and set_result[POWER_LIMIT] != 0)):
-                    self.log.warn("Port[{0}] setting failed: {1}".format(
-                        str(params.get(PORT_ID)), json.dumps(set_result)))
-                    ret_result=False
+                wanted[params.get(PORT_ID) - 1] = params
+
+            # Snapshot enable/priority/power limit of all ports in one bulk
+            # read and only send the settings that differ
+            ports_state = self.poe_plat.get_ports_state(list(wanted.keys()))
+            changes = self.poe_plat.diff_ports_state(wanted, ports_state)
+            results = self.poe_plat.apply_port_changes(changes)
+            set_failed = OrderedDict()
+            for (port_id, field, set_val), result in zip(changes, results):
+                if result != 0:
+                    set_failed.setdefault(port_id, dict({}))[field] = result
+            if len(set_failed) > 0:
+                self.log.warn("Port setting failed",
+                              ports=",".join(str(port_id + 1) for port_id in set_failed),
+                              result=json.dumps(OrderedDict(
+                                  (port_id + 1, failed) for port_id, failed in set_failed.items())))
+                ret_result=False
+            self.log.info("Flush settings to chip: {0} changed, {1} of {2} ports untouched".format(
+                str(len(changes)),
+                str(len(wanted) - len(set(change[0] for change in changes))),
+                str(len(wanted))))
 
             self.all_port_state = all_port_configs
-            self.last_poe_set_time = self.get_current_time()
+            if len(changes) > 0:
+                self.last_poe_set_time = self.get_current_time()
             self.last_cfg_save_time = last_save_time
             return ret_result
         except Exception as e:
@@ -381,20 +659,382 @@ class PoeAgent(object):
             return False
 
 
+    def set_desired_state(self, file=None):
+        if file is None:
+            with self.reconcile_lock:
+                self.desired_ports = None
+            remove_file(POED_DESIRED_CFG_PATH)
+            self.log.info("Desired state cleared, stop reconciling")
+            return True
+        try:
+            with open(file, 'r') as f:
+                data = json.loads(f.read())
+            desired = self.poe_plat.ports_cfg_to_wanted(data[PORT_CONFIGS])
+            if file != POED_DESIRED_CFG_PATH:
+                copyfile(file, POED_DESIRED_CFG_PATH)
+        except Exception as e:
+            self.log.err("Invalid desired state \"%s\": %s" % (file, str(e)))
+            return False
+        with self.reconcile_lock:
+            self.desired_ports = desired
+        self.log.info("Reconcile {0} ports to the desired state from \"{1}\"".format(
+            str(len(desired)), file))
+        self.request_reconcile()
+        return True
+
+    # invalidate: the chip was changed outside the reconciler, re-read it
+    def request_reconcile(self, invalidate=False):
+        if invalidate:
+            with self.reconcile_lock:
+                self.actual_ports_state = None
+                self.actual_state_gen += 1
+        self.reconcile_event.set()
+
+    @PoeAccessExclusiveLock
+    def reconcile(self):
+        with self.reconcile_lock:
+            desired = self.desired_ports
+            actual = self.actual_ports_state
+            gen = self.actual_state_gen
+        if desired is None:
+            return 0
+        if actual is None or \
+                time.time() - self.actual_state_time >= self.reconcile_refresh_intvl:
+            actual = self.poe_plat.get_ports_state(
+                list(range(self.poe_plat.total_poe_port())))
+            self.actual_state_time = time.time()
+        changes = self.poe_plat.diff_ports_state(desired, actual)
+        if len(changes) > 0:
+            failed = []
+            for item in self.poe_plat.set_ports_params(changes):
+                if "readback" in item:
+                    actual[item["idx"]][item["field"]] = item["readback"]
+                if item[CMD_RESULT_RET] != 0:
+                    failed.append(item)
+            if len(failed) > 0:
+                self.log.warn("Reconcile port failed",
+                              ports=",".join(str(item["idx"] + 1) for item in failed),
+                              result=json.dumps(failed))
+            self.update_set_time()
+            self.log.info("Reconciled {0} settings ({1} failed)".format(
+                str(len(changes)), str(len(failed))))
+        with self.reconcile_lock:
+            if gen == self.actual_state_gen:
+                self.actual_ports_state = actual
+        return len(changes)
+
+    def reconcile_main(self):
+        global thread_flag
+        self.log.info("Start reconcile thread")
+        while thread_flag is True:
+            try:
+                self.reconcile_event.wait(self.reconcile_check_intvl)
+                if self.desired_ports is None or self.failsafe_flag == True:
+                    self.reconcile_event.clear()
+                    continue
+                # Coalesce a burst of requests into one apply cycle
+                while self.reconcile_event.is_set():
+                    self.reconcile_event.clear()
+                    time.sleep(self.reconcile_debounce)
+                # Rate limit apply cycles
+                wait_time = self.last_reconcile + self.reconcile_min_intvl - time.time()
+                if wait_time > 0:
+                    time.sleep(wait_time)
+                self.last_reconcile = time.time()
+                self.reconcile()
+            except Exception as e:
+                self.log.err("An exception in reconcile routine", err=str(e))
+                time.sleep(1)
+
+    @PoeAccessExclusiveLock
+    def init_chip_events(self):
+        result = self.poe_plat.init_interrupt_mask()
+        if result is not None:
+            self.log.info("Program interrupt mask, result: {0}".format(str(result)))
+        return True
+
+    # Read the events latched by the chip, on port events find the ports
+    # whose status changed with a bulk status read and only fetch those
+    @PoeAccessExclusiveLock
+    def handle_chip_events(self):
+        events = self.event_monitor.poll()
+        if events[EVENT_PORT] == False and self.ports_status is not None:
+            return []
+        all_status = self.poe_plat.get_all_ports_status()
+        if self.ports_status is None:
+            changed = list(range(len(all_status)))
+        else:
+            changed = [port_id for port_id in range(len(all_status))
+                       if all_status[port_id] != self.ports_status[port_id]]
+            if len(changed) > 0:
+                self.log.info("Port status changed: {0}".format(", ".join(
+                    "{0} (0x{1:02x} -> 0x{2:02x})".format(
+                        port_id + 1, self.ports_status[port_id], all_status[port_id])
+                    for port_id in changed)))
+        self.ports_status = all_status
+        if len(changed) > 0:
+            self.poe_plat.update_ports([self.poe_ports[port_id]
+                                        for port_id in changed])
+        return changed
+
+    def get_cached_ports_info(self, more_info=True):
+        return [port.current_status(more_info) for port in self.poe_ports.values()]
+
+    # Data classes and their refresh interval (s) and budget (items per
+    # tick). The chip takes ~30ms per request, a full sweep of 48 ports is
+    # spread over the interval to keep the bus mostly idle.
+    def add_poll_tasks(self):
+        port_ids = list(self.poe_ports.keys())
+        self.poll_scheduler.add_task("power", 5, 12, port_ids,
+                                     self.poll_ports_measurement)
+        self.poll_scheduler.add_task("system_power", 5, 1, [None],
+                                     self.poll_system_power)
+        self.poll_scheduler.add_task("config", 60, 12, port_ids,
+                                     self.poll_ports_config)
+        self.poll_scheduler.add_task("versions", 0, 1, [None],
+                                     self.poll_versions)
+        self.poll_scheduler.add_task("metrics", self.metrics_intvl, 1, [None],
+                                     self.export_metrics)
+        self.poll_scheduler.add_task("ports_cache", POED_PORTS_CACHE_INTVL, 1,
+                                     [None], self.publish_ports_info)
+
+    @PoeAccessExclusiveLock
+    def poll_ports_measurement(self, port_ids):
+        self.poe_plat.update_ports([self.poe_ports[port_id] for port_id in port_ids],
+                                   PORT_DATA_MEASUREMENT)
+        now = time.time()
+        for port_id in port_ids:
+            (power, voltage, current, status) = \
+                self.poe_ports[port_id].telemetry_sample()
+            self.telemetry.add(port_id, now, power, voltage, current, status)
+
+    @PoeAccessExclusiveLock
+    def poll_ports_config(self, port_ids):
+        self.poe_plat.update_ports([self.poe_ports[port_id] for port_id in port_ids],
+                                   PORT_DATA_CONFIG)
+
+    @PoeAccessExclusiveLock
+    def poll_system_power(self, items):
+        params = self.poe_plat.get_power_supply_params()
+        # Swap in a copy, autosave may be serializing the current one
+        system_state = self.system_state
+        if system_state is not None:
+            system_state = OrderedDict(system_state)
+            system_state[POWER_CONSUMP] = params.get(POWER_CONSUMP)
+            system_state[POWER_AVAIL] = system_state[TOTAL_POWER] - \
+                params.get(POWER_CONSUMP)
+            self.system_state = system_state
+
+    @PoeAccessExclusiveLock
+    def poll_versions(self, items):
+        # Read from the chip once per start by check_firmware_version()
+        self.versions = self.poe_plat.get_poe_versions()
+
+    # Build the metrics text from the port objects, system state, bus
+    # statistics and poll tasks kept by poed. Runs in the poll thread, the
+    # one updating the port objects.
+    def collect_metrics(self):
+        metrics = PoeMetrics()
+        metrics.family("poe_agent", METRIC_INFO, "PoE agent version and platform")
+        metrics.add("poe_agent", 1, OrderedDict([
+            ("version", POE_AGENT_VERSION), ("platform", self.plat_name),
+            ("firmware", self.versions or "")]))
+        metrics.family("poe_agent_failsafe", METRIC_GAUGE,
+                       "1 when all ports were disabled by the fail safe mode")
+        metrics.add("poe_agent_failsafe", self.failsafe_flag)
+        metrics.family("poe_agent_uptime_seconds", METRIC_GAUGE,
+                       "Time since poed started")
+        metrics.add("poe_agent_uptime_seconds",
+                    round(time.time() - self.bringup_start, 3))
+
+        metrics.family("poe_port", METRIC_INFO, "Port state")
+        for name, help_text in (
+                ("poe_port_enabled", "1 when the port is enabled"),
+                ("poe_port_status_code", "Raw port status code of the chip"),
+                ("poe_port_class", "Detected PD class"),
+                ("poe_port_power_watts", "Port power consumption"),
+                ("poe_port_power_limit_watts", "Port power limit"),
+                ("poe_port_voltage_volts", "Port voltage"),
+                ("poe_port_current_amperes", "Port current"),
+                ("poe_port_power_avg_watts",
+                 "Average port power over the telemetry window"),
+                ("poe_port_power_max_watts",
+                 "Peak port power over the telemetry window")):
+            metrics.family(name, METRIC_GAUGE, help_text)
+        now = time.time()
+        for port_id, port in self.poe_ports.items():
+            info = port.current_status(True)
+            labels = OrderedDict([("port", port_id + 1)])
+            metrics.add("poe_port", 1, OrderedDict([
+                ("port", port_id + 1), ("status", info.get(STATUS)),
+                ("priority", info.get(PRIORITY)),
+                ("protocol", info.get(PROTOCOL)),
+                ("class", info.get(CLASS))]))
+            (power, voltage, current, status) = port.telemetry_sample()
+            metrics.add("poe_port_enabled", info.get(ENDIS) == "enable", labels)
+            metrics.add("poe_port_status_code", status, labels)
+            if str(info.get(CLASS)).isdigit():
+                metrics.add("poe_port_class", int(info.get(CLASS)), labels)
+            if power is not None:
+                metrics.add("poe_port_power_watts", power / 1000, labels)
+            if info.get(POWER_LIMIT) is not None:
+                metrics.add("poe_port_power_limit_watts",
+                            info.get(POWER_LIMIT) / 1000, labels)
+            metrics.add("poe_port_voltage_volts", voltage, labels)
+            if current is not None:
+                metrics.add("poe_port_current_amperes", current / 1000, labels)
+            power_stats = self.telemetry.stats(port_id, POWER_CONSUMP,
+                                               self.telemetry_window, now)
+            if power_stats is not None:
+                metrics.add("poe_port_power_avg_watts",
+                            round(power_stats["avg"] / 1000, 3), labels)
+                metrics.add("poe_port_power_max_watts",
+                            power_stats["max"] / 1000, labels)
+
+        system_state = self.system_state
+        if system_state is not None:
+            for name, key, help_text in (
+                    ("poe_system_power_budget_watts", TOTAL_POWER,
+                     "Power budget of the active power bank"),
+                    ("poe_system_power_consumption_watts", POWER_CONSUMP,
+                     "Total power consumption"),
+                    ("poe_system_power_available_watts", POWER_AVAIL,
+                     "Power left in the budget"),
+                    ("poe_system_power_bank", POWER_BANK,
+                     "Active power bank")):
+                metrics.family(name, METRIC_GAUGE, help_text)
+                metrics.add(name, system_state.get(key))
+
+        stats = self.poe_plat.get_bus_stats()
+        metrics.family("poe_bus_transactions", METRIC_COUNTER,
+                       "I2C request/reply transactions")
+        metrics.family("poe_bus_retries", METRIC_COUNTER,
+                       "Requests retried after a failure")
+        metrics.family("poe_bus_failures", METRIC_COUNTER,
+                       "Failed transactions by error class")
+        metrics.family("poe_bus_i2c_seconds", METRIC_COUNTER,
+                       "Time spent in I2C transfers")
+        metrics.family("poe_bus_sleep_seconds", METRIC_COUNTER,
+                       "Time spent in chip delays")
+        for cmd_type, entry in stats[BUS_STAT_COMMANDS].items():
+            labels = OrderedDict([("command", cmd_type)])
+            metrics.add("poe_bus_transactions", entry[BUS_STAT_TRANS], labels)
+            metrics.add("poe_bus_retries", entry[BUS_STAT_RETRIES], labels)
+            for err_class, count in entry[BUS_STAT_FAILURES].items():
+                metrics.add("poe_bus_failures", count, OrderedDict([
+                    ("command", cmd_type), ("class", err_class)]))
+            metrics.add("poe_bus_i2c_seconds", entry[BUS_STAT_I2C_TIME], labels)
+            metrics.add("poe_bus_sleep_seconds", entry[BUS_STAT_SLEEP_TIME], labels)
+
+        metrics.family("poe_poll_sweeps", METRIC_COUNTER,
+                       "Completed sweeps of a poll task")
+        metrics.family("poe_poll_sweep_duration_seconds", METRIC_GAUGE,
+                       "Duration of the last sweep of a poll task")
+        for task in self.poll_scheduler.tasks.values():
+            labels = OrderedDict([("task", task.name)])
+            metrics.add("poe_poll_sweeps", task.sweeps, labels)
+            if task.sweep_duration is not None:
+                metrics.add("poe_poll_sweep_duration_seconds",
+                            round(task.sweep_duration, 6), labels)
+        return metrics
+
+    def export_metrics(self, items):
+        save_metrics(self.collect_metrics().render(), POED_METRICS_PATH)
+
+    # Cached port information for "poecli show --watch", never reads the
+    # chip. Only written while a watcher requests it.
+    def publish_ports_info(self, items):
+        try:
+            watched = os.stat(POED_PORTS_WATCH_PATH).st_mtime > time.time()
+        except OSError:
+            watched = False
+        if not watched:
+            if self.ports_info_published:
+                remove_file(POED_PORTS_CACHE_PATH)
+                self.ports_info_published = False
+            return
+        data = OrderedDict()
+        data[POED_STATE_TIME] = time.time()
+        data[PORT_INFO] = self.get_cached_ports_info()
+        try:
+            tmp_path = POED_PORTS_CACHE_PATH + ".tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(data))
+            os.replace(tmp_path, POED_PORTS_CACHE_PATH)
+            self.ports_info_published = True
+        except Exception as e:
+            self.log.err("Failed to publish ports information", err=str(e))
+
+    def poll_main(self):
+        global thread_flag
+        self.log.info("Start poll thread")
+        self.poll_scheduler.request("versions")
+        while thread_flag is True:
+            try:
+                start = time.time()
+                self.poll_scheduler.run_tick(start)
+                time.sleep(max(0, self.poll_scheduler.tick - (time.time() - start)))
+            except Exception as e:
+                self.log.err("An exception in poll routine", err=str(e))
+                time.sleep(1)
+
+    def event_main(self):
+        global thread_flag
+        self.log.info("Start event thread")
+        while thread_flag is True:
+            try:
+                # Wake on the platform PoE interrupt line if there is one,
+                # otherwise poll the interrupt register on a short tick
+                if self.poe_plat.wait_poe_irq(self.event_irq_timeout) is None:
+                    time.sleep(self.event_tick)
+                self.handle_chip_events()
+            except Exception as e:
+                self.log.err("An exception in event routine", err=str(e))
+                time.sleep(1)
+
     def failsafe_mode(self):
         self.log.warn("Entering fail safe mode(All port disabled).")
         self.failsafe_flag = True
-        for idx in range(self.poe_plat.total_poe_port()):
-            self.poe_plat.set_port_enDis(idx, 0)
+        # Disable all ports with one broadcast, the ports which are still
+        # enabled on the bulk read back are set again, and the ones failing
+        # that are disabled one at a time
+        all_ports = list(range(self.poe_plat.total_poe_port()))
+        try:
+            results = self.poe_plat.set_all_ports_params(OrderedDict([(ENDIS, 0)]))
+            failed = [item for item in results if item[CMD_RESULT_RET] != 0]
+            if len(failed) > 0:
+                self.log.warn("Fail safe disable failed: %s, disable ports one by one" %
+                              json.dumps(failed))
+            # A failed broadcast (no port index) leaves every port to disable
+            if any(item["idx"] not in all_ports for item in failed):
+                self.failsafe_disable_ports(all_ports)
+            else:
+                self.failsafe_disable_ports(sorted(set(item["idx"] for item in failed)))
+        except Exception as e:
+            self.log.err("Fail safe broadcast failed: %s, disable ports one by one" % str(e))
+            self.failsafe_disable_ports(all_ports)
+
+    # Last resort of the fail safe mode, one port at a time
+    # (set_port_enDis, set_bt_port_enDis on BT firmware)
+    def failsafe_disable_ports(self, port_ids):
+        for idx in port_ids:
+            try:
+                func, args = self.poe_plat.port_change_call(idx, ENDIS, 0)
+                ret = func(*args)
+                if ret != 0:
+                    self.log.err("Fail safe disable failed", port=idx + 1, ret=ret)
+            except Exception as e:
+                self.log.err("Fail safe disable failed", port=idx + 1, err=str(e))
 
-    def load_poe_cfg(self, poe_cfg):
+    def load_poe_cfg(self, poe_cfg, cfg_data=None):
         retry = 0
         while retry < self.cfg_load_retry:
             try:
-                if poe_cfg.is_valid() == False:
-                    self.log.warn("Invalid cfg data to load!")
-                    return False
-                return self.flush_settings_to_chip(poe_cfg)
+                if cfg_data is None:
+                    if poe_cfg.is_valid() == False:
+                        self.log.warn("Invalid cfg data to load!")
+                        return False
+                return self.flush_settings_to_chip(poe_cfg, cfg_data)
             except Exception as e:
                 self.log.err("An exception to load cfg (%s): %s, retry = %s" %
                              (poe_cfg.path(), str(e), str(retry)))
@@ -417,7 +1057,61 @@ class PoeAgent(object):
             os.mkfifo(POE_IPC_EVT)
         except OSError as oe:
             if oe.errno != errno.EEXIST:
-                self.log.err("Failed to open named pipe: %s" % str(e))
+                self.log.err("Failed to open named pipe: %s" % str(oe))
+
+    # Pick and validate the cfg file to restore, runs while init_poe
+    # talks to the chip
+    def prepare_cfg(self, is_warm_boot):
+        try:
+            if is_warm_boot:
+                data = self.runtime_cfg.load_valid()
+                if data is not None:
+                    self.prepared_cfg = (self.runtime_cfg, data)
+                    return
+            self.prepared_cfg = (self.permanent_cfg,
+                                 self.permanent_cfg.load_valid())
+        except Exception as e:
+            self.log.err("An exception to prepare cfg: %s" % str(e))
+            self.prepared_cfg = (self.permanent_cfg, None)
+
+    def bringup_state(self, state, stage=None):
+        cur_state = OrderedDict()
+        cur_state[POED_STATE] = state
+        cur_state[POED_STAGE] = stage
+        if stage in self.bringup_stages:
+            cur_state[POED_STAGE_INDEX] = self.bringup_stages.index(stage) + 1
+            cur_state[POED_STAGE_TOTAL] = len(self.bringup_stages)
+        cur_state[POED_STATE_PID] = os.getpid()
+        cur_state[POED_STATE_SINCE] = self.bringup_start
+        cur_state[POED_STATE_TIME] = time.time()
+        if state != POED_STATE_STARTING:
+            cur_state[POED_BRINGUP_TIME] = round(
+                cur_state[POED_STATE_TIME] - self.bringup_start, 3)
+        save_poed_state(cur_state)
+
+    def bringup_begin(self):
+        try:
+            self.bringup_lock_fd = open(POED_BRINGUP_LOCK, 'a')
+            fcntl.flock(self.bringup_lock_fd, fcntl.LOCK_EX)
+        except Exception as e:
+            self.log.err("Failed to take bring-up lock: %s" % str(e))
+        self.bringup_state(POED_STATE_STARTING, self.bringup_stages[0])
+
+    def bringup_stage(self, stage):
+        self.log.info("Bring-up stage: {0}".format(stage))
+        self.bringup_state(POED_STATE_STARTING, stage)
+
+    def bringup_end(self):
+        if self.failsafe_flag == True:
+            self.bringup_state(POED_STATE_FAILSAFE)
+        else:
+            self.bringup_state(POED_STATE_READY)
+        if self.bringup_lock_fd is not None:
+            fcntl.flock(self.bringup_lock_fd, fcntl.LOCK_UN)
+            self.bringup_lock_fd.close()
+            self.bringup_lock_fd = None
+        self.log.info("Bring-up completed in {0:.3f}s".format(
+            time.time() - self.bringup_start))
 
 def get_prev_pid():
     return int(open(POED_PID_PATH, 'r').read())
@@ -450,17 +1144,28 @@ def main(argv):
         save_cur_pid()
 
     pa = PoeAgent()
+    signal.signal(signal.SIGUSR1, pa.start_profiling)
+    signal.signal(signal.SIGUSR2, pa.stop_profiling)
     if pa.plat_supported:
-        touch_file(POED_BUSY_FLAG)
+        pa.bringup_begin()
         try:
-            poe_cfg = pa.permanent_cfg
-            if is_warm_boot and pa.runtime_cfg.is_valid():
-                poe_cfg = pa.runtime_cfg
+            # IPC and cfg parsing do not need the chip, prepare them while
+            # init_poe runs. init_poe preserves the port state whether the
+            # cfg turns out valid or not, so it does not wait for the cfg.
+            pa.create_poe_set_ipc()
+            prepare_thread = threading.Thread(target=pa.prepare_cfg,
+                                              args=(is_warm_boot,))
+            prepare_thread.start()
+            pa.bringup_stage("init_poe")
+            init_result = pa.init_platform(True)
+            prepare_thread.join()
+            (poe_cfg, cfg_data) = pa.prepared_cfg
             pa.log.info("Configure PoE ports from \"%s\"" % poe_cfg.path())
-            if poe_cfg.is_valid() == True:
-                if pa.init_platform(True) == True:
+            if cfg_data is not None:
+                if init_result == True:
                     pa.log.info("Success to initialize platform PoE settings!")
-                    if pa.load_poe_cfg(poe_cfg)== True:
+                    pa.bringup_stage("load_cfg")
+                    if pa.load_poe_cfg(poe_cfg, cfg_data)== True:
                         pa.log.info(
                             "Success to restore port configurations from \"%s\"." % poe_cfg.path())
                     else:
@@ -472,8 +1177,9 @@ def main(argv):
                     pa.set_poe_agent_state(PoeAgentState.UNCLEAN_START)
                     pa.failsafe_mode()
             else:
-                if pa.init_platform(False) == True:
+                if init_result == True:
                     pa.log.info("Success to initialize platform PoE settings!")
+                    pa.bringup_stage("load_cfg")
                     if Path(pa.runtime_cfg.path()).exists() == False:
                         pa.log.info(
                             "Runtime config file loss, reconstruct \"%s\" config from poe chip runtime setting." % pa.runtime_cfg.path())
@@ -490,12 +1196,19 @@ def main(argv):
                     pa.set_poe_agent_state(PoeAgentState.UNCLEAN_START)
                     pa.failsafe_mode()
             # Start Autosave thread
+            pa.bringup_stage("autosave")
             pa.autosave_thread.start()
+            # Resume reconciling after a poed restart
+            if check_file(POED_DESIRED_CFG_PATH):
+                pa.set_desired_state(POED_DESIRED_CFG_PATH)
+            pa.reconcile_thread.start()
+            pa.init_chip_events()
+            pa.event_thread.start()
+            pa.poll_thread.start()
         except Exception as e:
             pa.log.warn("Load config failed: {0}".format(str(e)))
             poed_exit(ret_code=-2)
-        remove_file(POED_BUSY_FLAG)
-        pa.create_poe_set_ipc()
+        pa.bringup_end()
         while thread_flag is True:
             try:
                 with open(POE_IPC_EVT, 'r') as f:
@@ -504,6 +1217,10 @@ def main(argv):
                         if data == POECLI_SET:
                             pa.update_set_time()
                             pa.log.info("Receive a set event from poecli!")
+                            # Refresh the port settings shown by --watch
+                            pa.poll_scheduler.request("config")
+                            if pa.desired_ports is not None:
+                                pa.request_reconcile(invalidate=True)
                             if pa.rt_counter <pa.cfg_update_intvl_rt:
                                 pa.log.info("Reset rt_counter timing: {0}".format(
                                     str(pa.cfg_update_intvl_rt)))
@@ -545,6 +1262,10 @@ def main(argv):
                                         result = pa.load_poe_cfg(temp_cfg)
                                     if result == True:
                                         pa.update_set_time()
+                                    if pa.desired_ports is not None:
+                                        pa.request_reconcile(invalidate=True)
+                                elif action==POED_DESIRED_ACTION:
+                                    pa.set_desired_state(file)
                                 break
                         else:
                             pa.log.notice("Receive data: %s, skipped!" % data)
@@ -560,7 +1281,16 @@ def main(argv):
 
 def poed_exit(sig=0, frame=None,ret_code=0):
     global thread_flag
-    remove_file(POED_BUSY_FLAG)
+    state = load_poed_state()
+    if state is not None and state.get(POED_STATE_PID) == os.getpid():
+        state[POED_STATE] = POED_STATE_STOPPED
+        state[POED_STATE_TIME] = time.time()
+        save_poed_state(state)
+        # Do not leave metrics and port data of a stopped agent behind
+        remove_file(POED_METRICS_PATH)
+        remove_file(POED_PORTS_CACHE_PATH)
+        remove_file(POED_PORTS_WATCH_PATH)
+        remove_file(POED_SYSTEM_STATUS_PATH)
     thread_flag = False
     print_stderr("exitcode={0}".format(ret_code))
     sys.exit(ret_code)
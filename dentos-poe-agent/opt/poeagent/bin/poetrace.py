@@ -0,0 +1,260 @@
+'''
+Copyright 2021 Delta Electronic Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+from poe_common import *
+from poe_trace import *
+from poe_driver_pd69200_def import *
+import poe_driver_pd69200 as PoeDrv
+
+import os
+import sys
+import time
+import shutil
+import argparse
+from collections import OrderedDict
+
+# One request and its reply as seen on the bus
+class PoeTraceExchange(object):
+    def __init__(self, tx):
+        self.tx = tx
+        self.rx = None
+        # PoeCommError class of the reply, "no_reply" or None when valid
+        self.err = None
+        self.retry = False
+
+# Requests paired with their replies. Processes take the bus lock for
+# whole transactions but their records still interleave, so each pid is
+# paired separately: a reply belongs to the last request not answered yet,
+# a reply without one is a buffer clean up read.
+def pair_exchanges(records):
+    exchanges = []
+    pending = dict()
+    cleanups = 0
+    io_errors = []
+    for rec in records:
+        if rec.kind == TRACE_TX:
+            prev = pending.get(rec.pid)
+            if prev is not None:
+                prev.err = "no_reply"
+            ex = PoeTraceExchange(rec)
+            pending[rec.pid] = ex
+            exchanges.append(ex)
+        elif rec.kind == TRACE_RX:
+            ex = pending.pop(rec.pid, None)
+            if ex is None:
+                cleanups += 1
+            else:
+                ex.rx = rec
+        elif rec.kind == TRACE_ERR:
+            io_errors.append(rec)
+            ex = pending.pop(rec.pid, None)
+            if ex is not None:
+                ex.err = POE_PD69200_COMM_ERR_IO
+    for ex in pending.values():
+        if ex.rx is None and ex.err is None:
+            ex.err = "no_reply"
+    return exchanges, cleanups, io_errors
+
+# Request bytes that stay the same when the driver resends it
+def _request_body(frame):
+    return [frame[POE_PD69200_MSG_OFFSET_KEY]] + \
+        frame[POE_PD69200_MSG_OFFSET_ECHO + 1:-POE_PD69200_MSG_CSUM_LEN]
+
+# Run the replies through the driver frame checks and the reply parser,
+# as the driver did when they were received. Returns the parse errors.
+def check_exchanges(exchanges):
+    driver = PoeDrv.PoeDriver_microsemi_pd69200()
+    parser = PoeDrv.PoeMsgParser()
+    parse_errors = 0
+    last = dict()
+    for ex in exchanges:
+        prev = last.get(ex.tx.pid)
+        ex.retry = prev is not None and prev.err is not None and \
+            _request_body(prev.tx.frame) == _request_body(ex.tx.frame)
+        last[ex.tx.pid] = ex
+        if ex.rx is None:
+            continue
+        try:
+            driver._check_rx_msg(ex.rx.frame, ex.tx.frame)
+        except PoeDrv.PoeCommError as e:
+            ex.err = e.err_class
+            continue
+        if ex.tx.msg_type:
+            try:
+                parser.parse(ex.rx.frame, ex.tx.msg_type)
+            except Exception:
+                parse_errors += 1
+    return parse_errors
+
+class PoeTraceCLI(object):
+    def _load(self, path):
+        records = read_trace(path)
+        if len(records) == 0:
+            print_stderr("No frames in " + path)
+        return records
+
+    def start(self, path, capacity):
+        create_trace(path, capacity)
+        print("Tracing I2C frames to {0} ({1} frames)".format(path, capacity))
+
+    def stop(self, path, output):
+        if output is not None:
+            shutil.copyfile(path, output)
+            print("Trace saved to " + output)
+        remove_file(path)
+
+    def dump(self, path):
+        records = self._load(path)
+        if len(records) == 0:
+            return
+        base = records[0].timestamp
+        print("  Time (s)    PID  Dir  I2C (ms)  Command                       Frame")
+        for rec in records:
+            print("{0:10.6f} {1:6d}  {2:<3}  {3:8.3f}  {4:<28}  {5}".format(
+                rec.timestamp - base, rec.pid, TRACE_KIND_NAMES.get(rec.kind, "?"),
+                rec.i2c_time * 1000, rec.cmd_type, conv_byte_to_hex(rec.frame)))
+
+    def replay(self, path, gap_ms, top, repeat):
+        records = self._load(path)
+        if len(records) == 0:
+            return
+        exchanges, cleanups, io_errors = pair_exchanges(records)
+        parse_errors = check_exchanges(exchanges)
+        span = records[-1].timestamp - records[0].timestamp
+        print("Frames: {0}, exchanges: {1}, span: {2:.3f}s, processes: {3}".format(
+            len(records), len(exchanges), span,
+            len(set(rec.pid for rec in records))))
+        print("Clean up reads: {0}, I/O errors: {1}, parse errors: {2}".format(
+            cleanups, len(io_errors), parse_errors))
+
+        # Per command: exchanges, request to reply latency, errors, retries
+        cmds = OrderedDict()
+        for ex in exchanges:
+            entry = cmds.setdefault(ex.tx.cmd_type, OrderedDict(
+                [("count", 0), ("latency", []), ("errors", OrderedDict()),
+                 ("retries", 0)]))
+            entry["count"] += 1
+            if ex.rx is not None:
+                entry["latency"].append(ex.rx.timestamp - ex.tx.timestamp)
+            if ex.err is not None:
+                entry["errors"][ex.err] = entry["errors"].get(ex.err, 0) + 1
+            if ex.retry:
+                entry["retries"] += 1
+        print("")
+        print(" Command                       Count  Avg (ms)  Max (ms)  Retry  Errors")
+        print(" ----------------------------  -----  --------  --------  -----  ------")
+        for cmd_type, entry in cmds.items():
+            latency = entry["latency"]
+            avg = sum(latency) / len(latency) * 1000 if latency else 0
+            print(" {0:<28}  {1:5d}  {2:8.2f}  {3:8.2f}  {4:5d}  {5}".format(
+                cmd_type, entry["count"], avg,
+                max(latency) * 1000 if latency else 0, entry["retries"],
+                ", ".join("{0}={1}".format(err, count)
+                          for err, count in entry["errors"].items())))
+
+        # Retry chains: consecutive resends of one request
+        chains = OrderedDict()
+        length = 0
+        for ex in exchanges:
+            if ex.retry:
+                length += 1
+            elif length > 0:
+                chains[length] = chains.get(length, 0) + 1
+                length = 0
+        if length > 0:
+            chains[length] = chains.get(length, 0) + 1
+        if len(chains) > 0:
+            print("")
+            print("Retry chains: " + ", ".join("{0}x{1}".format(count, length)
+                  for length, count in sorted(chains.items())))
+
+        # Bus idle gaps of one process beyond the write delay of the
+        # previous frame
+        gaps = []
+        last = dict()
+        for rec in records:
+            prev = last.get(rec.pid)
+            last[rec.pid] = rec
+            if prev is None:
+                continue
+            gap = rec.timestamp - rec.i2c_time - prev.timestamp - prev.delay
+            if gap * 1000 >= gap_ms:
+                gaps.append((gap, prev, rec))
+        print("")
+        print("Gaps over {0} ms: {1}".format(gap_ms, len(gaps)))
+        base = records[0].timestamp
+        for gap, prev, rec in sorted(gaps, key=lambda item: -item[0])[:top]:
+            print("  {0:10.3f} ms at {1:.6f}s pid {2}: {3} -> {4}".format(
+                gap * 1000, prev.timestamp - base, rec.pid, prev.cmd_type,
+                rec.cmd_type))
+
+        # Offline benchmark of the frame checks and reply parsing
+        if repeat > 0:
+            start = time.monotonic()
+            for i in range(repeat):
+                check_exchanges(exchanges)
+            secs = time.monotonic() - start
+            print("")
+            print("Check and parse: {0} exchanges x {1} in {2:.3f}s, {3:.1f} us/exchange".format(
+                len(exchanges), repeat, secs,
+                secs / max(1, len(exchanges) * repeat) * 1000000))
+
+    def _build_parser(self):
+        root_parser = argparse.ArgumentParser(
+            description="Record PoE I2C frames of poed and poecli and analyze them offline")
+        sub_parser = root_parser.add_subparsers(dest="subcmd",
+                                                help="Descriptions")
+        start_parser = sub_parser.add_parser("start", help="Start tracing I2C frames")
+        start_parser.add_argument("-n", "--frames", type=int,
+                                  default=POE_TRACE_CAPACITY,
+                                  help="Frames kept in the trace ring")
+        stop_parser = sub_parser.add_parser("stop", help="Stop tracing")
+        stop_parser.add_argument("-o", "--output",
+                                 help="Save the trace to a file first")
+        dump_parser = sub_parser.add_parser("dump", help="Print the traced frames")
+        dump_parser.add_argument("file", nargs="?", default=POE_TRACE_PATH)
+        replay_parser = sub_parser.add_parser("replay",
+            help="Check and parse the traced frames, report timing gaps and retries")
+        replay_parser.add_argument("file", nargs="?", default=POE_TRACE_PATH)
+        replay_parser.add_argument("-g", "--gap", type=float, default=100,
+                                   help="Report gaps over this many ms")
+        replay_parser.add_argument("-t", "--top", type=int, default=10,
+                                   help="Number of gaps to list")
+        replay_parser.add_argument("-r", "--repeat", type=int, default=0,
+                                   help="Benchmark the check and parse N times")
+        return root_parser
+
+def main(argv):
+    poetrace = PoeTraceCLI()
+    parser = poetrace._build_parser()
+    args = parser.parse_args()
+    try:
+        if args.subcmd == "start":
+            poetrace.start(POE_TRACE_PATH, args.frames)
+        elif args.subcmd == "stop":
+            poetrace.stop(POE_TRACE_PATH, args.output)
+        elif args.subcmd == "dump":
+            poetrace.dump(args.file)
+        elif args.subcmd == "replay":
+            poetrace.replay(args.file, args.gap, args.top, args.repeat)
+        else:
+            parser.print_help()
+    except Exception as e:
+        print_stderr("poetrace failed! (%s)" % str(e))
+        os._exit(-1)
+
+if __name__ == '__main__':
+    main(sys.argv)
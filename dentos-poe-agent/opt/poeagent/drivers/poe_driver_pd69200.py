@@ -18,17 +18,29 @@ import time
 import sys
 import os
 import json
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
 from collections import OrderedDict
 from poe_common import *
-from poe_common import print_stderr
+from poe_common import print_stderr, print_stderr_limited
 from poe_driver_pd69200_def import *
+from poe_trace import PoeTraceRecorder, TRACE_TX, TRACE_RX, TRACE_ERR
 
 class PoeCommExclusiveLock(object):
+    # cost: function of the call arguments returning the number of requests
+    # the call sends, charged to the bus budget (default: 1)
+    def __init__(self, cost=None):
+        self.cost = cost
+
     def __call__(self, comm):
         def wrap_comm(*args, **kargs):
             poe_plat = args[0]
+            cost = 1 if self.cost is None else self.cost(*args[1:])
+            # bus_lock() is re-entrant, nested calls keep the outer lock
             try:
-                poe_plat.bus_lock()
+                poe_plat.bus_lock(cost)
                 result = comm(*args, **kargs)
             except Exception as e:
                 raise e
@@ -37,11 +49,188 @@ class PoeCommExclusiveLock(object):
             return result
         return wrap_comm
 
+class PoeCommError(RuntimeError):
+    def __init__(self, err_class, msg):
+        RuntimeError.__init__(self, msg)
+        self.err_class = err_class
+
+class PoeBusStats(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._since = time.time()
+        self._commands = OrderedDict()
+
+    def _entry(self, cmd_type):
+        entry = self._commands.get(cmd_type)
+        if entry is None:
+            entry = OrderedDict()
+            entry[BUS_STAT_TRANS] = 0
+            entry[BUS_STAT_TX_BYTES] = 0
+            entry[BUS_STAT_RX_BYTES] = 0
+            entry[BUS_STAT_RETRIES] = 0
+            entry[BUS_STAT_FAILURES] = OrderedDict()
+            entry[BUS_STAT_SLEEP_TIME] = 0.0
+            entry[BUS_STAT_I2C_TIME] = 0.0
+            self._commands[cmd_type] = entry
+        return entry
+
+    def add_transaction(self, cmd_type):
+        self._entry(cmd_type)[BUS_STAT_TRANS] += 1
+
+    def add_bytes(self, cmd_type, tx_bytes=0, rx_bytes=0):
+        entry = self._entry(cmd_type)
+        entry[BUS_STAT_TX_BYTES] += tx_bytes
+        entry[BUS_STAT_RX_BYTES] += rx_bytes
+
+    def add_retry(self, cmd_type):
+        self._entry(cmd_type)[BUS_STAT_RETRIES] += 1
+
+    def add_failure(self, cmd_type, err_class):
+        failures = self._entry(cmd_type)[BUS_STAT_FAILURES]
+        failures[err_class] = failures.get(err_class, 0) + 1
+
+    def add_sleep_time(self, cmd_type, secs):
+        self._entry(cmd_type)[BUS_STAT_SLEEP_TIME] += secs
+
+    def add_i2c_time(self, cmd_type, secs):
+        self._entry(cmd_type)[BUS_STAT_I2C_TIME] += secs
+
+    def snapshot(self):
+        total = OrderedDict()
+        total[BUS_STAT_TRANS] = 0
+        total[BUS_STAT_TX_BYTES] = 0
+        total[BUS_STAT_RX_BYTES] = 0
+        total[BUS_STAT_RETRIES] = 0
+        total[BUS_STAT_FAILURES] = OrderedDict()
+        total[BUS_STAT_SLEEP_TIME] = 0.0
+        total[BUS_STAT_I2C_TIME] = 0.0
+        commands = OrderedDict()
+        for cmd_type, entry in self._commands.items():
+            for key in entry:
+                if key == BUS_STAT_FAILURES:
+                    for err_class, count in entry[key].items():
+                        total[key][err_class] = total[key].get(err_class, 0) + count
+                else:
+                    total[key] += entry[key]
+            commands[cmd_type] = OrderedDict(entry)
+            commands[cmd_type][BUS_STAT_FAILURES] = OrderedDict(
+                entry[BUS_STAT_FAILURES])
+        stats = OrderedDict()
+        stats[BUS_STAT_SINCE] = self._since
+        stats[BUS_STAT_TOTAL] = total
+        stats[BUS_STAT_COMMANDS] = commands
+        return stats
+
+# Chip data that only changes with a firmware update or an explicit set:
+# firmware version, individual masks and the active matrix. The cache is
+# a JSON file under /run shared by poed and poecli, reloaded when another
+# process changed it and updated under an flock. Dropped on reset and
+# restore, and when poed finds another firmware version on the chip at
+# start (see check_firmware_version()).
+class PoeStaticCache(object):
+    def __init__(self, path=POE_STATIC_CACHE_PATH, lock_path=POE_STATIC_CACHE_LOCK):
+        self.path = path
+        self.lock_path = lock_path
+        self._data = OrderedDict()
+        self._stamp = None
+
+    def _load(self):
+        try:
+            st = os.stat(self.path)
+            stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        if stamp == self._stamp:
+            return self._data
+        data = OrderedDict()
+        if stamp is not None:
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.loads(f.read(), object_pairs_hook=OrderedDict)
+            except (OSError, ValueError):
+                data = OrderedDict()
+        self._data = data
+        self._stamp = stamp
+        return data
+
+    def get(self, key):
+        return self._load().get(key)
+
+    # Apply func(data) to the latest cache content and write it back
+    def _modify(self, func):
+        try:
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            print_stderr("Fail to lock: " + self.lock_path + ",err: " + str(e))
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = self._load()
+            func(data)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(data))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print_stderr("Fail to save: " + self.path + ",err: " + str(e))
+        finally:
+            os.close(fd)
+        # Force a reload, the stamp may not change within a timer tick
+        self._stamp = None
+
+    def set(self, key, value):
+        self._modify(lambda data: data.__setitem__(key, value))
+
+    def update(self, key, items):
+        self._modify(lambda data: data.setdefault(key, OrderedDict()).update(items))
+
+    def drop(self, key, item=None):
+        def _drop(data):
+            if item is None:
+                data.pop(key, None)
+            elif key in data:
+                data[key].pop(item, None)
+        self._modify(_drop)
+
+    def clear(self):
+        self._modify(lambda data: data.clear())
+
 class PoeDriver_microsemi_pd69200(object):
     _last_send_key = None
 
     def __init__(self):
         self._echo = 0x00
+        self._bus_stats = PoeBusStats()
+        self._cmd_type = BUS_STAT_IDLE_CMD
+        self._slept = 0.0
+        # Frame trace (see poetrace), with the reply message type of each
+        # command type seen so far
+        self._trace = PoeTraceRecorder()
+        self._trace_tx_cmd = BUS_STAT_IDLE_CMD
+        self._msg_types = dict()
+        # Firmware version, individual masks and active matrix
+        self._static_cache = PoeStaticCache()
+        # Last BT event exist flag seen by poll_chip_events()
+        self._last_event_exist = 0
+        # Last system status read from the chip, and the loader of the one
+        # published by poed (see read_system_status())
+        self.last_system_status = None
+        self.published_system_status = None
+        # Per thread bus context: bus priority class (see bus_priority())
+        # and the requests collected by run_batch() instead of being sent
+        self._bus_ctx = threading.local()
+        # Reused port/system records and reply parser. The get_poe_port()
+        # records belong to their caller (poed's poll thread), the ones of
+        # get_ports_information() are kept apart
+        self._port_pool = dict()
+        self._info_port_pool = dict()
+        self._poe_system = None
+        self._msg_parser = PoeMsgParser()
+        # Platform supports plat_poe_read_write(): read the pending reply
+        # and write the next request in a single combined I2C transfer
+        self._pipelined_xfer = 0
         self._4wire_bt = 0
         # Time between commands: 30ms
         self._msg_delay = 0.03
@@ -82,83 +271,323 @@ class PoeDriver_microsemi_pd69200(object):
         tx_msg += self._calc_msg_csum(tx_msg)
         return tx_msg
 
+    def _delay(self, secs):
+        if secs <= 0:
+            return
+        start = time.monotonic()
+        time.sleep(secs)
+        slept = time.monotonic() - start
+        self._slept += slept
+        self._bus_stats.add_sleep_time(self._cmd_type, slept)
+
     def _xmit(self, msg, delay):
         if len(msg) != POE_PD69200_MSG_LEN:
-            raise RuntimeError("Invalid POE Tx message Length: %d" % len(msg))
-        self.plat_poe_write(msg, delay)
+            raise PoeCommError(POE_PD69200_COMM_ERR_LENGTH,
+                               "Invalid POE Tx message Length: %d" % len(msg))
+        start, slept = time.monotonic(), self._slept
+        try:
+            self.plat_poe_write(msg, delay)
+        except Exception:
+            self._trace_frame(TRACE_ERR, msg, delay)
+            raise
+        finally:
+            i2c_time = (time.monotonic() - start) - (self._slept - slept)
+            self._bus_stats.add_i2c_time(self._cmd_type, i2c_time)
+        self._bus_stats.add_bytes(self._cmd_type, tx_bytes=len(msg))
+        self._trace_frame(TRACE_TX, msg, delay, i2c_time)
+
+    def _xmit_recv(self, msg, delay):
+        if len(msg) != POE_PD69200_MSG_LEN:
+            raise PoeCommError(POE_PD69200_COMM_ERR_LENGTH,
+                               "Invalid POE Tx message Length: %d" % len(msg))
+        start, slept = time.monotonic(), self._slept
+        try:
+            rx_msg = self.plat_poe_read_write(msg, delay)
+        except Exception:
+            self._trace_frame(TRACE_ERR, msg, delay)
+            raise
+        finally:
+            i2c_time = (time.monotonic() - start) - (self._slept - slept)
+            self._bus_stats.add_i2c_time(self._cmd_type, i2c_time)
+        self._bus_stats.add_bytes(self._cmd_type, tx_bytes=len(msg),
+                                  rx_bytes=len(rx_msg))
+        # The reply of the previous request is read before the write
+        self._trace_frame(TRACE_RX, rx_msg, 0, i2c_time)
+        self._trace_frame(TRACE_TX, msg, delay, i2c_time)
+        return rx_msg
 
     def _recv(self):
-        return self.plat_poe_read()
+        start = time.monotonic()
+        try:
+            rx_msg = self.plat_poe_read()
+        except Exception:
+            self._trace_frame(TRACE_ERR, [])
+            raise
+        finally:
+            i2c_time = time.monotonic() - start
+            self._bus_stats.add_i2c_time(self._cmd_type, i2c_time)
+        self._bus_stats.add_bytes(self._cmd_type, rx_bytes=len(rx_msg))
+        self._trace_frame(TRACE_RX, rx_msg, 0, i2c_time)
+        return rx_msg
+
+    # Replies are traced with the command of the last request, a pipelined
+    # read happens after the next command took over
+    def _trace_frame(self, kind, frame, delay=0, i2c_time=0):
+        if kind == TRACE_RX:
+            cmd_type = self._trace_tx_cmd
+        else:
+            cmd_type = self._cmd_type
+            self._trace_tx_cmd = cmd_type
+        self._trace.record(kind, cmd_type, self._msg_types.get(cmd_type),
+                           frame, delay, i2c_time)
 
     def _check_rx_msg(self, rx_msg, tx_msg):
         if len(rx_msg) != POE_PD69200_MSG_LEN:
-            raise RuntimeError(
+            raise PoeCommError(POE_PD69200_COMM_ERR_LENGTH,
                 "Received POE message Length is invalid: %d" % len(rx_msg))
         if rx_msg.count(0x00) == POE_PD69200_MSG_LEN:
-            raise RuntimeError("POE RX is not ready")
+            raise PoeCommError(POE_PD69200_COMM_ERR_NOT_READY,
+                               "POE RX is not ready")
 
         tx_key, rx_key = tx_msg[POE_PD69200_MSG_OFFSET_KEY], rx_msg[POE_PD69200_MSG_OFFSET_KEY]
         if (tx_key == POE_PD69200_MSG_KEY_COMMAND or tx_key == POE_PD69200_MSG_KEY_PROGRAM) and \
                 rx_key != POE_PD69200_MSG_KEY_REPORT:
-            raise RuntimeError("Key field in Tx/Rx message is mismatch,\
+            raise PoeCommError(POE_PD69200_COMM_ERR_KEY,
+                               "Key field in Tx/Rx message is mismatch,\
                                Tx key is %02x, Rx key should be %02x, but received %02x" %
                                (tx_key, POE_PD69200_MSG_KEY_REPORT, rx_key))
         if tx_key == POE_PD69200_MSG_KEY_REQUEST and rx_key != POE_PD69200_MSG_KEY_TELEMETRY:
-            raise RuntimeError("Key field in Tx/Rx message is mismatch,\
+            raise PoeCommError(POE_PD69200_COMM_ERR_KEY,
+                               "Key field in Tx/Rx message is mismatch,\
                                Tx key is %02x, Rx key should be %02x, but received %02x" %
                                (tx_key, POE_PD69200_MSG_KEY_TELEMETRY, rx_key))
 
         tx_echo, rx_echo = tx_msg[POE_PD69200_MSG_OFFSET_ECHO], rx_msg[POE_PD69200_MSG_OFFSET_ECHO]
         if rx_echo != tx_echo:
-            raise RuntimeError("Echo field in Tx/Rx message is mismatch,\
+            raise PoeCommError(POE_PD69200_COMM_ERR_ECHO,
+                               "Echo field in Tx/Rx message is mismatch,\
                                Tx Echo is %02x, Rx Echo is %02x" % (tx_echo, rx_echo))
 
         csum = self._calc_msg_csum(rx_msg[0:POE_PD69200_MSG_OFFSET_CSUM_H])
         if (rx_msg[POE_PD69200_MSG_OFFSET_CSUM_H] != csum[0] or
                 rx_msg[POE_PD69200_MSG_OFFSET_CSUM_L] != csum[1]):
-            raise RuntimeError("Invalid checksum in POE Rx message")
-
-
+            raise PoeCommError(POE_PD69200_COMM_ERR_CSUM,
+                               "Invalid checksum in POE Rx message")
+
+    def _comm_err_class(self, ex):
+        if isinstance(ex, PoeCommError):
+            return ex.err_class
+        if isinstance(ex, OSError):
+            return POE_PD69200_COMM_ERR_IO
+        return POE_PD69200_COMM_ERR_OTHER
+
+    def _renew_tx_msg(self, tx_msg):
+        # Increment echo byte
+        command = tx_msg[0:POE_PD69200_MSG_OFFSET_DATA12]
+        command[POE_PD69200_MSG_OFFSET_ECHO] = self._calc_msg_echo()
+        return self._build_tx_msg(command)
+
+    # The command type is only set under the bus lock, other threads may
+    # be sending their own commands
     @PoeCommExclusiveLock()
-    def _communicate(self, tx_msg, delay):
-        retry = 0
+    def _communicate(self, cmd_type, tx_msg, delay):
+        self._cmd_type = cmd_type
+        try:
+            if self._need_msg_pacing(self._last_send_key, tx_msg):
+                self._delay(self._msg_delay)
+            self._bus_stats.add_transaction(cmd_type)
+            rx_msg = self._transact(tx_msg, delay)
+            self._last_send_key = tx_msg[POE_PD69200_MSG_OFFSET_KEY]
+            return rx_msg
+        finally:
+            self._cmd_type = BUS_STAT_IDLE_CMD
+
+    def _transact(self, tx_msg, delay, retry=0):
         ex="Unknown"
         while retry < POE_PD69200_COMM_RETRY_TIMES:
+            rx_msg = []
             try:
                 self._xmit(tx_msg, delay)
                 if retry > 0:
-                    print_stderr("Send(retry: {0}): {1}".format(retry, conv_byte_to_hex(tx_msg)))
+                    print_stderr_limited("Send retry", retry=retry,
+                                         send=conv_byte_to_hex(tx_msg))
                 rx_msg = self._recv()
                 self._check_rx_msg(rx_msg, tx_msg)
                 return rx_msg
             except Exception as e:
                 ex = e
-                print_stderr("_communicate error: {0}".format(str(e)))
-                print_stderr("Send: {0}".format(conv_byte_to_hex(tx_msg)))
-                print_stderr("Recv: {0}".format(conv_byte_to_hex(rx_msg)))
-                rx_msg = self._recv()
-                print_stderr("Recv(clean buffer): {0}".format(conv_byte_to_hex(rx_msg)))
-                # Increment echo byte
-                command = tx_msg[0:POE_PD69200_MSG_OFFSET_DATA12]
-                command[POE_PD69200_MSG_OFFSET_ECHO] = self._calc_msg_echo()
-                tx_msg = self._build_tx_msg(command)
+                self._bus_stats.add_failure(self._cmd_type,
+                                            self._comm_err_class(e))
+                clean_msg = self._drain()
+                print_stderr_limited("_communicate error", err=str(e),
+                                     send=conv_byte_to_hex(tx_msg),
+                                     recv=conv_byte_to_hex(rx_msg),
+                                     clean=conv_byte_to_hex(clean_msg))
+                tx_msg = self._renew_tx_msg(tx_msg)
                 # Wait 0.5s to clear up I2C buffer
-                time.sleep(self._clear_bus_buffer_delay)
+                self._delay(self._clear_bus_buffer_delay)
                 retry += 1
+                if retry < POE_PD69200_COMM_RETRY_TIMES:
+                    self._bus_stats.add_retry(self._cmd_type)
+        self._bus_stats.add_failure(self._cmd_type,
+                                    POE_PD69200_COMM_ERR_EXHAUSTED)
         raise RuntimeError(
             "Problems in running poe communication protocol: {0}".format(str(ex)))
 
-    def _run_communication_protocol(self, command, delay, msg_type=None):
-        tx_msg = self._build_tx_msg(command)
-        if self._last_send_key == tx_msg[POE_PD69200_MSG_OFFSET_KEY] and \
-                tx_msg[POE_PD69200_MSG_OFFSET_KEY] == POE_PD69200_MSG_KEY_COMMAND:
-            time.sleep(self._msg_delay)
-        rx_msg = self._communicate(tx_msg, delay)
-        self._last_send_key = tx_msg[POE_PD69200_MSG_OFFSET_KEY]
+    def _need_msg_pacing(self, prev_key, tx_msg):
+        return prev_key == tx_msg[POE_PD69200_MSG_OFFSET_KEY] and \
+            prev_key == POE_PD69200_MSG_KEY_COMMAND
+
+    # cmd_type: name of the command method, e.g. "get_port_status", bus
+    # statistics and traced frames are accounted to it
+    def _run_communication_protocol(self, cmd_type, command, delay, msg_type=None):
+        if cmd_type not in self._msg_types:
+            self._msg_types[cmd_type] = msg_type
+        batch_queue = getattr(self._bus_ctx, "batch_queue", None)
+        if batch_queue is not None:
+            batch_queue.append((cmd_type, command, delay, msg_type))
+            return None
+        rx_msg = self._communicate(cmd_type, self._build_tx_msg(command), delay)
         if rx_msg is not None and msg_type is not None:
-            result = PoeMsgParser().parse(rx_msg, msg_type)
+            result = self._msg_parser.parse(rx_msg, msg_type)
             return result
 
+    def get_bus_priority(self):
+        return getattr(self._bus_ctx, "prio", BUS_PRIO_STATE)
+
+    # Run the calls of the current thread in the given BUS_PRIO_* class
+    @contextmanager
+    def bus_priority(self, prio):
+        prev = self.get_bus_priority()
+        self._bus_ctx.prio = prio
+        try:
+            yield
+        finally:
+            self._bus_ctx.prio = prev
+
+    # Run a list of (method, args) request/command calls as one bus
+    # transaction: the bus lock is taken once and, on platforms supporting
+    # pipelined transfers, each reply is read in the same I2C transfer that
+    # writes the next request. Only plain command methods (the ones that
+    # return the parsed reply unmodified) can be batched.
+    # In the bulk priority class the batch is sent in chunks of
+    # BUS_BULK_CHUNK requests, releasing the bus between chunks.
+    def run_batch(self, calls):
+        queue = []
+        self._bus_ctx.batch_queue = queue
+        try:
+            for func, args in calls:
+                func(*args)
+        finally:
+            self._bus_ctx.batch_queue = None
+        chunk = len(queue)
+        if self.get_bus_priority() >= BUS_PRIO_BULK:
+            chunk = BUS_BULK_CHUNK
+        rx_msgs = []
+        for idx in range(0, len(queue), max(chunk, 1)):
+            rx_msgs += self._communicate_batch(queue[idx:idx + chunk])
+        results = []
+        for (cmd_type, command, delay, msg_type), rx_msg in zip(queue, rx_msgs):
+            if rx_msg is not None and msg_type is not None:
+                results.append(self._msg_parser.parse(rx_msg, msg_type))
+            else:
+                results.append(None)
+        return results
+
+    @PoeCommExclusiveLock(cost=len)
+    def _communicate_batch(self, queue):
+        try:
+            return self._send_batch(queue)
+        finally:
+            self._cmd_type = BUS_STAT_IDLE_CMD
+
+    def _send_batch(self, queue):
+        tx_msgs = [self._build_tx_msg(command) for (cmd_type, command,
+                                                    delay, msg_type) in queue]
+        if len(queue) == 0 or self._pipelined_xfer == 0:
+            return self._send_serial(queue, tx_msgs)
+
+        # Pipelined: write(0), read(0)+write(1), ..., read(n-1). After a bus
+        # error the failed request and the rest of the queue are sent one
+        # request at a time with the retries of _transact().
+        rx_msgs = []
+        self._cmd_type = queue[0][0]
+        if self._need_msg_pacing(self._last_send_key, tx_msgs[0]):
+            self._delay(self._msg_delay)
+        self._bus_stats.add_transaction(self._cmd_type)
+        try:
+            self._xmit(tx_msgs[0], queue[0][2])
+        except Exception as e:
+            self._batch_error(self._cmd_type, e, tx_msgs[0], [])
+            return self._send_serial(queue, self._renew_tx_msgs(tx_msgs),
+                                     retry=1)
+        for idx in range(len(queue)):
+            cmd_type, command, delay, msg_type = queue[idx]
+            nxt = idx + 1 if idx + 1 < len(queue) else None
+            self._cmd_type = cmd_type
+            rx_msg = []
+            try:
+                if nxt is None:
+                    rx_msg = self._recv()
+                else:
+                    if self._need_msg_pacing(tx_msgs[idx][POE_PD69200_MSG_OFFSET_KEY],
+                                             tx_msgs[nxt]):
+                        self._delay(self._msg_delay)
+                    rx_msg = self._xmit_recv(tx_msgs[nxt], queue[nxt][2])
+                self._check_rx_msg(rx_msg, tx_msgs[idx])
+                if nxt is not None:
+                    self._bus_stats.add_transaction(queue[nxt][0])
+            except Exception as e:
+                self._batch_error(cmd_type, e, tx_msgs[idx], rx_msg)
+                return rx_msgs + self._send_serial(
+                    queue[idx:], self._renew_tx_msgs(tx_msgs[idx:]), retry=1)
+            rx_msgs.append(rx_msg)
+            self._last_send_key = tx_msgs[idx][POE_PD69200_MSG_OFFSET_KEY]
+        return rx_msgs
+
+    # One request at a time, retry: retry count of the first request
+    def _send_serial(self, queue, tx_msgs, retry=0):
+        rx_msgs = []
+        for (cmd_type, command, delay, msg_type), tx_msg in zip(queue, tx_msgs):
+            self._cmd_type = cmd_type
+            if self._need_msg_pacing(self._last_send_key, tx_msg):
+                self._delay(self._msg_delay)
+            if retry > 0:
+                self._bus_stats.add_retry(cmd_type)
+            else:
+                self._bus_stats.add_transaction(cmd_type)
+            rx_msgs.append(self._transact(tx_msg, delay, retry))
+            self._last_send_key = tx_msg[POE_PD69200_MSG_OFFSET_KEY]
+            retry = 0
+        return rx_msgs
+
+    def _renew_tx_msgs(self, tx_msgs):
+        return [self._renew_tx_msg(tx_msg) for tx_msg in tx_msgs]
+
+    # A pipelined exchange failed: the next request may already be on the
+    # wire, drop its reply and let the bus settle
+    def _batch_error(self, cmd_type, err, tx_msg, rx_msg):
+        self._bus_stats.add_failure(cmd_type, self._comm_err_class(err))
+        clean_msg = self._drain()
+        print_stderr_limited("_communicate_batch error", err=str(err),
+                             send=conv_byte_to_hex(tx_msg),
+                             recv=conv_byte_to_hex(rx_msg),
+                             clean=conv_byte_to_hex(clean_msg))
+        self._delay(self._clear_bus_buffer_delay)
+
+    # Read and drop a pending reply, [] when the read fails as well
+    def _drain(self):
+        try:
+            return self._recv()
+        except Exception:
+            return []
+
+    def get_bus_stats(self):
+        return self._bus_stats.snapshot()
+
+    def reset_bus_stats(self):
+        self._bus_stats.reset()
+
     def reset_poe(self):
         command = [POE_PD69200_MSG_KEY_COMMAND,
                    self._calc_msg_echo(),
@@ -168,31 +597,39 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB1_RESET,
                    0x00,
                    POE_PD69200_MSG_SUB1_RESET]
-        return self._run_communication_protocol(command, self._reset_poe_chip_delay,
-                                                PoeMsgParser.MSG_CMD_STATUS)
+        try:
+            return self._run_communication_protocol("reset_poe", command,
+                                                    self._reset_poe_chip_delay,
+                                                    PoeMsgParser.MSG_CMD_STATUS)
+        finally:
+            self._static_cache.clear()
 
     def restore_factory_default(self):
         command = [POE_PD69200_MSG_KEY_PROGRAM,
                    self._calc_msg_echo(),
                    POE_PD69200_MSG_SUB_RESOTRE_FACT]
-        return self._run_communication_protocol(command, self._restore_factory_default_delay,
-                                                PoeMsgParser.MSG_CMD_STATUS)
+        try:
+            return self._run_communication_protocol("restore_factory_default", command,
+                                                    self._restore_factory_default_delay,
+                                                    PoeMsgParser.MSG_CMD_STATUS)
+        finally:
+            self._static_cache.clear()
 
     def save_system_settings(self):
         command = [POE_PD69200_MSG_KEY_PROGRAM,
                    self._calc_msg_echo(),
                    POE_PD69200_MSG_SUB_E2,
                    POE_PD69200_MSG_SUB1_SAVE_CONFIG]
-        return self._run_communication_protocol(command, self._save_sys_delay,
-                                                PoeMsgParser.MSG_CMD_STATUS)
+        return self._run_communication_protocol("save_system_settings", command,
+                                                self._save_sys_delay, PoeMsgParser.MSG_CMD_STATUS)
 
     def set_user_byte_to_save(self, user_val):
         command = [POE_PD69200_MSG_KEY_PROGRAM,
                    self._calc_msg_echo(),
                    POE_PD69200_MSG_SUB_USER_BYTE,
                    user_val]
-        return self._run_communication_protocol(command, self._save_sys_delay,
-                                                PoeMsgParser.MSG_CMD_STATUS)
+        return self._run_communication_protocol("set_user_byte_to_save", command,
+                                                self._save_sys_delay, PoeMsgParser.MSG_CMD_STATUS)
 
     # System status function
     def set_system_status(self, priv_label):
@@ -201,24 +638,24 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_GLOBAL,
                    POE_PD69200_MSG_SUB1_SYSTEM_STATUS,
                    priv_label]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_CMD_STATUS)
+        return self._run_communication_protocol("set_system_status", command,
+                                                self._msg_delay, PoeMsgParser.MSG_CMD_STATUS)
 
     def get_system_status(self):
         command = [POE_PD69200_MSG_KEY_REQUEST,
                    self._calc_msg_echo(),
                    POE_PD69200_MSG_SUB_GLOBAL,
                    POE_PD69200_MSG_SUB1_SYSTEM_STATUS]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_SYSTEM_STATUS)
+        return self._run_communication_protocol("get_system_status", command,
+                                                self._msg_delay, PoeMsgParser.MSG_SYSTEM_STATUS)
 
     def get_bt_system_status(self):
         command = [POE_PD69200_MSG_KEY_REQUEST,
                    self._calc_msg_echo(),
                    POE_PD69200_MSG_SUB_GLOBAL,
                    POE_PD69200_BT_MSG_SUB1_SYSTEM_STATUS]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_BT_SYSTEM_STATUS)
+        return self._run_communication_protocol("get_bt_system_status", command,
+                                                self._msg_delay, PoeMsgParser.MSG_BT_SYSTEM_STATUS)
 
     def set_individual_mask(self, mask_num, enDis):
         command = [POE_PD69200_MSG_KEY_COMMAND,
@@ -227,8 +664,11 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB1_INDV_MSK,
                    mask_num,
                    enDis]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_CMD_STATUS)
+        try:
+            return self._run_communication_protocol("set_individual_mask", command,
+                                                    self._msg_delay, PoeMsgParser.MSG_CMD_STATUS)
+        finally:
+            self._static_cache.drop(INDV_MASKS, "0x{:02x}".format(mask_num))
 
     def get_individual_mask(self, mask_num):
         command = [POE_PD69200_MSG_KEY_REQUEST,
@@ -236,8 +676,88 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_GLOBAL,
                    POE_PD69200_MSG_SUB1_INDV_MSK,
                    mask_num]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_INDV_MASK)
+        return self._run_communication_protocol("get_individual_mask", command,
+                                                self._msg_delay, PoeMsgParser.MSG_INDV_MASK)
+
+    # {"0x<mask>": enDis} of the masks, only the ones missing from the
+    # static cache are read, in one batch
+    def get_individual_masks(self, mask_list):
+        cached = self._static_cache.get(INDV_MASKS) or {}
+        keys = ["0x{:02x}".format(mask_num) for mask_num in mask_list]
+        missing = [(mask_num, key) for mask_num, key in zip(mask_list, keys)
+                   if key not in cached]
+        if len(missing) > 0:
+            results = self.run_batch([(self.get_individual_mask, (mask_num,))
+                                      for mask_num, key in missing])
+            read = OrderedDict()
+            for (mask_num, key), result in zip(missing, results):
+                read[key] = result.get(ENDIS)
+            self._static_cache.update(INDV_MASKS, read)
+            cached = dict(cached)
+            cached.update(read)
+        masks = OrderedDict()
+        for key in keys:
+            masks[key] = cached[key]
+        return masks
+
+    def set_interrupt_mask(self, mask):
+        command = [POE_PD69200_MSG_KEY_COMMAND,
+                   self._calc_msg_echo(),
+                   POE_PD69200_MSG_SUB_GLOBAL,
+                   POE_PD69200_MSG_SUB1_IRQ_MASK,
+                   mask >> 8,
+                   mask & 0xff]
+        return self._run_communication_protocol("set_interrupt_mask", command,
+                                                self._msg_delay, PoeMsgParser.MSG_CMD_STATUS)
+
+    def get_interrupt_mask(self):
+        command = [POE_PD69200_MSG_KEY_REQUEST,
+                   self._calc_msg_echo(),
+                   POE_PD69200_MSG_SUB_GLOBAL,
+                   POE_PD69200_MSG_SUB1_IRQ_MASK]
+        return self._run_communication_protocol("get_interrupt_mask", command,
+                                                self._msg_delay, PoeMsgParser.MSG_IRQ_MASK)
+
+    # Program the interrupt mask poed relies on, returns None when already
+    # set. BT firmware keeps its own event reporting.
+    def init_interrupt_mask(self, mask=POE_PD69200_INTR_MASK_POED):
+        if self._4wire_bt == 1:
+            return None
+        if self.get_interrupt_mask().get(IRQ_MASK) == mask:
+            return None
+        return self.set_interrupt_mask(mask)
+
+    # Status byte of 11 ports, sub1: POE_PD69200_MSG_SUB1_PORTS_STATUS1..5
+    def get_ports_status_group(self, sub1):
+        command = [POE_PD69200_MSG_KEY_REQUEST,
+                   self._calc_msg_echo(),
+                   POE_PD69200_MSG_SUB_GLOBAL,
+                   sub1]
+        return self._run_communication_protocol("get_ports_status_group", command,
+                                                self._msg_delay,
+                                                PoeMsgParser.MSG_PORTS_STATUS_GROUP)
+
+    # Status byte of every port in bulk: 11 ports per request on AT
+    # firmware, one port parameters request per port on BT firmware
+    def get_all_ports_status(self):
+        total_ports = self.total_poe_port()
+        if self._4wire_bt == 1:
+            results = self.run_batch([(self.get_bt_port_parameters, (port_id,))
+                                      for port_id in range(total_ports)])
+            return [result.get(STATUS) for result in results]
+        groups = (total_ports + POE_PD69200_PORTS_STATUS_GROUP_SIZE - 1) // \
+            POE_PD69200_PORTS_STATUS_GROUP_SIZE
+        results = self.run_batch([(self.get_ports_status_group, (sub1,))
+                                  for sub1 in POE_PD69200_PORTS_STATUS_GROUPS[:groups]])
+        all_status = []
+        for result in results:
+            all_status += result.get(STATUS)
+        return all_status[:total_ports]
+
+    # Platform hook: block until the PoE interrupt line asserts (True) or
+    # the timeout expires (False). None: no interrupt line, poll instead.
+    def wait_poe_irq(self, timeout):
+        return None
 
     def get_software_version(self):
         command = [POE_PD69200_MSG_KEY_REQUEST,
@@ -245,8 +765,75 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_GLOBAL,
                    POE_PD69200_MSG_SUB1_VERSIONZ,
                    POE_PD69200_MSG_SUB2_SW_VERSION]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_SW_VERSION)
+        return self._run_communication_protocol("get_software_version", command,
+                                                self._msg_delay, PoeMsgParser.MSG_SW_VERSION)
+
+    def _matrix_hash(self):
+        return hashlib.sha1(
+            repr(getattr(self, "_default_matrix", None)).encode()).hexdigest()
+
+    def _load_capability(self):
+        try:
+            with open(POE_CAPABILITY_PATH, 'r') as f:
+                cap = json.loads(f.read(), object_pairs_hook=OrderedDict)
+        except (OSError, ValueError):
+            return None
+        # Written in this boot for this platform and port map, and the
+        # firmware version was not dropped from the static cache since
+        # (reset, restore or firmware change)
+        if cap.get(CAP_BOOT_ID) != get_boot_id() or \
+                cap.get(CAP_PLATFORM) != type(self).__name__ or \
+                cap.get(TOTAL_PORTS) != self.total_poe_port() or \
+                cap.get(CAP_MATRIX_HASH) != self._matrix_hash() or \
+                cap.get(SW_VERSION) is None or \
+                cap.get(SW_VERSION) != self._static_cache.get(SW_VERSION):
+            return None
+        return cap
+
+    # Called at the end of the platform constructor: load the capability
+    # descriptor of this boot, or clean up the chip I2C buffer, probe the
+    # firmware and write the descriptor when it is missing or stale.
+    # bt_min_major_ver: minimum firmware major version running 4-wire BT,
+    # None if the platform has no BT firmware
+    def init_capability(self, bt_min_major_ver=None):
+        self._bt_min_major_ver = bt_min_major_ver
+        cap = self._load_capability()
+        if cap is not None:
+            self._4wire_bt = cap[CAP_4WIRE_BT]
+            return cap
+        # Add read 15byte first to cleanup buffer
+        self.plat_poe_read()
+        cap = OrderedDict()
+        cap[CAP_BOOT_ID] = get_boot_id()
+        cap[CAP_PLATFORM] = type(self).__name__
+        cap[TOTAL_PORTS] = self.total_poe_port()
+        cap[CAP_MATRIX_HASH] = self._matrix_hash()
+        cap[SW_VERSION] = self.get_poe_versions(cached=False)
+        if bt_min_major_ver is not None:
+            self._4wire_bt = self.support_4wire_bt(bt_min_major_ver)
+        cap[CAP_4WIRE_BT] = self._4wire_bt
+        try:
+            tmp_path = POE_CAPABILITY_PATH + ".tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(cap, indent = 4))
+            os.replace(tmp_path, POE_CAPABILITY_PATH)
+        except OSError as e:
+            print_stderr("Fail to save: " + POE_CAPABILITY_PATH + ",err: " + str(e))
+        return cap
+
+    # Read the firmware version from the chip (once per poed start): after
+    # a firmware update the static cache is dropped and the capability
+    # descriptor probed again. Returns the firmware version.
+    def check_firmware_version(self):
+        poe_ver = self.get_poe_versions(cached=False)
+        if self._load_capability() is None:
+            self.init_capability(self._bt_min_major_ver)
+            # Records made for the previous firmware may be AT or BT ones
+            for pool in (self._port_pool, self._info_port_pool):
+                for port in pool.values():
+                    port._4wire_bt = self._4wire_bt
+            self._poe_system = None
+        return poe_ver
 
     def support_4wire_bt(self, min_major_ver=3):
         poe_ver = self.get_poe_versions()
@@ -264,8 +851,8 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_CHANNEL,
                    POE_PD69200_MSG_SUB1_TEMP_MATRIX,
                    logic_port, phy_port_a, phy_port_b]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_CMD_STATUS)
+        return self._run_communication_protocol("set_temp_matrix", command,
+                                                self._msg_delay, PoeMsgParser.MSG_CMD_STATUS)
 
     def get_temp_matrix(self, logic_port):
         command = [POE_PD69200_MSG_KEY_REQUEST,
@@ -273,15 +860,19 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_CHANNEL,
                    POE_PD69200_MSG_SUB1_TEMP_MATRIX,
                    logic_port]
-        return self._run_communication_protocol(command, self._msg_delay)
+        return self._run_communication_protocol("get_temp_matrix", command,
+                                                self._msg_delay)
 
     def program_active_matrix(self):
         command = [POE_PD69200_MSG_KEY_COMMAND,
                    self._calc_msg_echo(),
                    POE_PD69200_MSG_SUB_GLOBAL,
                    POE_PD69200_MSG_SUB1_TEMP_MATRIX]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_CMD_STATUS)
+        try:
+            return self._run_communication_protocol("program_active_matrix", command,
+                                                    self._msg_delay, PoeMsgParser.MSG_CMD_STATUS)
+        finally:
+            self._static_cache.drop(ACTIVE_MATRIX)
 
     def get_active_matrix(self, logic_port):
         command = [POE_PD69200_MSG_KEY_REQUEST,
@@ -289,8 +880,29 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_CHANNEL,
                    POE_PD69200_MSG_SUB1_CH_MATRIX,
                    logic_port]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_ACTIVE_MATRIX)
+        return self._run_communication_protocol("get_active_matrix", command,
+                                                self._msg_delay, PoeMsgParser.MSG_ACTIVE_MATRIX)
+
+    # Active matrix {logic port: (phy a, phy b)} of the ports, only the
+    # ones missing from the static cache are read, in one batch
+    def get_active_matrices(self, port_list):
+        cached = self._static_cache.get(ACTIVE_MATRIX) or {}
+        missing = [logic_port for logic_port in port_list
+                   if str(logic_port) not in cached]
+        if len(missing) > 0:
+            results = self.run_batch([(self.get_active_matrix, (logic_port,))
+                                      for logic_port in missing])
+            read = OrderedDict()
+            for logic_port, result in zip(missing, results):
+                read[str(logic_port)] = [result.get(ACTIVE_MATRIX_PHYA),
+                                         result.get(ACTIVE_MATRIX_PHYB)]
+            self._static_cache.update(ACTIVE_MATRIX, read)
+            cached = dict(cached)
+            cached.update(read)
+        active_matrix = OrderedDict()
+        for logic_port in port_list:
+            active_matrix[logic_port] = tuple(cached[str(logic_port)])
+        return active_matrix
 
     def set_port_enDis(self, logic_port, EnDis):
         command = [POE_PD69200_MSG_KEY_COMMAND,
@@ -300,8 +912,8 @@ class PoeDriver_microsemi_pd69200(object):
                    logic_port,
                    POE_PD69200_MSG_DATA_CMD_ENDIS_ONLY | EnDis,
                    POE_PD69200_MSG_DATA_PORT_TYPE_AT]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_CMD_STATUS)
+        return self._run_communication_protocol("set_port_enDis", command,
+                                                self._msg_delay, PoeMsgParser.MSG_CMD_STATUS)
 
     def set_bt_port_enDis(self, logic_port, EnDis):
         command = [POE_PD69200_MSG_KEY_COMMAND,
@@ -314,8 +926,8 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_BT_MSG_DATA_PORT_OP_MODE_NO_CHANGE,
                    POE_PD69200_BT_MSG_DATA_PORT_MODE_POWER_SAME,
                    POE_PD69200_BT_MSG_DATA_PORT_PRIORITY_NO_CHANGE]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_CMD_STATUS)
+        return self._run_communication_protocol("set_bt_port_enDis", command,
+                                                self._msg_delay, PoeMsgParser.MSG_CMD_STATUS)
 
     def get_all_ports_enDis(self):
         # Only support AT/AF Protocol, to speedup setting flow
@@ -324,7 +936,8 @@ class PoeDriver_microsemi_pd69200(object):
                     self._calc_msg_echo(),
                     POE_PD69200_MSG_SUB_GLOBAL,
                     POE_PD69200_MSG_SUB1_EN_DIS]
-            return self._run_communication_protocol(command, self._msg_delay,
+            return self._run_communication_protocol("get_all_ports_enDis", command,
+                                                    self._msg_delay,
                                                     PoeMsgParser.MSG_ALL_PORTS_ENDIS)
         else:
             # Skip Get All port command
@@ -332,7 +945,7 @@ class PoeDriver_microsemi_pd69200(object):
 
     all_ports_enDis = property(get_all_ports_enDis, None)
 
-    # logic_port range: 0x00 to 0x2F, 'AllChannels' = 0x80
+    # logic_port range: 0x00 to 0x2F, 'AllChannels' = POE_PD69200_ALL_CHANNELS
     def set_port_power_limit(self, logic_port, power_limit):
         command = [POE_PD69200_MSG_KEY_COMMAND,
                    self._calc_msg_echo(),
@@ -341,8 +954,8 @@ class PoeDriver_microsemi_pd69200(object):
                    logic_port,
                    power_limit >> 8,
                    power_limit & 0xff]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_CMD_STATUS)
+        return self._run_communication_protocol("set_port_power_limit", command,
+                                                self._msg_delay, PoeMsgParser.MSG_CMD_STATUS)
 
     def get_port_power_limit(self, logic_port):
         command = [POE_PD69200_MSG_KEY_REQUEST,
@@ -350,8 +963,8 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_CHANNEL,
                    POE_PD69200_MSG_SUB1_SUPPLY,
                    logic_port]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_PORT_POWER_LIMIT)
+        return self._run_communication_protocol("get_port_power_limit", command,
+                                                self._msg_delay, PoeMsgParser.MSG_PORT_POWER_LIMIT)
 
     def set_port_priority(self, logic_port, priority):
         command = [POE_PD69200_MSG_KEY_COMMAND,
@@ -360,8 +973,8 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB1_PRIORITY,
                    logic_port,
                    priority]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_CMD_STATUS)
+        return self._run_communication_protocol("set_port_priority", command,
+                                                self._msg_delay, PoeMsgParser.MSG_CMD_STATUS)
 
     def set_bt_port_priority(self, logic_port, priority):
         command = [POE_PD69200_MSG_KEY_COMMAND,
@@ -374,8 +987,8 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_BT_MSG_DATA_PORT_OP_MODE_NO_CHANGE,
                    POE_PD69200_BT_MSG_DATA_PORT_MODE_POWER_SAME,
                    priority]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_CMD_STATUS)
+        return self._run_communication_protocol("set_bt_port_priority", command,
+                                                self._msg_delay, PoeMsgParser.MSG_CMD_STATUS)
 
     def get_port_priority(self, logic_port):
         command = [POE_PD69200_MSG_KEY_REQUEST,
@@ -383,8 +996,8 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_CHANNEL,
                    POE_PD69200_MSG_SUB1_PRIORITY,
                    logic_port]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_PORT_PRIORITY)
+        return self._run_communication_protocol("get_port_priority", command,
+                                                self._msg_delay, PoeMsgParser.MSG_PORT_PRIORITY)
 
     def get_port_status(self, logic_port):
         command = [POE_PD69200_MSG_KEY_REQUEST,
@@ -392,8 +1005,8 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_CHANNEL,
                    POE_PD69200_MSG_SUB1_PORT_STATUS,
                    logic_port]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_PORT_STATUS)
+        return self._run_communication_protocol("get_port_status", command,
+                                                self._msg_delay, PoeMsgParser.MSG_PORT_STATUS)
 
     def set_pm_method(self, pm1, pm2, pm3):
         command = [POE_PD69200_MSG_KEY_COMMAND,
@@ -402,8 +1015,8 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB1_SUPPLY,
                    POE_PD69200_MSG_SUB2_PWR_MANAGE_MODE,
                    pm1, pm2, pm3]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_CMD_STATUS)
+        return self._run_communication_protocol("set_pm_method", command,
+                                                self._msg_delay, PoeMsgParser.MSG_CMD_STATUS)
 
     def get_pm_method(self):
         command = [POE_PD69200_MSG_KEY_REQUEST,
@@ -411,8 +1024,8 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_GLOBAL,
                    POE_PD69200_MSG_SUB1_SUPPLY,
                    POE_PD69200_MSG_SUB2_PWR_MANAGE_MODE]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_PM_METHOD)
+        return self._run_communication_protocol("get_pm_method", command,
+                                                self._msg_delay, PoeMsgParser.MSG_PM_METHOD)
 
     def get_total_power(self):
         command = [POE_PD69200_MSG_KEY_REQUEST,
@@ -420,7 +1033,8 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_GLOBAL,
                    POE_PD69200_MSG_SUB1_SUPPLY,
                    POE_PD69200_MSG_SUB2_TOTAL_PWR]
-        return self._run_communication_protocol(command, self._msg_delay)
+        return self._run_communication_protocol("get_total_power", command,
+                                                self._msg_delay)
 
     def set_power_bank(self, bank, power_limit):
         command = [POE_PD69200_MSG_KEY_COMMAND,
@@ -433,8 +1047,8 @@ class PoeDriver_microsemi_pd69200(object):
         command += [x for x in int(self._max_shutdown_vol).to_bytes(2,byteorder="big")]
         command += [x for x in int(self._min_shutdown_vol).to_bytes(2,byteorder="big")]
         command.append(self._guard_band)
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_CMD_STATUS)
+        return self._run_communication_protocol("set_power_bank", command,
+                                                self._msg_delay, PoeMsgParser.MSG_CMD_STATUS)
 
     def get_power_bank(self, bank):
         command = [POE_PD69200_MSG_KEY_REQUEST,
@@ -443,7 +1057,8 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB1_SUPPLY,
                    POE_PD69200_MSG_SUB2_PWR_BUDGET,
                    bank]
-        return self._run_communication_protocol(command, self._msg_delay)
+        return self._run_communication_protocol("get_power_bank", command,
+                                                self._msg_delay, PoeMsgParser.MSG_POWER_BANK)
 
     def get_power_supply_params(self):
         command = [POE_PD69200_MSG_KEY_REQUEST,
@@ -451,7 +1066,8 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_GLOBAL,
                    POE_PD69200_MSG_SUB1_SUPPLY,
                    POE_PD69200_MSG_SUB2_MAIN]
-        return self._run_communication_protocol(command, self._msg_delay,
+        return self._run_communication_protocol("get_power_supply_params", command,
+                                                self._msg_delay,
                                                 PoeMsgParser.MSG_POWER_SUPPLY_PARAMS)
 
     def get_port_measurements(self, logic_port):
@@ -460,8 +1076,8 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_CHANNEL,
                    POE_PD69200_MSG_SUB1_PARAMZ,
                    logic_port]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_PORT_MEASUREMENTS)
+        return self._run_communication_protocol("get_port_measurements", command,
+                                                self._msg_delay, PoeMsgParser.MSG_PORT_MEASUREMENTS)
 
     def get_bt_port_measurements(self, logic_port):
         command = [POE_PD69200_MSG_KEY_REQUEST,
@@ -469,7 +1085,8 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_CHANNEL,
                    POE_PD69200_BT_MSG_SUB1_PORTS_MEASUREMENT,
                    logic_port]
-        return self._run_communication_protocol(command, self._msg_delay,
+        return self._run_communication_protocol("get_bt_port_measurements", command,
+                                                self._msg_delay,
                                                 PoeMsgParser.MSG_BT_PORT_MEASUREMENTS)
 
     def get_poe_device_parameters(self, csnum):
@@ -478,37 +1095,436 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_GLOBAL,
                    POE_PD69200_MSG_SUB1_DEV_PARAMS,
                    csnum]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_POE_DEVICE_STATUS)
-
-    def get_poe_versions(self):
+        return self._run_communication_protocol("get_poe_device_parameters", command,
+                                                self._msg_delay, PoeMsgParser.MSG_POE_DEVICE_STATUS)
+
+    # cached=False reads the version from the chip and drops the whole
+    # static cache when the firmware changed
+    def get_poe_versions(self, cached=True):
+        if cached:
+            poe_ver = self._static_cache.get(SW_VERSION)
+            if poe_ver is not None:
+                return poe_ver
         versions = self.get_software_version()
         prod = str(versions.get(PROD_NUM))
         sw_ver = int(versions.get(SW_VERSION))
         major_ver = str(int(sw_ver / 100))
         minor_ver = str(int(sw_ver / 10) % 10)
         pa_ver = str(int(sw_ver % 10))
-        return prod + "." + major_ver + "." + minor_ver + "." + pa_ver
+        poe_ver = prod + "." + major_ver + "." + minor_ver + "." + pa_ver
+        last_ver = self._static_cache.get(SW_VERSION)
+        if last_ver is not None and last_ver != poe_ver:
+            print_stderr("PoE firmware changed ({0} -> {1}), drop static cache".format(
+                last_ver, poe_ver))
+            self._static_cache.clear()
+        if last_ver != poe_ver:
+            self._static_cache.set(SW_VERSION, poe_ver)
+        return poe_ver
 
     def get_current_power_bank(self):
         params = self.get_power_supply_params()
         return params.get(POWER_BANK)
 
+    # Platform hook: PSU presence/power good state as any comparable value,
+    # read without the PoE bus (e.g. from the CPLD). None: unknown.
+    def get_psu_presence(self):
+        return None
+
+    # Get System Status, Get BT System Status on BT firmware. Reading it
+    # clears the events latched by the chip: when published_system_status
+    # is set (poed is running), the status poed read last is used instead.
+    def read_system_status(self):
+        if self.published_system_status is not None:
+            return self.published_system_status()
+        if self._4wire_bt == 1:
+            status = self.get_bt_system_status()
+        else:
+            status = self.get_system_status()
+        self.last_system_status = status
+        return status
+
+    # Read the events latched by the chip with a single request and sort
+    # them by what has to be re-read: the interrupt register on AT firmware,
+    # the event exist flag on BT firmware (which does not tell the cause).
+    def poll_chip_events(self):
+        events = OrderedDict()
+        if self._4wire_bt == 1:
+            raw = self.read_system_status().get(EVENT_EXIST)
+            # Level flag, only a change of it is a new event
+            changed = raw != self._last_event_exist
+            self._last_event_exist = raw
+            events[EVENT_PORT] = changed
+            events[EVENT_SYSTEM] = changed
+            events[EVENT_POWER] = changed
+        else:
+            raw = self.read_system_status().get(INTR_REG)
+            events[EVENT_PORT] = (raw & POE_PD69200_INTR_PORT_EVENTS) != 0
+            events[EVENT_SYSTEM] = (raw & POE_PD69200_INTR_SYSTEM_EVENTS) != 0
+            events[EVENT_POWER] = (raw & POE_PD69200_INTR_POWER_EVENTS) != 0
+        events[CHIP_EVENTS] = raw
+        return events
+
+    # Run several lists of batchable calls as a single batch and split the
+    # results back per section, e.g. to snapshot the chip state in one go.
+    def run_batch_sections(self, sections):
+        calls = []
+        for name in sections:
+            calls += sections[name]
+        results = self.run_batch(calls)
+        section_results = OrderedDict()
+        for name in sections:
+            section_results[name] = results[:len(sections[name])]
+            results = results[len(sections[name]):]
+        return section_results
+
+    def ports_state_calls(self, port_list):
+        if len(port_list) == 0:
+            return []
+        if self._4wire_bt == 1:
+            return [(self.get_bt_port_parameters, (port_id,))
+                    for port_id in port_list]
+        calls = [(self.get_all_ports_enDis, ())]
+        for port_id in port_list:
+            calls += [(self.get_port_priority, (port_id,)),
+                      (self.get_port_power_limit, (port_id,))]
+        return calls
+
+    # Current port settings in driver values, {port_id: {ENDIS, PRIORITY,
+    # POWER_LIMIT (AT only), OPERATION_MODE (BT only)}}
+    def ports_state_from_results(self, port_list, results):
+        ports_state = OrderedDict()
+        if len(port_list) == 0:
+            return ports_state
+        if self._4wire_bt == 1:
+            for port_id, params in zip(port_list, results):
+                ports_state[port_id] = {
+                    ENDIS: params.get(ENDIS),
+                    PRIORITY: params.get(PRIORITY),
+                    OPERATION_MODE: params.get(OPERATION_MODE)
+                }
+            return ports_state
+        all_endis = results[0].get(ENDIS)
+        results = results[1:]
+        for idx, port_id in enumerate(port_list):
+            ports_state[port_id] = {
+                ENDIS: all_endis[port_id] if port_id < len(all_endis) else None,
+                PRIORITY: results[2 * idx].get(PRIORITY),
+                POWER_LIMIT: results[2 * idx + 1].get(PPL)
+            }
+        return ports_state
+
+    def get_ports_state(self, port_list):
+        return self.ports_state_from_results(
+            port_list, self.run_batch(self.ports_state_calls(port_list)))
+
+    # Compare wanted port settings ({port_id: cfg params}, as in the poe
+    # config) with the chip state and return the (port_id, field, value)
+    # changes in driver values. Power limit is not supported on BT firmware.
+    def diff_ports_state(self, wanted, ports_state):
+        changes = []
+        for port_id in wanted:
+            params = wanted[port_id]
+            current = ports_state.get(port_id, {})
+            if ENDIS in params:
+                set_val = TBL_ENDIS_TO_DRV[params[ENDIS]]
+                if current.get(ENDIS) != set_val:
+                    changes.append((port_id, ENDIS, set_val))
+            if PRIORITY in params:
+                set_val = TBL_PRIORITY_TO_DRV[params[PRIORITY]]
+                if current.get(PRIORITY) != set_val:
+                    changes.append((port_id, PRIORITY, set_val))
+            if POWER_LIMIT in params and self._4wire_bt != 1:
+                set_val = params[POWER_LIMIT]
+                if current.get(POWER_LIMIT) != set_val:
+                    changes.append((port_id, POWER_LIMIT, set_val))
+        return changes
+
+    # Check the port settings of a poe config (PORT_CONFIGS list) and
+    # return them as {port_id: cfg params}, raises on invalid entries
+    def ports_cfg_to_wanted(self, port_configs):
+        wanted = OrderedDict()
+        for params in port_configs:
+            port_id = params.get(PORT_ID)
+            if type(port_id) is not int or port_id < 1 or \
+                    port_id > self.total_poe_port():
+                raise RuntimeError("Invalid port id: %s" % str(port_id))
+            if ENDIS in params and params[ENDIS] not in TBL_ENDIS_TO_DRV:
+                raise RuntimeError("Port[%d] invalid %s: %s" % (
+                    port_id, ENDIS, str(params[ENDIS])))
+            if PRIORITY in params and params[PRIORITY] not in TBL_PRIORITY_TO_DRV:
+                raise RuntimeError("Port[%d] invalid %s: %s" % (
+                    port_id, PRIORITY, str(params[PRIORITY])))
+            if POWER_LIMIT in params and (type(params[POWER_LIMIT]) is not int or
+                                          not 0 <= params[POWER_LIMIT] <= 0xffff):
+                raise RuntimeError("Port[%d] invalid %s: %s" % (
+                    port_id, POWER_LIMIT, str(params[POWER_LIMIT])))
+            wanted[port_id - 1] = params
+        return wanted
+
+    def port_change_call(self, port_id, field, set_val):
+        if field == ENDIS:
+            if self._4wire_bt == 1:
+                return (self.set_bt_port_enDis, (port_id, set_val))
+            return (self.set_port_enDis, (port_id, set_val))
+        elif field == PRIORITY:
+            if self._4wire_bt == 1:
+                return (self.set_bt_port_priority, (port_id, set_val))
+            return (self.set_port_priority, (port_id, set_val))
+        elif field == POWER_LIMIT:
+            if self._4wire_bt == 1:
+                raise RuntimeError("Not support on BT firmware")
+            return (self.set_port_power_limit, (port_id, set_val))
+        raise RuntimeError("Unknown port setting: %s" % str(field))
+
+    # Send (port_id, field, value) changes in one batch, returns the
+    # command status of every change
+    def apply_port_changes(self, changes):
+        with self.bus_priority(BUS_PRIO_CONTROL):
+            return self.run_batch([self.port_change_call(port_id, field, set_val)
+                                   for (port_id, field, set_val) in changes])
+
+    # Batch set engine: apply a list of (port_id, field, value) changes in
+    # driver values as one bus transaction. Duplicates are dropped (the last
+    # value wins), BT enable and priority of a port are merged into one
+    # command, and everything is validated before the first write. With
+    # verify, each command is followed by the read back of what it set, so
+    # two commands are never sent back to back and the pacing delay between
+    # them is not needed. Returns one result per (port_id, field) with the
+    # command status and, when verified, the read back value.
+    def set_ports_params(self, changes, verify=True):
+        merged = OrderedDict()
+        for (port_id, field, set_val) in changes:
+            if field not in (ENDIS, PRIORITY, POWER_LIMIT):
+                raise RuntimeError("Unknown port setting: %s" % str(field))
+            if field == POWER_LIMIT and self._4wire_bt == 1:
+                raise RuntimeError("Not support on BT firmware")
+            if port_id < 0 or port_id >= self.total_poe_port():
+                raise RuntimeError("Invalid port id: %s" % str(port_id))
+            merged.setdefault(port_id, OrderedDict())[field] = set_val
+
+        # (set call, verify call, [(field, value)]) per command
+        ops = []
+        for port_id in merged:
+            fields = merged[port_id]
+            if self._4wire_bt == 1:
+                ops.append(((self.set_bt_port_enDis_priority,
+                             (port_id, fields.get(ENDIS), fields.get(PRIORITY))),
+                            (self.get_bt_port_parameters, (port_id,)),
+                            list(fields.items())))
+                continue
+            for field in fields:
+                if field == ENDIS:
+                    verify_call = (self.get_port_status, (port_id,))
+                elif field == PRIORITY:
+                    verify_call = (self.get_port_priority, (port_id,))
+                else:
+                    verify_call = (self.get_port_power_limit, (port_id,))
+                ops.append((self.port_change_call(port_id, field, fields[field]),
+                            verify_call, [(field, fields[field])]))
+
+        calls = []
+        for (set_call, verify_call, fields) in ops:
+            calls.append(set_call)
+            if verify:
+                calls.append(verify_call)
+        with self.bus_priority(BUS_PRIO_CONTROL):
+            results = self.run_batch(calls)
+
+        ret_list = []
+        step = 2 if verify else 1
+        for idx, (set_call, verify_call, fields) in enumerate(ops):
+            port_id = set_call[1][0]
+            result = results[idx * step]
+            readback = results[idx * step + 1] if verify else None
+            for (field, set_val) in fields:
+                item = OrderedDict()
+                item["idx"] = port_id
+                item["field"] = field
+                item["value"] = set_val
+                item[CMD_RESULT_RET] = result
+                if readback is not None:
+                    item["readback"] = readback.get(
+                        PPL if field == POWER_LIMIT else field)
+                    if result == 0 and item["readback"] != set_val:
+                        item[CMD_RESULT_RET] = -1
+                ret_list.append(item)
+        return ret_list
+
+    # Broadcast {field: value} settings in driver values to all channels
+    # ('AllChannels' logic port): one command per setting, or one for
+    # enable and priority on BT firmware, instead of one per port. With
+    # verify, the ports of port_list (default: all ports) are read back in
+    # bulk and the ones that did not take a setting are set one by one with
+    # set_ports_params(). Returns results in the set_ports_params() format,
+    # idx is POE_PD69200_ALL_CHANNELS for the broadcast commands.
+    def set_all_ports_params(self, params, port_list=None, verify=True):
+        for field in params:
+            if field not in (ENDIS, PRIORITY, POWER_LIMIT):
+                raise RuntimeError("Unknown port setting: %s" % str(field))
+            if field == POWER_LIMIT and self._4wire_bt == 1:
+                raise RuntimeError("Not support on BT firmware")
+        if port_list is None:
+            port_list = list(range(self.total_poe_port()))
+
+        if self._4wire_bt == 1:
+            ops = [((self.set_bt_port_enDis_priority,
+                     (POE_PD69200_ALL_CHANNELS, params.get(ENDIS),
+                      params.get(PRIORITY))), list(params.keys()))]
+        else:
+            ops = [(self.port_change_call(POE_PD69200_ALL_CHANNELS, field,
+                                          params[field]), [field])
+                   for field in params]
+        with self.bus_priority(BUS_PRIO_CONTROL):
+            results = self.run_batch([call for (call, fields) in ops])
+        ret_list = []
+        for (call, fields), result in zip(ops, results):
+            for field in fields:
+                item = OrderedDict()
+                item["idx"] = POE_PD69200_ALL_CHANNELS
+                item["field"] = field
+                item["value"] = params[field]
+                item[CMD_RESULT_RET] = result
+                ret_list.append(item)
+        if not verify or len(port_list) == 0:
+            return ret_list
+
+        # Enable state alone is a single request on AT firmware
+        if self._4wire_bt == 0 and list(params.keys()) == [ENDIS]:
+            all_endis = self.get_all_ports_enDis().get(ENDIS)
+            ports_state = OrderedDict(
+                (port_id, {ENDIS: all_endis[port_id]}) for port_id in port_list)
+        else:
+            ports_state = self.get_ports_state(port_list)
+        retry = [(port_id, field, params[field]) for port_id in port_list
+                 for field in params
+                 if ports_state[port_id].get(field) != params[field]]
+        if len(retry) > 0:
+            ret_list += self.set_ports_params(retry)
+        return ret_list
+
+    # Differential platform init helpers: each one takes the chip state read
+    # in bulk beforehand, sends only the settings that differ and returns
+    # (results, number of skipped settings).
+    def init_port_params(self, default_param, ports_state):
+        wanted = OrderedDict((port_id, default_param) for port_id in ports_state)
+        changes = self.diff_ports_state(wanted, ports_state)
+        changed_fields = OrderedDict()
+        for (port_id, field, set_val) in changes:
+            changed_fields[field] = set_val
+        ret_list = []
+        # Every port gets the same defaults: broadcast the settings that
+        # differ when this takes fewer commands than setting port by port
+        if set(range(self.total_poe_port())).issubset(ports_state) and \
+                len(changes) > len(changed_fields):
+            port_list = [port_id for port_id in ports_state
+                         if port_id < self.total_poe_port()]
+            for item in self.set_all_ports_params(changed_fields, port_list):
+                ret_list.append({
+                    "idx": item["idx"],
+                    "field": item["field"],
+                    CMD_RESULT_RET: item[CMD_RESULT_RET]
+                })
+        else:
+            results = self.apply_port_changes(changes)
+            for (port_id, field, set_val), result in zip(changes, results):
+                ret_list.append({
+                    "idx": port_id,
+                    "field": field,
+                    CMD_RESULT_RET: result
+                })
+        fields = [field for field in (ENDIS, PRIORITY, POWER_LIMIT)
+                  if field in default_param and
+                  (field != POWER_LIMIT or self._4wire_bt != 1)]
+        return ret_list, len(wanted) * len(fields) - len(changes)
+
+    def power_banks_calls(self, power_banks):
+        return [(self.get_power_bank, (bank,)) for (bank, power_limit) in power_banks]
+
+    def init_power_banks(self, power_banks, results):
+        calls = []
+        settings = []
+        for (bank, power_limit), current in zip(power_banks, results):
+            if current.get(POWER_LIMIT) == power_limit and \
+                    current.get(MAX_SD_VOLT) == self._max_shutdown_vol and \
+                    current.get(MIN_SD_VOLT) == self._min_shutdown_vol and \
+                    current.get(GUARD_BAND) == self._guard_band:
+                continue
+            calls.append((self.set_power_bank, (bank, power_limit)))
+            settings.append((bank, power_limit))
+        ret_list = []
+        for setting, result in zip(settings, self.run_batch(calls)):
+            ret_list.append({
+                "setting": setting,
+                CMD_RESULT_RET: result
+            })
+        return ret_list, len(power_banks) - len(settings)
+
+    def init_pm_method(self, pm1, pm2, pm3, current):
+        if current.get(PM1) == pm1 and current.get(PM2) == pm2 and \
+                current.get(PM3) == pm3:
+            return None, 1
+        return {CMD_RESULT_RET: self.set_pm_method(pm1, pm2, pm3)}, 0
+
+    def init_bt_port_operation_mode(self, port_modes, ports_state):
+        calls = []
+        for port_id in port_modes:
+            if ports_state.get(port_id, {}).get(OPERATION_MODE) != port_modes[port_id]:
+                calls.append((self.set_bt_port_operation_mode,
+                              (port_id, port_modes[port_id])))
+        ret_list = []
+        for (func, args), result in zip(calls, self.run_batch(calls)):
+            ret_list.append({
+                "idx": args[0],
+                CMD_RESULT_RET: result
+            })
+        return ret_list, len(port_modes) - len(calls)
+
+    def _pooled_port(self, pool, port_id):
+        port = pool.get(port_id)
+        if port is None:
+            port = poePort(self, port_id)
+            pool[port_id] = port
+        return port
+
+    # Long-lived record of a port, the same object on every call
     def get_poe_port(self, port_id):
-        return poePort(self, port_id)
+        return self._pooled_port(self._port_pool, port_id)
+
+    # Refresh one data class (PORT_DATA_CONFIG, PORT_DATA_MEASUREMENT or
+    # None for both) of long-lived poePort objects in one batch
+    def update_ports(self, ports, data_class=None):
+        port_calls = []
+        for port in ports:
+            if data_class == PORT_DATA_MEASUREMENT:
+                port_calls.append(port.measurement_calls())
+            elif data_class == PORT_DATA_CONFIG:
+                port_calls.append(port.config_calls())
+            else:
+                port_calls.append(port.status_calls())
+        results = self.run_batch([call for calls in port_calls for call in calls])
+        for port, calls in zip(ports, port_calls):
+            port_results = results[:len(calls)]
+            results = results[len(calls):]
+            if data_class == PORT_DATA_MEASUREMENT:
+                port.apply_measurement_results(port_results)
+            elif data_class == PORT_DATA_CONFIG:
+                port.apply_config_results(port_results)
+            else:
+                port.apply_status_results(port_results)
 
     def get_poe_system(self):
-        return poeSystem()
+        if self._poe_system is None:
+            self._poe_system = poeSystem(self)
+        return self._poe_system
 
     def get_ports_information(self, portList, more_info=True):
-        ports_info = []
-        for portidx in portList:
-            info = poePort(self, portidx).get_current_status(more_info)
-            ports_info.append(info)
-        return ports_info
+        ports = [self._pooled_port(self._info_port_pool, portidx)
+                 for portidx in portList]
+        self.update_ports(ports)
+        return [port.current_status(more_info) for port in ports]
 
     def get_system_information(self, more_info=True):
-        return poeSystem(self).get_current_status(more_info)
+        return self.get_poe_system().get_current_status(more_info)
 
     def get_bt_port_parameters(self, logic_port):
         command = [POE_PD69200_MSG_KEY_REQUEST,
@@ -516,7 +1532,8 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_CHANNEL,
                    POE_PD69200_BT_MSG_SUB1_PORTS_PARAMETERS,
                    logic_port]
-        return self._run_communication_protocol(command, self._msg_delay,
+        return self._run_communication_protocol("get_bt_port_parameters", command,
+                                                self._msg_delay,
                                                 PoeMsgParser.MSG_BT_PORT_PARAMETERS)
 
     def get_bt_port_class(self, logic_port):
@@ -525,8 +1542,8 @@ class PoeDriver_microsemi_pd69200(object):
                    POE_PD69200_MSG_SUB_CHANNEL,
                    POE_PD69200_BT_MSG_SUB1_PORTS_CLASS,
                    logic_port]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_BT_PORT_CLASS)
+        return self._run_communication_protocol("get_bt_port_class", command,
+                                                self._msg_delay, PoeMsgParser.MSG_BT_PORT_CLASS)
 
     def set_bt_port_operation_mode(self, logic_port, mode):
         command = [POE_PD69200_MSG_KEY_COMMAND,
@@ -539,8 +1556,30 @@ class PoeDriver_microsemi_pd69200(object):
                    mode,
                    POE_PD69200_BT_MSG_DATA_PORT_MODE_POWER_SAME,
                    POE_PD69200_BT_MSG_DATA_PORT_PRIORITY_NO_CHANGE]
-        return self._run_communication_protocol(command, self._msg_delay,
-                                                PoeMsgParser.MSG_CMD_STATUS)
+        return self._run_communication_protocol("set_bt_port_operation_mode", command,
+                                                self._msg_delay, PoeMsgParser.MSG_CMD_STATUS)
+
+    # Set enable/disable and priority in one BT port parameters command,
+    # None leaves the setting unchanged
+    def set_bt_port_enDis_priority(self, logic_port, EnDis, priority):
+        if EnDis is None:
+            EnDis = POE_PD69200_BT_MSG_DATA_CMD_ENDIS_NO_CHAGNE
+        else:
+            EnDis = POE_PD69200_MSG_DATA_CMD_ENDIS_ONLY | EnDis
+        if priority is None:
+            priority = POE_PD69200_BT_MSG_DATA_PORT_PRIORITY_NO_CHANGE
+        command = [POE_PD69200_MSG_KEY_COMMAND,
+                   self._calc_msg_echo(),
+                   POE_PD69200_MSG_SUB_CHANNEL,
+                   POE_PD69200_BT_MSG_SUB1_PORTS_PARAMETERS,
+                   logic_port,
+                   EnDis,
+                   POE_PD69200_BT_MSG_DATA_PORT_MODE_NO_CHANGE | POE_PD69200_BT_MSG_DATA_PORT_CLASS_ERROR_NO_CHANGE,
+                   POE_PD69200_BT_MSG_DATA_PORT_OP_MODE_NO_CHANGE,
+                   POE_PD69200_BT_MSG_DATA_PORT_MODE_POWER_SAME,
+                   priority]
+        return self._run_communication_protocol("set_bt_port_enDis_priority", command,
+                                                self._msg_delay, PoeMsgParser.MSG_CMD_STATUS)
 
 
 class PoeMsgParser(object):
@@ -560,6 +1599,9 @@ class PoeMsgParser(object):
     MSG_BT_SYSTEM_STATUS = 14
     MSG_BT_PORT_CLASS = 15
     MSG_ACTIVE_MATRIX = 16
+    MSG_POWER_BANK = 17
+    MSG_IRQ_MASK = 18
+    MSG_PORTS_STATUS_GROUP = 19
     MSG_CMD_STATUS = 255
 
     def _to_word(self, byteH, byteL):
@@ -725,6 +1767,18 @@ class PoeMsgParser(object):
             [msg[POE_PD69200_MSG_OFFSET_SUB], msg[POE_PD69200_MSG_OFFSET_SUB1]]), byteorder='big')
         return parsed_data
 
+    def _parse_power_bank(self, msg):
+        parsed_data = {
+            POWER_LIMIT: self._to_word(msg[POE_PD69200_MSG_OFFSET_SUB],
+                                       msg[POE_PD69200_MSG_OFFSET_SUB1]),
+            MAX_SD_VOLT: self._to_word(msg[POE_PD69200_MSG_OFFSET_SUB2],
+                                       msg[POE_PD69200_MSG_OFFSET_DATA5]),
+            MIN_SD_VOLT: self._to_word(msg[POE_PD69200_MSG_OFFSET_DATA6],
+                                       msg[POE_PD69200_MSG_OFFSET_DATA7]),
+            GUARD_BAND: msg[POE_PD69200_MSG_OFFSET_DATA8]
+        }
+        return parsed_data
+
     def _parse_active_matrix(self, msg):
         parsed_data = {
             ACTIVE_MATRIX_PHYA: msg[POE_PD69200_MSG_OFFSET_SUB],
@@ -733,6 +1787,20 @@ class PoeMsgParser(object):
         }
         return parsed_data
 
+    def _parse_irq_mask(self, msg):
+        parsed_data = {
+            IRQ_MASK: self._to_word(msg[POE_PD69200_MSG_OFFSET_SUB],
+                                    msg[POE_PD69200_MSG_OFFSET_SUB1])
+        }
+        return parsed_data
+
+    def _parse_ports_status_group(self, msg):
+        parsed_data = {
+            STATUS: msg[POE_PD69200_MSG_OFFSET_SUB:POE_PD69200_MSG_OFFSET_SUB +
+                        POE_PD69200_PORTS_STATUS_GROUP_SIZE]
+        }
+        return parsed_data
+
     def parse(self, msg, msg_type):
         if msg_type == self.MSG_PORT_POWER_LIMIT:
             return self._parse_port_power_limit(msg)
@@ -766,11 +1834,25 @@ class PoeMsgParser(object):
             return self._parse_bt_port_measurements(msg)
         elif msg_type == self.MSG_ACTIVE_MATRIX:
             return self._parse_active_matrix(msg)
+        elif msg_type == self.MSG_POWER_BANK:
+            return self._parse_power_bank(msg)
+        elif msg_type == self.MSG_IRQ_MASK:
+            return self._parse_irq_mask(msg)
+        elif msg_type == self.MSG_PORTS_STATUS_GROUP:
+            return self._parse_ports_status_group(msg)
         elif msg_type == self.MSG_CMD_STATUS:
             return self._parse_cmd_status(msg)
         return {}
 
+# Port and system records are pooled by the driver (get_poe_port(),
+# get_ports_information(), get_poe_system()) and refreshed in place, dicts are only built for the
+# JSON/CLI output by current_status()/get_current_status()
 class poePort(object):
+    __slots__ = ("poe_plat", "port_id", "enDis", "status", "priority",
+                 "protocol", "latch", "class_type", "FPairEn", "power_consump",
+                 "power_limit", "voltage", "current", "measured_class",
+                 "status_code", "_4wire_bt")
+
     def __init__(self, poe_plat, port_id):
         self.poe_plat = poe_plat
         self.port_id = port_id
@@ -786,12 +1868,50 @@ class poePort(object):
         self.voltage = 0
         self.current = 0
         self.measured_class = 0
+        # Raw port status code of the last config read, None before it
+        self.status_code = None
         self._4wire_bt = self.poe_plat._4wire_bt
 
+    # Port data is read in two classes refreshed at different rates:
+    # config (enable, status, priority, limit, class) and measurement
+    # (power, voltage, current)
+    def config_calls(self):
+        if self._4wire_bt == 1:
+            return [(self.poe_plat.get_bt_port_parameters, (self.port_id,)),
+                    (self.poe_plat.get_bt_port_class, (self.port_id,))]
+        else:
+            return [(self.poe_plat.get_port_status, (self.port_id,)),
+                    (self.poe_plat.get_port_priority, (self.port_id,)),
+                    (self.poe_plat.get_port_power_limit, (self.port_id,))]
+
+    def measurement_calls(self):
+        if self._4wire_bt == 1:
+            return [(self.poe_plat.get_bt_port_measurements, (self.port_id,))]
+        else:
+            return [(self.poe_plat.get_port_measurements, (self.port_id,))]
+
+    def status_calls(self):
+        return self.config_calls() + self.measurement_calls()
+
     def update_port_status(self):
+        self.apply_status_results(
+            self.poe_plat.run_batch(self.status_calls()))
+
+    def apply_status_results(self, results):
+        config_len = len(self.config_calls())
+        self.apply_config_results(results[:config_len])
+        self.apply_measurement_results(results[config_len:])
+
+    def apply_measurement_results(self, results):
+        [meas] = results
+        self.current = meas.get(CURRENT)
+        self.power_consump = meas.get(POWER_CONSUMP)
+        self.voltage = meas.get(VOLTAGE)
+
+    def apply_config_results(self, results):
         if self._4wire_bt == 1:
-            params = self.poe_plat.get_bt_port_parameters(self.port_id)
-            params_class = self.poe_plat.get_bt_port_class(self.port_id)
+            [params, params_class] = results
+            self.status_code = params.get(STATUS)
             self.status = TBL_BT_STATUS_TO_CFG[params.get(STATUS)]
             self.enDis = TBL_ENDIS_TO_CFG[params.get(ENDIS)]
             self.measured_class = params_class.get(MEASURED_CLASS) >> 4
@@ -808,37 +1928,39 @@ class poePort(object):
 
             self.priority = TBL_PRIORITY_TO_CFG[params.get(PRIORITY)]
 
-            power_limit = self.poe_plat.get_bt_port_class(self.port_id)
-            port_class = (power_limit.get(CLASS) >> 4)
+            port_class = (params_class.get(CLASS) >> 4)
             self.class_type = TBL_BT_CLASS_TO_CFG[port_class]
-            self.power_limit = power_limit.get(TPPL)
-
-            meas = self.poe_plat.get_bt_port_measurements(self.port_id)
-            self.current = meas.get(CURRENT)
-            self.power_consump = meas.get(POWER_CONSUMP)
-            self.voltage = meas.get(VOLTAGE)
+            self.power_limit = params_class.get(TPPL)
         else:
-            status = self.poe_plat.get_port_status(self.port_id)
+            [status, priority, power_limit] = results
             self.enDis = TBL_ENDIS_TO_CFG[status.get(ENDIS)]
+            self.status_code = status.get(STATUS)
             self.status = TBL_STATUS_TO_CFG[status.get(STATUS)]
             self.latch = status.get(LATCH)
             self.class_type = TBL_CLASS_TO_CFG[status.get(CLASS)]
             self.protocol = TBL_PROTOCOL_TO_CFG[status.get(PROTOCOL)]
             self.FPairEn = status.get(EN_4PAIR)
 
-            priority = self.poe_plat.get_port_priority(self.port_id)
             self.priority = TBL_PRIORITY_TO_CFG[priority.get(PRIORITY)]
 
-            power_limit = self.poe_plat.get_port_power_limit(self.port_id)
             self.power_limit = power_limit.get(PPL)
 
-            meas = self.poe_plat.get_port_measurements(self.port_id)
-            self.current = meas.get(CURRENT)
-            self.power_consump = meas.get(POWER_CONSUMP)
-            self.voltage = meas.get(VOLTAGE)
+    # Last measurement in power (mW), voltage (V), current (mA) and the
+    # raw status code, as current_status() scales them
+    def telemetry_sample(self):
+        if self.power_consump is None or self.voltage is None:
+            return (None, None, self.current, self.status_code)
+        if self._4wire_bt == 1:
+            power = self.power_consump * 100
+        else:
+            power = self.power_consump
+        return (power, self.voltage / 10, self.current, self.status_code)
 
     def get_current_status(self, more_info=True):
         self.update_port_status()
+        return self.current_status(more_info)
+
+    def current_status(self, more_info=True):
         port_status = OrderedDict()
         if self._4wire_bt == 1:
             port_status[PORT_ID] = self.port_id + 1
@@ -950,6 +2072,13 @@ class poePort(object):
         return ret_flag
 
 class poeSystem(object):
+    __slots__ = ("poe_plat", "total_ports", "total_power", "power_consump",
+                 "power_avail", "power_bank", "max_sd_volt", "min_sd_volt",
+                 "power_src", "cpu_status1", "cpu_status2", "fac_default",
+                 "gie", "priv_label", "user_byte", "device_fail", "temp_disco",
+                 "temp_alarm", "intr_reg", "pm1", "pm2", "pm3", "nvm_user_byte",
+                 "found_device", "event_exist", "_4wire_bt")
+
     def __init__(self, poe_plat):
         self.poe_plat = poe_plat
         self.total_ports = 0
@@ -989,15 +2118,17 @@ class poeSystem(object):
         self.power_bank = params.get(POWER_BANK)
         self.power_src = self.poe_plat.bank_to_psu_str(self.power_bank)
         if self._4wire_bt == 1:
-            system_status = self.poe_plat.get_bt_system_status()
+            system_status = self.poe_plat.read_system_status()
             self.cpu_status2 = system_status.get(CPU_STATUS2)
             self.fac_default = system_status.get(FAC_DEFAULT)
             self.priv_label = system_status.get(PRIV_LABEL)
             self.nvm_user_byte = system_status.get(NVM_USER_BYTE)
             self.found_device = system_status.get(FOUND_DEVICE)
             self.event_exist = system_status.get(EVENT_EXIST)
+            # Seen here, not a new event for poll_chip_events()
+            self.poe_plat._last_event_exist = self.event_exist
         else:
-            system_status = self.poe_plat.get_system_status()
+            system_status = self.poe_plat.read_system_status()
             self.cpu_status1 = system_status.get(CPU_STATUS1)
             self.cpu_status2 = system_status.get(CPU_STATUS2)
             self.fac_default = system_status.get(FAC_DEFAULT)
@@ -20,6 +20,16 @@ POE_PD69200_MSG_CSUM_LEN = 2
 POE_PD69200_MSG_N = 0x4E
 POE_PD69200_COMM_RETRY_TIMES = 6
 
+# PD69200 Communication failure classes (bus statistics)
+POE_PD69200_COMM_ERR_LENGTH = "length"
+POE_PD69200_COMM_ERR_NOT_READY = "not_ready"
+POE_PD69200_COMM_ERR_KEY = "key_mismatch"
+POE_PD69200_COMM_ERR_ECHO = "echo_mismatch"
+POE_PD69200_COMM_ERR_CSUM = "checksum"
+POE_PD69200_COMM_ERR_IO = "io"
+POE_PD69200_COMM_ERR_OTHER = "other"
+POE_PD69200_COMM_ERR_EXHAUSTED = "retry_exhausted"
+
 # PD69200 Message Structure
 POE_PD69200_MSG_OFFSET_KEY = 0
 POE_PD69200_MSG_OFFSET_ECHO = 1
@@ -76,6 +86,7 @@ POE_PD69200_MSG_SUB1_PORTS_POW4 = 0x4F
 POE_PD69200_MSG_SUB1_PORTS_POW5 = 0x50
 POE_PD69200_MSG_SUB1_RESET = 0x55
 POE_PD69200_MSG_SUB1_INDV_MSK = 0x56
+POE_PD69200_MSG_SUB1_IRQ_MASK = 0x63
 POE_PD69200_MSG_SUB1_DEV_PARAMS = 0x87
 POE_PD69200_MSG_SUB1_PORTS_DLV_PWR = 0xC0
 # PD69200 BT Message - Byte 4: SUB1
@@ -107,6 +118,9 @@ POE_PD69200_MSG_DATA_PORT_TYPE_AF = 0
 POE_PD69200_MSG_DATA_PORT_TYPE_AT = 1
 POE_PD69200_MSG_DATA_PORT_TYPE_AOH = 2
 
+# Logic port of the channel commands addressing all channels at once
+POE_PD69200_ALL_CHANNELS = 0x80
+
 POE_PD69200_MSG_DATA_CMD_ENDIS_ONLY = 0
 POE_PD69200_MSG_DATA_CMD_DISABLE = 0
 POE_PD69200_MSG_DATA_CMD_ENABLE = 1
@@ -120,6 +134,41 @@ POE_PD69200_MSG_DATA_PM1_DYNAMIC = 0
 POE_PD69200_MSG_DATA_PM2_PPL = 0
 POE_PD69200_MSG_DATA_PM3_NO_COND = 0
 
+# Interrupt register (Get System Status DATA11/12), events latched by the chip
+POE_PD69200_INTR_PORT_ON = 0x0001
+POE_PD69200_INTR_PORT_OFF = 0x0002
+POE_PD69200_INTR_DETECT_UNSUCCESSFUL = 0x0004
+POE_PD69200_INTR_PORT_FAULT = 0x0008
+POE_PD69200_INTR_PORT_UNDERLOAD = 0x0010
+POE_PD69200_INTR_PORT_OVERLOAD = 0x0020
+POE_PD69200_INTR_PORT_PM = 0x0040
+POE_PD69200_INTR_DISCO_TEMP = 0x0100
+POE_PD69200_INTR_USER_TEMP = 0x0200
+POE_PD69200_INTR_DEVICE_FAULT = 0x0400
+POE_PD69200_INTR_NO_MORE_CONNECT = 0x1000
+POE_PD69200_INTR_VMAIN_FAULT = 0x2000
+POE_PD69200_INTR_PORT_EVENTS = (POE_PD69200_INTR_PORT_ON | POE_PD69200_INTR_PORT_OFF |
+                                POE_PD69200_INTR_DETECT_UNSUCCESSFUL | POE_PD69200_INTR_PORT_FAULT |
+                                POE_PD69200_INTR_PORT_UNDERLOAD | POE_PD69200_INTR_PORT_OVERLOAD |
+                                POE_PD69200_INTR_PORT_PM)
+POE_PD69200_INTR_SYSTEM_EVENTS = (POE_PD69200_INTR_PORT_ON | POE_PD69200_INTR_PORT_OFF |
+                                  POE_PD69200_INTR_PORT_PM | POE_PD69200_INTR_DISCO_TEMP |
+                                  POE_PD69200_INTR_USER_TEMP | POE_PD69200_INTR_DEVICE_FAULT |
+                                  POE_PD69200_INTR_NO_MORE_CONNECT | POE_PD69200_INTR_VMAIN_FAULT)
+POE_PD69200_INTR_POWER_EVENTS = (POE_PD69200_INTR_PORT_PM | POE_PD69200_INTR_VMAIN_FAULT)
+# Interrupt mask programmed by poed: port on/off, overload and PSU events
+POE_PD69200_INTR_MASK_POED = (POE_PD69200_INTR_PORT_ON | POE_PD69200_INTR_PORT_OFF |
+                              POE_PD69200_INTR_PORT_FAULT | POE_PD69200_INTR_PORT_OVERLOAD |
+                              POE_PD69200_INTR_PORT_PM | POE_PD69200_INTR_VMAIN_FAULT)
+
+# Get All Ports Status: 11 port status bytes per request
+POE_PD69200_PORTS_STATUS_GROUP_SIZE = 11
+POE_PD69200_PORTS_STATUS_GROUPS = [POE_PD69200_MSG_SUB1_PORTS_STATUS1,
+                                   POE_PD69200_MSG_SUB1_PORTS_STATUS2,
+                                   POE_PD69200_MSG_SUB1_PORTS_STATUS3,
+                                   POE_PD69200_MSG_SUB1_PORTS_STATUS4,
+                                   POE_PD69200_MSG_SUB1_PORTS_STATUS5]
+
 # PD69200 BT Message - Byte 6: DATA
 #Port Mode CFG2
 # BITS[3:0] BT Port PM Mode
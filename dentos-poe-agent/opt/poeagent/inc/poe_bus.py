@@ -0,0 +1,201 @@
+'''
+Copyright 2021 Delta Electronic Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import os
+import fcntl
+import time
+import threading
+from smbus2 import SMBus, i2c_msg
+from poe_common import POE_ACCESS_LOCK, POE_BUS_PRIO_LOCK, \
+    POE_BUS_BUDGET_PATH, BUS_PRIO_CONTROL, BUS_PRIO_STATE, BUS_PRIO_BULK, \
+    BUS_BULK_RATE, BUS_BULK_BURST
+
+_sessions = dict()
+_sessions_lock = threading.Lock()
+
+def get_bus_session(bus_num, addr):
+    with _sessions_lock:
+        key = (bus_num, addr)
+        if key not in _sessions:
+            _sessions[key] = PoeBusSession(bus_num, addr)
+        return _sessions[key]
+
+# Token bucket of bus requests shared by all processes through a small
+# "<tokens> <timestamp>" file under flock. Bulk users wait for tokens,
+# more urgent users are only charged so that they shrink the bulk share.
+# The bucket is not enforced when the file cannot be used.
+class PoeBusBudget(object):
+    def __init__(self, path=POE_BUS_BUDGET_PATH, rate=BUS_BULK_RATE,
+                 burst=BUS_BULK_BURST):
+        self.path = path
+        self.rate = float(rate)
+        self.burst = float(burst)
+
+    # Take cost tokens, returns 0 or the time to wait before trying again.
+    # force: take them anyway, the bucket may go down to -burst
+    def _take(self, cost, force):
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            return 0
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            now = time.monotonic()
+            try:
+                tokens, stamp = [float(val) for val in os.read(fd, 64).split()]
+            except ValueError:
+                tokens, stamp = self.burst, now
+            tokens = min(self.burst, tokens + max(0.0, now - stamp) * self.rate)
+            need = min(float(cost), self.burst)
+            wait = 0
+            if force or tokens >= need:
+                tokens = max(-self.burst, tokens - cost)
+            else:
+                wait = (need - tokens) / self.rate
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, "{0:.3f} {1:.3f}".format(tokens, now).encode())
+            return wait
+        except OSError:
+            return 0
+        finally:
+            os.close(fd)
+
+    def charge(self, cost):
+        self._take(cost, True)
+
+    def acquire(self, cost):
+        while True:
+            wait = self._take(cost, False)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+# One long-lived /dev/i2c-<bus_num> handle bound to a slave address.
+# The handle is opened on first use and reopened lazily after an I/O error.
+# lock()/unlock() are re-entrant: only the outermost caller takes the flock,
+# and threads of the same process are serialized by an RLock since they
+# share the fd and flock would not exclude them.
+# The outermost lock() also applies the bus priority classes, see
+# BUS_PRIO_* in poe_common.
+class PoeBusSession(object):
+    def __init__(self, bus_num, addr):
+        self.bus_num = bus_num
+        self.addr = addr
+        self._smbus = None
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._prio_fd = None
+        self._budget = PoeBusBudget()
+        self.open_count = 0
+
+    def _handle(self):
+        if self._smbus is None or self._smbus.fd is None:
+            self._smbus = SMBus(self.bus_num)
+            self.open_count += 1
+            if self._lock_depth > 0:
+                # Reopened inside a locked section, take the lock again
+                fcntl.flock(self._smbus.fd, fcntl.LOCK_EX)
+        return self._smbus
+
+    @property
+    def fd(self):
+        return self._handle().fd
+
+    def invalidate(self):
+        with self._lock:
+            if self._smbus is not None:
+                try:
+                    self._smbus.close()
+                except Exception:
+                    pass
+            self._smbus = None
+
+    def _prio_lock(self, operation):
+        if self._prio_fd is None:
+            try:
+                self._prio_fd = os.open(POE_BUS_PRIO_LOCK,
+                                        os.O_RDWR | os.O_CREAT, 0o644)
+            except OSError:
+                return
+        fcntl.flock(self._prio_fd, operation)
+
+    # Bulk users wait until no more urgent user is queued for the bus and
+    # no exclusive POE access (e.g. poed restoring the chip) is running.
+    # Must not be used while holding the POE access lock exclusively.
+    def _yield_bus(self):
+        self._prio_lock(fcntl.LOCK_EX)
+        try:
+            fd = os.open(POE_ACCESS_LOCK, os.O_RDONLY | os.O_CREAT, 0o644)
+        except OSError:
+            fd = None
+        try:
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+        finally:
+            if fd is not None:
+                os.close(fd)
+            self._prio_lock(fcntl.LOCK_UN)
+
+    # prio: BUS_PRIO_*, cost: number of requests about to be sent
+    def lock(self, prio=BUS_PRIO_STATE, cost=1):
+        self._lock.acquire()
+        try:
+            if self._lock_depth == 0:
+                if prio >= BUS_PRIO_BULK:
+                    self._budget.acquire(cost)
+                    self._yield_bus()
+                else:
+                    if prio > BUS_PRIO_CONTROL:
+                        self._budget.charge(cost)
+                    self._prio_lock(fcntl.LOCK_SH)
+                fcntl.flock(self._handle().fd, fcntl.LOCK_EX)
+        except Exception:
+            if self._lock_depth == 0:
+                self._prio_lock(fcntl.LOCK_UN)
+            self._lock.release()
+            raise
+        self._lock_depth += 1
+
+    def unlock(self):
+        self._lock_depth -= 1
+        try:
+            if self._lock_depth == 0:
+                if self._smbus is not None and self._smbus.fd is not None:
+                    fcntl.flock(self._smbus.fd, fcntl.LOCK_UN)
+                self._prio_lock(fcntl.LOCK_UN)
+        finally:
+            self._lock.release()
+
+    def _rdwr(self, *msgs):
+        try:
+            self._handle().i2c_rdwr(*msgs)
+        except OSError:
+            self.invalidate()
+            raise
+
+    def write(self, msg):
+        self._rdwr(i2c_msg.write(self.addr, msg))
+
+    def read(self, size):
+        read = i2c_msg.read(self.addr, size)
+        self._rdwr(read)
+        return list(read)
+
+    def read_write(self, msg, size):
+        read = i2c_msg.read(self.addr, size)
+        self._rdwr(read, i2c_msg.write(self.addr, msg))
+        return list(read)
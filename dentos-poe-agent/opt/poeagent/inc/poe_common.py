@@ -17,10 +17,14 @@ limitations under the License.
 import os
 import sys
 import time
+import json
+import signal
 import syslog
 import fcntl
-import traceback
-from pathlib import Path
+import atexit
+import threading
+import importlib.util
+from collections import deque
 
 # POE Driver Attributes
 TOTAL_PORTS   = "total_ports"
@@ -48,6 +52,7 @@ DEVICE_FAIL   = "device_fail"
 TEMP_DISCO    = "temp_disc"
 TEMP_ALARM    = "temp_alarm"
 INTR_REG      = "intr_reg"
+IRQ_MASK      = "irq_mask"
 PROTOCOL      = "protocol"
 CLASS         = "class"
 VOLTAGE       = "voltage"
@@ -65,6 +70,7 @@ CPU_STATUS2_ERROR = "cpu_status2_error"
 NVM_USER_BYTE = "nvm_user_byte"
 FOUND_DEVICE = "found_device"
 EVENT_EXIST = "event_exist"
+GUARD_BAND = "guard_band"
 # POE Configuration Attributes
 GEN_INFO       = "GENERAL_INFORMATION"
 TIMESTAMP      = "TIMESTAMP"
@@ -83,7 +89,33 @@ OPERATION_MODE = "operation_mode"
 MEASURED_CLASS = "measured_class"
 ACTIVE_MATRIX_PHYA = "ACTIVE_MATRIX_A"
 ACTIVE_MATRIX_PHYB = "ACTIVE_MATRIX_B"
+ACTIVE_MATRIX  = "ACTIVE_MATRIX"
 CMD_RESULT_RET = "ret"
+INIT_SKIPPED   = "skipped"
+
+# POE Bus Statistics Attributes
+BUS_STATS           = "BUS_STATISTICS"
+BUS_STAT_SINCE      = "since"
+BUS_STAT_TOTAL      = "total"
+BUS_STAT_COMMANDS   = "commands"
+BUS_STAT_TRANS      = "transactions"
+BUS_STAT_TX_BYTES   = "tx_bytes"
+BUS_STAT_RX_BYTES   = "rx_bytes"
+BUS_STAT_RETRIES    = "retries"
+BUS_STAT_FAILURES   = "failures"
+BUS_STAT_SLEEP_TIME = "sleep_time"
+BUS_STAT_I2C_TIME   = "i2c_time"
+BUS_STAT_IDLE_CMD   = "idle"
+
+# Port data classes, see poePort.config_calls/measurement_calls
+PORT_DATA_CONFIG      = "config"
+PORT_DATA_MEASUREMENT = "measurement"
+
+# Chip event classes reported by poll_chip_events
+CHIP_EVENTS  = "chip_events"
+EVENT_PORT   = "port"
+EVENT_SYSTEM = "system"
+EVENT_POWER  = "power"
 
 # IPC EVENT
 POE_IPC_EVT    = "/run/poe_ipc_event"
@@ -99,57 +131,307 @@ POED_PERM_CFG_PATH    = "/etc/poe_agent/poe_perm_cfg.json"
 POED_RUNTIME_CFG_PATH = "/run/poe_runtime_cfg.json"
 POED_SAVE_ACTION = "save"
 POED_LOAD_ACTION = "load"
+POED_DESIRED_ACTION = "desired"
+POED_DESIRED_CFG_PATH = "/run/poe_desired_cfg.json"
 
 # POE Access Exclusive Lock
 POE_ACCESS_LOCK = "/run/poe_access.lock"
 EXLOCK_RETRY = 5
 
+# POE bus priority classes, lower value is more urgent. Control (set)
+# commands and state collection hold the priority lock shared while they
+# wait for and use the bus. Bulk diagnostic reads are sent in chunks, each
+# one waiting for the priority lock exclusively (no more urgent user
+# queued) and for a token bucket shared by all processes.
+POE_BUS_PRIO_LOCK   = "/run/poe_bus_prio.lock"
+POE_BUS_BUDGET_PATH = "/run/poe_bus_budget"
+BUS_PRIO_CONTROL = 0
+BUS_PRIO_STATE   = 1
+BUS_PRIO_BULK    = 2
+# Requests per bulk chunk, bulk budget in requests/s and burst size
+BUS_BULK_CHUNK = 8
+BUS_BULK_RATE  = 20
+BUS_BULK_BURST = 100
+
+# Static chip data (firmware version, individual masks, active matrix)
+# cached across processes, see PoeStaticCache
+POE_STATIC_CACHE_PATH = "/run/poe_static_cache.json"
+POE_STATIC_CACHE_LOCK = "/run/poe_static_cache.lock"
+
+# Chip capability descriptor written once per boot, see init_capability()
+POE_CAPABILITY_PATH = "/run/poe_capability.json"
+BOOT_ID_PATH        = "/proc/sys/kernel/random/boot_id"
+CAP_BOOT_ID     = "boot_id"
+CAP_PLATFORM    = "platform"
+CAP_4WIRE_BT    = "4wire_bt"
+CAP_MATRIX_HASH = "matrix_hash"
+
+# Platform name sources, see PoePlatformRegistry
+BOOTCMD_PATH            = "/proc/cmdline"
+# Fallback when the boot cmdline has no onl_platform
+ONL_PLATFORM_PATH       = "/etc/onl/platform"
+ONL_PLATFORM    = "onl_platform"
+
 # POE PID file location
 POED_PID_PATH   = "/run/poed.pid"
 
+# POE bus statistics dumped by poed
+POED_BUS_STATS_PATH = "/run/poe_bus_stats.json"
+
+# Last Get (BT) System Status reply read by poed, published when it
+# changes. Reading it from the chip clears the events latched for poed's
+# event monitor, so other processes take this copy while poed is running.
+POED_SYSTEM_STATUS_PATH = "/run/poe_system_status.json"
+
+# Port information of poed's port objects, published for "poecli show
+# --watch" every POED_PORTS_CACHE_INTVL seconds while requested: the
+# watcher sets the mtime of the request file to the time until which it
+# wants the data (its next refresh plus POED_PORTS_WATCH_GRACE seconds)
+POED_PORTS_CACHE_PATH  = "/run/poe_ports_info.json"
+POED_PORTS_WATCH_PATH  = "/run/poe_ports_watch"
+POED_PORTS_CACHE_INTVL = 2
+POED_PORTS_WATCH_GRACE = 10
+
+# I2C frame trace ring, recorded by every poed/poecli driver while the
+# file exists, see bin/poetrace.py
+POE_TRACE_PATH     = "/run/poe_trace.bin"
+POE_TRACE_CAPACITY = 32768
+
+# Sampling profile of poed, started by SIGUSR1 and dumped by SIGUSR2:
+# collapsed stacks (flamegraph input) and a summary with the bus time per
+# driver command during the profile
+POED_PROFILE_STACKS_PATH  = "/run/poed_profile.folded"
+POED_PROFILE_SUMMARY_PATH = "/run/poed_profile.json"
+PROFILE_INTERVAL = 0.01
+# A forgotten profile is stopped and dumped after this many seconds
+PROFILE_MAX_TIME = 600
+PROFILE_START    = "start"
+PROFILE_DURATION = "duration"
+PROFILE_SAMPLES  = "samples"
+PROFILE_INTVL    = "interval"
+
+# Prometheus text file written by poed from its cached state, for the
+# node_exporter textfile collector
+POED_METRICS_PATH = "/run/poe_metrics.prom"
+
 # POE fileflag function
-POED_BUSY_FLAG = "/run/.poed_busy"
 POED_EXIT_FLAG = "/run/.poed_exit"
 FILEFLAG_RETRY = 5
 
+# POE agent bring-up state published by poed, the bring-up lock is held
+# exclusively by poed until the chip and port configurations are restored
+POED_STATE_PATH   = "/run/poed_state.json"
+POED_BRINGUP_LOCK = "/run/poed_bringup.lock"
+POED_STATE        = "state"
+POED_STAGE        = "stage"
+POED_STAGE_INDEX  = "stage_index"
+POED_STAGE_TOTAL  = "stage_total"
+POED_STATE_PID    = "pid"
+POED_STATE_SINCE  = "since"
+POED_STATE_TIME   = "timestamp"
+POED_BRINGUP_TIME = "bringup_time"
+POED_STATE_STARTING = "starting"
+POED_STATE_READY    = "ready"
+POED_STATE_FAILSAFE = "failsafe"
+POED_STATE_STOPPED  = "stopped"
+
 def print_stderr(msg,end="\n",flush=True):
     sys.stderr.write(msg+end)
     if flush:
         sys.stderr.flush()
 
+# Per call site log rate limit: up to LOG_RATE_BURST messages every
+# LOG_RATE_INTERVAL seconds, the others are only counted
+LOG_RATE_INTERVAL = 10
+LOG_RATE_BURST    = 5
+# Messages waiting for the syslog writer of a buffered PoeLog
+LOG_QUEUE_SIZE    = 256
+
+# "msg key=value ...", values with blanks or quotes are quoted
+def format_log_fields(msg, fields):
+    if not fields:
+        return msg
+    items = []
+    for key, val in fields.items():
+        val = str(val)
+        if val == "" or any(c in val for c in ' ="'):
+            val = '"' + val.replace('\\', '\\\\').replace('"', '\\"') + '"'
+        items.append("{0}={1}".format(key, val))
+    return msg + " " + " ".join(items)
+
+# (file, line) of the caller depth frames above the caller of _call_site
+def _call_site(depth):
+    frame = sys._getframe(depth + 1)
+    return (os.path.basename(frame.f_code.co_filename), frame.f_lineno)
+
+class PoeLogLimiter(object):
+    def __init__(self, interval=LOG_RATE_INTERVAL, burst=LOG_RATE_BURST):
+        self.interval = interval
+        self.burst = burst
+        # Re-entrant: poed also logs from signal handlers
+        self._lock = threading.RLock()
+        # site: [window start, messages let through, messages dropped]
+        self._sites = dict()
+
+    # None when the message is to be dropped, else the number of messages
+    # of the site dropped since the previous one let through
+    def check(self, site):
+        now = time.monotonic()
+        with self._lock:
+            state = self._sites.get(site)
+            if state is None or now - state[0] >= self.interval:
+                self._sites[site] = [now, 1, 0]
+                return 0 if state is None else state[2]
+            if state[1] < self.burst:
+                state[1] += 1
+                return 0
+            state[2] += 1
+            return None
+
+    # [(site, dropped)] of the sites whose window is over (all sites when
+    # forced) with messages dropped, their counts are reset
+    def expired(self, force=False):
+        now = time.monotonic()
+        result = []
+        with self._lock:
+            for site, state in self._sites.items():
+                if state[2] > 0 and (force or now - state[0] >= self.interval):
+                    result.append((site, state[2]))
+                    state[2] = 0
+        return result
+
+_stderr_limiter = PoeLogLimiter()
+
+# Report the messages dropped by print_stderr_limited() at call sites that
+# went quiet since (all of them when forced, e.g. at exit)
+def _report_stderr_suppressed(force=False):
+    for (file_name, line_num), count in _stderr_limiter.expired(force):
+        print_stderr(format_log_fields("Messages suppressed", {
+            "site": "{0}:{1}".format(file_name, line_num),
+            "suppressed": count}))
+
+atexit.register(_report_stderr_suppressed, True)
+
+# print_stderr() of a message with key=value fields, rate limited per
+# call site like PoeLog
+def print_stderr_limited(msg, **fields):
+    suppressed = _stderr_limiter.check(_call_site(1))
+    _report_stderr_suppressed()
+    if suppressed is None:
+        return
+    if suppressed > 0:
+        fields["suppressed"] = suppressed
+    print_stderr(format_log_fields(msg, fields))
+
+# Syslog with optional key=value fields, e.g.:
+#   log.err("Port setting failed", port=3, err=str(e))
+# Messages are rate limited per call site, the number of messages dropped
+# is added to the next one let through ("suppressed=N"), or reported once
+# the site went quiet. Loops over ports log one line for all ports.
+# buffered: syslog is written by a writer thread from a bounded queue so
+# that callers never wait for syslog. When the queue is full the oldest
+# messages are dropped and counted.
 class PoeLog(object):
-    def __init__(self, debug_mode=False):
+    def __init__(self, debug_mode=False, buffered=False):
         self.debug_mode = debug_mode
-
-    def emerg(self, msg):
-        self._record(syslog.LOG_EMERG, "EMERG: %s" % msg)
-
-    def alert(self, msg):
-        self._record(syslog.LOG_ALERT, "ALERT: %s" % msg)
-
-    def crit(self, msg):
-        self._record(syslog.LOG_CRIT, "CRIT: %s" % msg)
-
-    def err(self, msg):
-        self._record(syslog.LOG_ERR, "ERR: %s" % msg)
-
-    def warn(self, msg):
-        self._record(syslog.LOG_WARNING, "WARN: %s" % msg)
-
-    def notice(self, msg):
-        self._record(syslog.LOG_NOTICE, "NOTICE: %s" % msg)
-
-    def info(self, msg):
-        self._record(syslog.LOG_INFO, "INFO: %s" % msg)
-
-    def dbg(self, msg):
-        self._record(syslog.LOG_DEBUG, "DBG: %s" % msg)
-
-    def _record(self, priority, msg):
+        self.limiter = PoeLogLimiter()
+        self.dropped = 0
+        self._queue = None
+        if buffered:
+            self._queue = deque()
+            self._cond = threading.Condition()
+            self._emit_lock = threading.Lock()
+            self._writer = threading.Thread(target=self._writer_main,
+                                            daemon=True)
+            self._writer.start()
+        atexit.register(self.flush, True)
+
+    def emerg(self, msg, **fields):
+        self._record(syslog.LOG_EMERG, "EMERG", msg, fields)
+
+    def alert(self, msg, **fields):
+        self._record(syslog.LOG_ALERT, "ALERT", msg, fields)
+
+    def crit(self, msg, **fields):
+        self._record(syslog.LOG_CRIT, "CRIT", msg, fields)
+
+    def err(self, msg, **fields):
+        self._record(syslog.LOG_ERR, "ERR", msg, fields)
+
+    def warn(self, msg, **fields):
+        self._record(syslog.LOG_WARNING, "WARN", msg, fields)
+
+    def notice(self, msg, **fields):
+        self._record(syslog.LOG_NOTICE, "NOTICE", msg, fields)
+
+    def info(self, msg, **fields):
+        self._record(syslog.LOG_INFO, "INFO", msg, fields)
+
+    def dbg(self, msg, **fields):
+        self._record(syslog.LOG_DEBUG, "DBG", msg, fields)
+
+    def _record(self, priority, level, msg, fields):
+        suppressed = self.limiter.check((priority, level) + _call_site(2))
+        if self._queue is None:
+            # No writer thread to report quiet sites
+            self._emit_suppressed()
+        if suppressed is None:
+            return
+        if suppressed > 0:
+            fields["suppressed"] = suppressed
+        msg = format_log_fields("%s: %s" % (level, msg), fields)
+        if self._queue is None:
+            self._emit(priority, msg)
+            return
+        with self._cond:
+            if len(self._queue) >= LOG_QUEUE_SIZE:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append((priority, msg))
+            self._cond.notify()
+
+    def _emit(self, priority, msg):
         syslog.syslog(priority, msg)
         if self.debug_mode == True:
             sys.stdout.write(msg+"\n")
 
+    # Report the messages dropped by the rate limit of call sites that
+    # went quiet since (all of them when forced, e.g. at exit)
+    def _emit_suppressed(self, force=False):
+        for (priority, level, file_name, line_num), count in self.limiter.expired(force):
+            self._emit(priority, format_log_fields(
+                level + ": Log messages suppressed",
+                {"site": "{0}:{1}".format(file_name, line_num),
+                 "suppressed": count}))
+
+    # Write out the queued messages of a buffered PoeLog
+    def flush(self, force=False):
+        if self._queue is None:
+            self._emit_suppressed(force)
+            return
+        with self._emit_lock:
+            with self._cond:
+                items = list(self._queue)
+                self._queue.clear()
+                dropped = self.dropped
+                self.dropped = 0
+            if dropped > 0:
+                self._emit(syslog.LOG_WARNING, format_log_fields(
+                    "WARN: Log queue full", {"dropped": dropped}))
+            for priority, msg in items:
+                self._emit(priority, msg)
+            self._emit_suppressed(force)
+
+    def _writer_main(self):
+        while True:
+            with self._cond:
+                if len(self._queue) == 0:
+                    self._cond.wait(LOG_RATE_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                time.sleep(1)
+
 def PoeAccessExclusiveLock(func):
     def wrap_cmd(*args, **kwargs):
         try:
@@ -186,6 +468,8 @@ def PoeAccessExclusiveLock(func):
             except Exception as e:
                 error_class = e.__class__.__name__
                 detail = e.args[0]
+                # Only needed on failure, keep it out of the startup path
+                import traceback
                 cl, exc, tb = sys.exc_info()
                 lastCallStack = traceback.extract_tb(tb)[-1]
                 fileName = lastCallStack[0]
@@ -200,10 +484,24 @@ def PoeAccessExclusiveLock(func):
         return res
     return wrap_cmd
 
+# Shared POE access for read-only users: runs along with other readers,
+# never in the middle of an exclusive access (e.g. poed restoring the chip)
+def PoeAccessSharedLock(func):
+    def wrap_cmd(*args, **kwargs):
+        fd = os.open(POE_ACCESS_LOCK, os.O_RDONLY | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            return func(*args, **kwargs)
+        finally:
+            os.close(fd)
+    return wrap_cmd
+
 
 def touch_file(file_path):
     try:
-        return Path(file_path).touch()
+        with open(file_path, 'a'):
+            os.utime(file_path, None)
+        return True
     except Exception as e:
         print_stderr("Fail to touch: "+file_path+",err: "+str(e))
         return False
@@ -212,7 +510,7 @@ def touch_file(file_path):
 def remove_file(file_path):
     try:
         if check_file(file_path):
-            return Path(file_path).unlink()
+            return os.unlink(file_path)
         else:
             return True
     except Exception as e:
@@ -222,24 +520,116 @@ def remove_file(file_path):
 
 def check_file(file_path):
     try:
-        return Path(file_path).exists()
+        return os.path.exists(file_path)
     except Exception as e:
         print_stderr("Fail to check: "+file_path+",err: "+str(e))
         return False
 
 
-def wait_poed_busy(timeout=FILEFLAG_RETRY):
-    ret = check_file(POED_BUSY_FLAG)
-    while ret == True:
-        ret = check_file(POED_BUSY_FLAG)
-        print_stderr("\rpoe agent busy...")
-        if timeout > 0:
-            timeout -= 1
-        else:
-            print_stderr("\r\rpoe agent busy...timeout")
+# Platform modules loaded by load_poe_platform_module, by source path
+_plat_modules = dict()
+
+# Load a platform poe_platform.py through importlib. The source loader keeps
+# the compiled module in the platform __pycache__ and the module object is
+# kept per source path, so only the first load of a process execs it.
+def load_poe_platform_module(src_path, name="poe_plat"):
+    module = _plat_modules.get(src_path)
+    if module is not None:
+        return module
+    spec = importlib.util.spec_from_file_location(name, src_path)
+    if spec is None:
+        raise ImportError("Unable to load platform module: {0}".format(src_path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except Exception:
+        del sys.modules[name]
+        raise
+    _plat_modules[src_path] = module
+    return module
+
+
+def save_poed_state(state):
+    try:
+        tmp_path = POED_STATE_PATH + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(state, indent = 4))
+        os.replace(tmp_path, POED_STATE_PATH)
+        return True
+    except Exception as e:
+        print_stderr("Fail to save: "+POED_STATE_PATH+",err: "+str(e))
+        return False
+
+
+def get_boot_id():
+    try:
+        with open(BOOT_ID_PATH, 'r') as f:
+            return f.read().strip()
+    except Exception:
+        return None
+
+
+def load_poed_state():
+    try:
+        with open(POED_STATE_PATH, 'r') as f:
+            return json.loads(f.read())
+    except Exception:
+        return None
+
+
+def poed_bringup_progress(state):
+    if state is None or state.get(POED_STATE) != POED_STATE_STARTING:
+        return "poe agent starting..."
+    return "poe agent starting, stage {0}/{1}: {2}".format(
+        state.get(POED_STAGE_INDEX), state.get(POED_STAGE_TOTAL),
+        state.get(POED_STAGE))
+
+
+def _bringup_wait_timeout(sig, frame):
+    raise RuntimeError("bring-up wait timeout")
+
+
+def _try_bringup_lock(fd):
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def is_poed_bringup():
+    try:
+        with open(POED_BRINGUP_LOCK, 'a') as fd:
+            return _try_bringup_lock(fd) == False
+    except Exception:
+        return False
+
+
+# Block until poed has released the bring-up lock, no polling: the
+# shared flock is granted as soon as poed drops its exclusive one (or dies)
+def wait_poed_bringup(timeout=FILEFLAG_RETRY):
+    try:
+        fd = open(POED_BRINGUP_LOCK, 'a')
+    except Exception:
+        return True
+    try:
+        if _try_bringup_lock(fd) == True:
+            return True
+        print_stderr(poed_bringup_progress(load_poed_state()))
+        prev_handler = signal.signal(signal.SIGALRM, _bringup_wait_timeout)
+        signal.alarm(timeout)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            return True
+        except RuntimeError:
+            print_stderr("poe agent starting...timeout")
             return False
-        time.sleep(1)
-    return True
+        finally:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, prev_handler)
+    finally:
+        fd.close()
 
 
 def conv_byte_to_hex(byte_in):
@@ -248,25 +638,27 @@ def conv_byte_to_hex(byte_in):
     return hex_string
 
 def fast_temp_matrix_compare(def_matrix,plat_obj):
-    get_phya = None
-    get_phyb = None
     if len(def_matrix[0]) == 3:
         print_stderr("Select 4-Pair mode")
         four_pair = True
     else:
         print_stderr("Select 2-Pair mode")
         four_pair = False
+    # Read each port's active matrix (PHY A and B) once, in one batch,
+    # the parsed result stays cached in the platform object
+    active_matrix = plat_obj.get_active_matrices(
+        [def_mat_pair[0] for def_mat_pair in def_matrix])
+    mismatch_ports = []
     for def_mat_pair in def_matrix:
         idx = def_mat_pair[0]
-        get_phya = plat_obj.get_active_matrix(idx)[ACTIVE_MATRIX_PHYA]
-        if get_phya != def_mat_pair[1]:
-            print_stderr("Port map mismatch, run program global matrix")
-            return False
-        if four_pair == True:
-            get_phyb = plat_obj.get_active_matrix(idx)[ACTIVE_MATRIX_PHYB]
-            if get_phyb != def_mat_pair[2]:
-                print_stderr("Port map mismatch, run program global matrix")
-                return False
+        (get_phya, get_phyb) = active_matrix[idx]
+        if get_phya != def_mat_pair[1] or \
+                (four_pair == True and get_phyb != def_mat_pair[2]):
+            mismatch_ports.append(idx)
+    if len(mismatch_ports) > 0:
+        print_stderr("Port map mismatch (logic ports: {0}), run program global matrix".format(
+            ",".join(str(idx) for idx in mismatch_ports)))
+        return False
     print_stderr("Port map match, skip program global matrix")
     return True
 
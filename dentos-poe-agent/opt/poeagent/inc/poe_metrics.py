@@ -0,0 +1,98 @@
+'''
+Copyright 2021 Delta Electronic Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import os
+import math
+from collections import OrderedDict
+from poe_common import print_stderr
+
+METRIC_GAUGE   = "gauge"
+METRIC_COUNTER = "counter"
+METRIC_INFO    = "info"
+
+# Sample name suffix and Prometheus type of each metric type. The
+# Prometheus text format has no info type, info metrics are gauges of 1.
+_SUFFIX = {METRIC_GAUGE: "", METRIC_COUNTER: "_total", METRIC_INFO: "_info"}
+_PROM_TYPE = {METRIC_GAUGE: "gauge", METRIC_COUNTER: "counter",
+              METRIC_INFO: "gauge"}
+
+def _escape(val):
+    return str(val).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# HELP text keeps its double quotes
+def _escape_help(val):
+    return str(val).replace('\\', '\\\\').replace('\n', '\\n')
+
+def _format_value(val):
+    if isinstance(val, bool):
+        return "1" if val else "0"
+    if isinstance(val, int):
+        return str(val)
+    val = float(val)
+    if math.isnan(val):
+        return "NaN"
+    if math.isinf(val):
+        return "+Inf" if val > 0 else "-Inf"
+    return repr(val)
+
+# Metric families in the Prometheus text format (as read by the
+# node_exporter textfile collector), e.g.:
+#   metrics = PoeMetrics()
+#   metrics.family("poe_port_power_watts", METRIC_GAUGE, "Port power")
+#   metrics.add("poe_port_power_watts", 3.5, OrderedDict([("port", 1)]))
+#   text = metrics.render()
+class PoeMetrics(object):
+    def __init__(self):
+        self._families = OrderedDict()
+
+    def family(self, name, mtype, help_text):
+        if name not in self._families:
+            self._families[name] = (mtype, help_text, [])
+
+    # None values (no reading yet) are left out
+    def add(self, name, value, labels=None):
+        if value is None:
+            return
+        self._families[name][2].append((labels, value))
+
+    def render(self):
+        lines = []
+        for name, (mtype, help_text, samples) in self._families.items():
+            if len(samples) == 0:
+                continue
+            # TYPE and HELP name the samples, suffix included
+            name = name + _SUFFIX[mtype]
+            lines.append("# HELP {0} {1}".format(name, _escape_help(help_text)))
+            lines.append("# TYPE {0} {1}".format(name, _PROM_TYPE[mtype]))
+            for labels, value in samples:
+                label_str = ""
+                if labels:
+                    label_str = "{" + ",".join('{0}="{1}"'.format(
+                        key, _escape(val)) for key, val in labels.items()) + "}"
+                lines.append("{0}{1} {2}".format(
+                    name, label_str, _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+def save_metrics(text, path):
+    try:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        print_stderr("Fail to save: " + path + ",err: " + str(e))
+        return False
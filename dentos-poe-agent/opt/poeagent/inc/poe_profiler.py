@@ -0,0 +1,138 @@
+'''
+Copyright 2021 Delta Electronic Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+from poe_common import PROFILE_INTERVAL, PROFILE_MAX_TIME, \
+    BUS_STAT_SINCE, BUS_STAT_COMMANDS, BUS_STAT_TRANS, BUS_STAT_RETRIES, \
+    BUS_STAT_SLEEP_TIME, BUS_STAT_I2C_TIME
+
+# Bus statistics counted per driver command during a profile
+_PROFILE_BUS_STATS = (BUS_STAT_TRANS, BUS_STAT_RETRIES, BUS_STAT_I2C_TIME,
+                      BUS_STAT_SLEEP_TIME)
+
+# Statistical profiler of all threads of the process: a sampler thread
+# takes the stack of every other thread each interval and counts the
+# collapsed stacks ("thread;file:func;file:func"). The sampled threads run
+# unchanged, the overhead is the sampler thread only.
+class PoeSampler(object):
+    def __init__(self, interval=PROFILE_INTERVAL, max_time=PROFILE_MAX_TIME,
+                 on_timeout=None):
+        self.interval = interval
+        self.max_time = max_time
+        # Called from the sampler thread when max_time is reached
+        self.on_timeout = on_timeout
+        self.start_time = None
+        self.stop_time = None
+        self.samples = 0
+        self._stacks = dict()
+        self._stop = threading.Event()
+        self._thread = None
+        # Set by the one caller ending the profile, stop() or the timeout.
+        # Re-entrant: stop() runs from a signal handler.
+        self._end_lock = threading.RLock()
+        self._ended = False
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running():
+            return False
+        self.start_time = time.time()
+        self.stop_time = None
+        self.samples = 0
+        self._stacks = dict()
+        self._stop.clear()
+        self._ended = False
+        self._thread = threading.Thread(target=self._sampler_main,
+                                        name="profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    # True when this call ended the profile, False when it was not running
+    # or had already timed out (on_timeout handles it then)
+    def stop(self):
+        if not self.is_running():
+            return False
+        self._stop.set()
+        ended = self._end()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        return ended
+
+    def _end(self):
+        with self._end_lock:
+            if self._ended:
+                return False
+            self._ended = True
+            return True
+
+    def _stack_key(self, thread_name, frame):
+        funcs = []
+        while frame is not None:
+            code = frame.f_code
+            funcs.append("{0}:{1}".format(
+                os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        funcs.append(thread_name)
+        return ";".join(reversed(funcs))
+
+    def _sample(self):
+        names = dict((t.ident, t.name) for t in threading.enumerate())
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            key = self._stack_key(names.get(ident, str(ident)), frame)
+            self._stacks[key] = self._stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def _sampler_main(self):
+        deadline = time.monotonic() + self.max_time
+        timed_out = False
+        while not self._stop.wait(self.interval):
+            self._sample()
+            if time.monotonic() >= deadline:
+                timed_out = True
+                break
+        self.stop_time = time.time()
+        if timed_out and self._end() and self.on_timeout is not None:
+            self.on_timeout()
+
+    # Collapsed stacks, most sampled first, e.g. for flamegraph.pl
+    def collapsed(self):
+        stacks = sorted(self._stacks.items(), key=lambda item: -item[1])
+        return "".join("{0} {1}\n".format(key, count) for key, count in stacks)
+
+# Bus time per driver command between two get_bus_stats() snapshots of
+# the same process, counted from the reset when reset in between
+def diff_bus_stats(before, after):
+    commands = OrderedDict()
+    prev_commands = before[BUS_STAT_COMMANDS]
+    if before[BUS_STAT_SINCE] != after[BUS_STAT_SINCE]:
+        prev_commands = dict()
+    for cmd_type, entry in after[BUS_STAT_COMMANDS].items():
+        prev = prev_commands.get(cmd_type)
+        diff = OrderedDict()
+        for key in _PROFILE_BUS_STATS:
+            diff[key] = entry[key] - (0 if prev is None else prev[key])
+        if diff[BUS_STAT_TRANS] > 0:
+            commands[cmd_type] = diff
+    return commands
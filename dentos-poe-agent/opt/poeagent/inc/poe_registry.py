@@ -0,0 +1,85 @@
+'''
+Copyright 2021 Delta Electronic Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import os
+from collections import OrderedDict
+from poe_common import *
+
+# Kernel cmdline as an OrderedDict, flags without a value map to None
+def parse_cmdline(text):
+    params = OrderedDict()
+    for item in text.split():
+        key, sep, val = item.partition('=')
+        params[key] = val if sep else None
+    return params
+
+# dentOS platform format: <arch>-<manufacturer>-<model>-<revision>, the
+# x86 arch is spelled "x86-64"
+def platform_src_path(plat_root, plat_name):
+    if plat_name.startswith("x86-64-"):
+        arch = "x86-64"
+    else:
+        arch = plat_name.split('-', 1)[0]
+    fields = plat_name[len(arch) + 1:].split('-', 1)
+    if not arch or len(fields) != 2 or not all(fields):
+        raise RuntimeError("Invalid platform name: \"%s\"" % plat_name)
+    return os.path.join(plat_root, fields[0], fields[1], "poe_platform.py")
+
+# Resolves the PoE platform of this system: ONL platform name from the
+# boot cmdline (or the ONL platform file) and the platform module path
+class PoePlatformRegistry(object):
+    def __init__(self, plat_root, cmdline_path=BOOTCMD_PATH,
+                 onl_path=ONL_PLATFORM_PATH):
+        self.plat_root = os.path.abspath(plat_root)
+        self.cmdline_path = cmdline_path
+        self.onl_path = onl_path
+        self._plat_name = None
+
+    # onl_platform from the boot cmdline, else from the ONL platform file
+    def _read_platform_name(self):
+        errors = []
+        try:
+            with open(self.cmdline_path, 'r') as f:
+                name = parse_cmdline(f.read()).get(ONL_PLATFORM)
+            if name:
+                return name
+            errors.append("no %s in %s" % (ONL_PLATFORM, self.cmdline_path))
+        except OSError as e:
+            errors.append(str(e))
+        try:
+            with open(self.onl_path, 'r') as f:
+                name = f.read().strip()
+            if name:
+                return name
+            errors.append("%s is empty" % self.onl_path)
+        except OSError as e:
+            errors.append(str(e))
+        raise RuntimeError("Unable to resolve the platform: " +
+                           ", ".join(errors))
+
+    def platform_model(self):
+        if self._plat_name is None:
+            self._plat_name = self._read_platform_name()
+        return self._plat_name
+
+    # Load the platform module and create the platform
+    def load_platform(self):
+        plat_name = self.platform_model()
+        src_path = platform_src_path(self.plat_root, plat_name)
+        if not os.path.exists(src_path):
+            raise RuntimeError("No PoE support for platform \"%s\" (%s)" % (
+                plat_name, src_path))
+        return load_poe_platform_module(src_path).get_poe_platform()
@@ -0,0 +1,152 @@
+'''
+Copyright 2021 Delta Electronic Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import math
+import threading
+from array import array
+from collections import OrderedDict
+from poe_common import POWER_CONSUMP, VOLTAGE, CURRENT, STATUS
+
+TELEMETRY_TIME = "timestamp"
+TELEMETRY_FIELDS = (POWER_CONSUMP, VOLTAGE, CURRENT)
+TELEMETRY_NO_STATUS = -1
+
+# Fixed size ring of one port's samples: timestamp, power (mW), voltage
+# (V), current (mA) and raw port status code. Each column is a
+# preallocated array, appending overwrites the oldest sample. Missing
+# values are stored as NaN (status: TELEMETRY_NO_STATUS) and skipped by
+# the statistics.
+class PoePortRing(object):
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.count = 0
+        # Index of the next sample to write
+        self._head = 0
+        self._time = array('d', [0.0]) * capacity
+        self._values = OrderedDict()
+        for field in TELEMETRY_FIELDS:
+            self._values[field] = array('d', [0.0]) * capacity
+        self._status = array('i', [TELEMETRY_NO_STATUS]) * capacity
+
+    def append(self, timestamp, power, voltage, current, status):
+        idx = self._head
+        self._time[idx] = timestamp
+        for field, val in zip(TELEMETRY_FIELDS, (power, voltage, current)):
+            self._values[field][idx] = float('nan') if val is None else val
+        self._status[idx] = TELEMETRY_NO_STATUS if status is None else status
+        self._head = (idx + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    # Ring indexes of the last n samples (all when None), oldest first
+    def _indexes(self, n=None):
+        if n is None or n > self.count:
+            n = self.count
+        start = self._head - n
+        return [(start + i) % self.capacity for i in range(n)]
+
+    # Ring indexes of the samples taken since now - window, oldest first
+    def _window(self, window, now):
+        since = now - window
+        idxs = self._indexes()
+        pos = len(idxs)
+        while pos > 0 and self._time[idxs[pos - 1]] >= since:
+            pos -= 1
+        return idxs[pos:]
+
+    def _sample(self, idx):
+        sample = OrderedDict()
+        sample[TELEMETRY_TIME] = self._time[idx]
+        for field in TELEMETRY_FIELDS:
+            val = self._values[field][idx]
+            sample[field] = None if math.isnan(val) else val
+        status = self._status[idx]
+        sample[STATUS] = None if status == TELEMETRY_NO_STATUS else status
+        return sample
+
+    def last(self, n=1):
+        return [self._sample(idx) for idx in self._indexes(n)]
+
+    def latest_time(self):
+        if self.count == 0:
+            return None
+        return self._time[(self._head - 1) % self.capacity]
+
+    # min, max, avg and sample count of a field over the window (s) ending
+    # at now (default: the latest sample), None without samples
+    def stats(self, field, window, now=None):
+        if now is None:
+            now = self.latest_time()
+            if now is None:
+                return None
+        column = self._values[field]
+        values = [column[idx] for idx in self._window(window, now)
+                  if not math.isnan(column[idx])]
+        if len(values) == 0:
+            return None
+        result = OrderedDict()
+        result["min"] = min(values)
+        result["max"] = max(values)
+        result["avg"] = sum(values) / len(values)
+        result["count"] = len(values)
+        return result
+
+    # Change of a field per second between the first and the last sample
+    # of the window, None with less than two samples
+    def rate(self, field, window, now=None):
+        if now is None:
+            now = self.latest_time()
+            if now is None:
+                return None
+        column = self._values[field]
+        idxs = [idx for idx in self._window(window, now)
+                if not math.isnan(column[idx])]
+        if len(idxs) < 2:
+            return None
+        first, last = idxs[0], idxs[-1]
+        span = self._time[last] - self._time[first]
+        if span <= 0:
+            return None
+        return (column[last] - column[first]) / span
+
+# Port telemetry of poed: one ring per port, filled by the poll thread and
+# read by any other thread
+class PoeTelemetry(object):
+    def __init__(self, port_ids, capacity):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._rings = OrderedDict()
+        for port_id in port_ids:
+            self._rings[port_id] = PoePortRing(capacity)
+
+    def port_ids(self):
+        return list(self._rings.keys())
+
+    def add(self, port_id, timestamp, power, voltage, current, status):
+        with self._lock:
+            self._rings[port_id].append(timestamp, power, voltage, current,
+                                        status)
+
+    def last(self, port_id, n=1):
+        with self._lock:
+            return self._rings[port_id].last(n)
+
+    def stats(self, port_id, field, window, now=None):
+        with self._lock:
+            return self._rings[port_id].stats(field, window, now)
+
+    def rate(self, port_id, field, window, now=None):
+        with self._lock:
+            return self._rings[port_id].rate(field, window, now)
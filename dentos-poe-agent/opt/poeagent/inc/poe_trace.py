@@ -0,0 +1,140 @@
+'''
+Copyright 2021 Delta Electronic Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import os
+import time
+import fcntl
+import struct
+from collections import namedtuple
+from poe_common import POE_TRACE_PATH, POE_TRACE_CAPACITY, \
+    print_stderr_limited
+
+TRACE_TX  = 1
+TRACE_RX  = 2
+# Failed I2C transfer (OSError), the frame is the request if any
+TRACE_ERR = 3
+TRACE_KIND_NAMES = {TRACE_TX: "TX", TRACE_RX: "RX", TRACE_ERR: "ERR"}
+
+# Ring file: header, then capacity fixed size records. The header keeps
+# the number of records ever written, the oldest record is overwritten.
+#   header: magic, version, record size, capacity, records written
+#   record: completion time (CLOCK_MONOTONIC), I2C time excluding sleeps,
+#           pid, kind, frame length, message type, delay after the write,
+#           driver command, frame
+TRACE_MAGIC   = b"POETRACE"
+TRACE_VERSION = 1
+_HEADER = struct.Struct("<8sIIIQ4x")
+_WRITTEN = struct.Struct("<Q")
+_WRITTEN_OFFSET = struct.calcsize("<8sIII")
+_RECORD = struct.Struct("<ddIBBBf32s15s")
+# Seconds between checks of the trace file existence
+TRACE_CHECK_INTVL = 1.0
+
+PoeTraceRecord = namedtuple("PoeTraceRecord",
+    ["timestamp", "i2c_time", "pid", "kind", "msg_type", "delay", "cmd_type",
+     "frame"])
+
+def create_trace(path=POE_TRACE_PATH, capacity=POE_TRACE_CAPACITY):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, _RECORD.size,
+                             capacity, 0))
+        f.truncate(_HEADER.size + _RECORD.size * capacity)
+    os.replace(tmp_path, path)
+
+def _read_header(fd):
+    data = os.pread(fd, _HEADER.size, 0)
+    if len(data) != _HEADER.size:
+        raise RuntimeError("Truncated trace header")
+    magic, version, rec_size, capacity, written = _HEADER.unpack(data)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION or \
+            rec_size != _RECORD.size or capacity == 0:
+        raise RuntimeError("Not a PoE trace file (version %d)" % TRACE_VERSION)
+    return capacity, written
+
+# Records of a trace file, oldest first
+def read_trace(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        capacity, written = _read_header(fd)
+        count = min(written, capacity)
+        records = []
+        for seq in range(written - count, written):
+            data = os.pread(fd, _RECORD.size,
+                            _HEADER.size + (seq % capacity) * _RECORD.size)
+            (timestamp, i2c_time, pid, kind, length, msg_type, delay,
+             cmd_type, frame) = _RECORD.unpack(data)
+            records.append(PoeTraceRecord(timestamp, i2c_time, pid, kind,
+                msg_type, delay, cmd_type.rstrip(b"\0").decode(),
+                list(frame[:length])))
+        return records
+    finally:
+        os.close(fd)
+
+# Appends frames to the trace ring while its file exists. The file is
+# shared by all processes, appends are serialized by a flock on it.
+class PoeTraceRecorder(object):
+    def __init__(self, path=POE_TRACE_PATH):
+        self.path = path
+        self._fd = None
+        self._ino = None
+        self._next_check = 0
+
+    def _close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = None
+        self._ino = None
+
+    def active(self):
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + TRACE_CHECK_INTVL
+            try:
+                ino = os.stat(self.path).st_ino
+            except OSError:
+                ino = None
+            if ino != self._ino:
+                self._close()
+                if ino is not None:
+                    try:
+                        self._fd = os.open(self.path, os.O_RDWR)
+                        self._ino = os.fstat(self._fd).st_ino
+                    except OSError:
+                        self._close()
+        return self._fd is not None
+
+    def record(self, kind, cmd_type, msg_type, frame, delay=0, i2c_time=0):
+        if not self.active():
+            return
+        data = _RECORD.pack(time.monotonic(), i2c_time, os.getpid(), kind,
+                            len(frame), msg_type or 0, delay,
+                            cmd_type.encode()[:32], bytes(frame[:15]))
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                capacity, written = _read_header(self._fd)
+                os.pwrite(self._fd, data, _HEADER.size +
+                          (written % capacity) * _RECORD.size)
+                os.pwrite(self._fd, _WRITTEN.pack(written + 1),
+                          _WRITTEN_OFFSET)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        except Exception as e:
+            print_stderr_limited("Trace record failed", path=self.path,
+                                 err=str(e))
+            self._close()
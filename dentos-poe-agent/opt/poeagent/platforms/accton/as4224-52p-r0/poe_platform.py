@@ -2,12 +2,11 @@ from collections import OrderedDict
 from poe_driver_pd69200_def import *
 from poe_common import *
 from poe_common import print_stderr
-from smbus2 import SMBus, i2c_msg
+from poe_bus import get_bus_session
 
 import os
 import sys
 import time
-import fcntl
 import poe_driver_pd69200 as PoeDrv
 
 def get_poe_platform():
@@ -20,10 +19,8 @@ class PoePlatform_accton_as4224_52p(PoeDrv.PoeDriver_microsemi_pd69200):
         self._total_poe_port = 48
         self._i2c_bus = 1
         self._i2c_addr = 0x3C
-        self._poe_bus = SMBus(self._i2c_bus)
-
-        # Add read 15byte first to cleanup buffer
-        self.plat_poe_read()
+        self._poe_bus = get_bus_session(self._i2c_bus, self._i2c_addr)
+        self._pipelined_xfer = 1
 
         # item in matrix: (logic port, phy port)
         self._default_matrix = [
@@ -41,23 +38,25 @@ class PoePlatform_accton_as4224_52p(PoeDrv.PoeDriver_microsemi_pd69200):
         self._port_power_limit = 0x7530 # 30000 mW
         self._default_power_banks = [(1, 800)]
 
+        # Chip capability of this boot, probed by the first process only
+        self.init_capability()
+
     def total_poe_port(self):
         return self._total_poe_port
 
     def _bus(self):
-        if self._poe_bus.fd is None:
-            self._poe_bus = SMBus(self._poe_bus)
         return self._poe_bus
 
     def _i2c_write(self, bus, msg, delay = 0.03):
-        write = i2c_msg.write(self._i2c_addr, msg)
-        bus.i2c_rdwr(write)
-        time.sleep(delay)
+        bus.write(msg)
+        self._delay(delay)
 
     def _i2c_read(self, bus, size = 15):
-        read = i2c_msg.read(self._i2c_addr, size)
-        bus.i2c_rdwr(read)
-        msg = list(read)
+        return bus.read(size)
+
+    def _i2c_read_write(self, bus, msg, delay = 0.03, size = 15):
+        msg = bus.read_write(msg, size)
+        self._delay(delay)
         return msg
 
     def plat_poe_write(self, msg, delay):
@@ -66,11 +65,14 @@ class PoePlatform_accton_as4224_52p(PoeDrv.PoeDriver_microsemi_pd69200):
     def plat_poe_read(self):
         return self._i2c_read(self._bus())
 
-    def bus_lock(self):
-        fcntl.flock(self._bus().fd, fcntl.LOCK_EX)
+    def plat_poe_read_write(self, msg, delay):
+        return self._i2c_read_write(self._bus(), msg, delay)
+
+    def bus_lock(self, cost=1):
+        self._bus().lock(self.get_bus_priority(), cost)
 
     def bus_unlock(self):
-        fcntl.flock(self._bus().fd, fcntl.LOCK_UN)
+        self._bus().unlock()
 
     def init_poe(self, config_in=None):
         ret_item = OrderedDict()
@@ -90,6 +92,7 @@ class PoePlatform_accton_as4224_52p(PoeDrv.PoeDriver_microsemi_pd69200):
         set_port_item["set_temp_matrix"] = []
         ret_item["set_power_bank"] = []
         ret_item["set_op_mode"] = []
+        ret_item[INIT_SKIPPED] = OrderedDict()
         result_prog_matrix = None
         result_save_sys = None
 
@@ -99,22 +102,33 @@ class PoePlatform_accton_as4224_52p(PoeDrv.PoeDriver_microsemi_pd69200):
             PRIORITY: "low",
             POWER_LIMIT: self._port_power_limit,
         })
-        # Set Temporary Matrix and
-        for temp_matrix_mapping in self._default_matrix:
-            logic_port = temp_matrix_mapping[0]
-            phy_porta = temp_matrix_mapping[1]
-            if config_in == None:
-                port = self.get_poe_port(logic_port)
-                result = port.set_all_params(default_param)
-                set_port_item["set_port_params"].append({
-                    "idx": logic_port,
-                    CMD_RESULT_RET: result
-                })
-            elif config_in == True:
-                # Preserve current state
-                pass
 
-            if prog_global_matrix == True:
+        default_ports = []
+        if config_in == None:
+            default_ports = [mapping[0] for mapping in self._default_matrix]
+        elif config_in == True:
+            # Preserve current state
+            pass
+
+        # Read current chip settings at once, only send what differs
+        chip_state = self.run_batch_sections(OrderedDict([
+            ("ports", self.ports_state_calls(default_ports)),
+            ("power_banks", self.power_banks_calls(self._default_power_banks)),
+            ("pm_method", [(self.get_pm_method, ())])
+        ]))
+
+        # Set port default
+        ports_state = self.ports_state_from_results(default_ports,
+                                                    chip_state["ports"])
+        (set_port_item["set_port_params"],
+         ret_item[INIT_SKIPPED]["set_port_params"]) = self.init_port_params(
+            default_param, ports_state)
+
+        # Set Temporary Matrix
+        if prog_global_matrix == True:
+            for temp_matrix_mapping in self._default_matrix:
+                logic_port = temp_matrix_mapping[0]
+                phy_porta = temp_matrix_mapping[1]
                 result = self.set_temp_matrix(logic_port, phy_porta)
                 set_port_item["set_temp_matrix"].append({
                     "idx": logic_port,
@@ -123,21 +137,18 @@ class PoePlatform_accton_as4224_52p(PoeDrv.PoeDriver_microsemi_pd69200):
         ret_item["set_port_item"] = set_port_item
 
         # Set Power Bank
-        for _power_bank in self._default_power_banks:
-            (bank, power_limit) = _power_bank
-            result = self.set_power_bank(bank, power_limit)
-            ret_item["set_power_bank"].append({
-                "setting": _power_bank,
-                CMD_RESULT_RET: result
-            })
+        (ret_item["set_power_bank"],
+         ret_item[INIT_SKIPPED]["set_power_bank"]) = self.init_power_banks(
+            self._default_power_banks, chip_state["power_banks"])
 
         # Set POE Power Management Method
-        result = self.set_pm_method(POE_PD69200_MSG_DATA_PM1_DYNAMIC,
-                                    POE_PD69200_MSG_DATA_PM2_PPL,
-                                    POE_PD69200_MSG_DATA_PM3_NO_COND)
-        ret_item["set_pm_method"] = {
-            CMD_RESULT_RET: result
-        }
+        (result, ret_item[INIT_SKIPPED]["set_pm_method"]) = self.init_pm_method(
+            POE_PD69200_MSG_DATA_PM1_DYNAMIC,
+            POE_PD69200_MSG_DATA_PM2_PPL,
+            POE_PD69200_MSG_DATA_PM3_NO_COND,
+            chip_state["pm_method"][0])
+        if result is not None:
+            ret_item["set_pm_method"] = result
 
         if prog_global_matrix == True:
             print_stderr(
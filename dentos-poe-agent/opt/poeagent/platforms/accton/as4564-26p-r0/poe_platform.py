@@ -3,12 +3,11 @@ from collections import OrderedDict
 from poe_driver_pd69200_def import *
 from poe_common import *
 from poe_common import print_stderr
-from smbus2 import SMBus, i2c_msg
+from poe_bus import get_bus_session
 
 import os
 import sys
 import time
-import fcntl
 import poe_driver_pd69200 as PoeDrv
 
 def get_poe_platform():
@@ -21,10 +20,8 @@ class PoePlatform_accton_as4564_26p(PoeDrv.PoeDriver_microsemi_pd69200):
         self._total_poe_port = 24
         self._i2c_bus = 1
         self._i2c_addr = 0x3C
-        self._poe_bus = SMBus(self._i2c_bus)
-        # Add read 15byte first to cleanup buffer
-        self.plat_poe_read()
-        self._4wire_bt = self.support_4wire_bt(3)
+        self._poe_bus = get_bus_session(self._i2c_bus, self._i2c_addr)
+        self._pipelined_xfer = 1
         # item in matrix: (logic port, phy port a,  phy port b)
         self._default_matrix = [
             (0, 4, 0xff), (1, 5, 0xff), (2, 6, 0xff), (3, 7, 0xff),
@@ -45,23 +42,25 @@ class PoePlatform_accton_as4564_26p(PoeDrv.PoeDriver_microsemi_pd69200):
         self._guard_band = 0x0A
         self._default_power_banks = [(1, 520)]
 
+        # Chip capability of this boot, probed by the first process only
+        self.init_capability(3)
+
     def total_poe_port(self):
         return self._total_poe_port
 
     def _bus(self):
-        if self._poe_bus.fd is None:
-            self._poe_bus = SMBus(self._poe_bus)
         return self._poe_bus
 
     def _i2c_write(self, bus, msg, delay = 0.03):
-        write = i2c_msg.write(self._i2c_addr, msg)
-        bus.i2c_rdwr(write)
-        time.sleep(delay)
+        bus.write(msg)
+        self._delay(delay)
 
     def _i2c_read(self, bus, size = 15):
-        read = i2c_msg.read(self._i2c_addr, size)
-        bus.i2c_rdwr(read)
-        msg = list(read)
+        return bus.read(size)
+
+    def _i2c_read_write(self, bus, msg, delay = 0.03, size = 15):
+        msg = bus.read_write(msg, size)
+        self._delay(delay)
         return msg
 
     def plat_poe_write(self, msg, delay):
@@ -70,11 +69,14 @@ class PoePlatform_accton_as4564_26p(PoeDrv.PoeDriver_microsemi_pd69200):
     def plat_poe_read(self):
         return self._i2c_read(self._bus())
 
-    def bus_lock(self):
-        fcntl.flock(self._bus().fd, fcntl.LOCK_EX)
+    def plat_poe_read_write(self, msg, delay):
+        return self._i2c_read_write(self._bus(), msg, delay)
+
+    def bus_lock(self, cost=1):
+        self._bus().lock(self.get_bus_priority(), cost)
 
     def bus_unlock(self):
-        fcntl.flock(self._bus().fd, fcntl.LOCK_UN)
+        self._bus().unlock()
 
     def init_poe(self, config_in=None):
         ret_item = OrderedDict()
@@ -94,6 +96,7 @@ class PoePlatform_accton_as4564_26p(PoeDrv.PoeDriver_microsemi_pd69200):
         set_port_item["set_temp_matrix"] = []
         ret_item["set_power_bank"] = []
         ret_item["set_op_mode"] = []
+        ret_item[INIT_SKIPPED] = OrderedDict()
         result_prog_matrix = None
         result_save_sys = None
 
@@ -104,23 +107,42 @@ class PoePlatform_accton_as4564_26p(PoeDrv.PoeDriver_microsemi_pd69200):
             PRIORITY: "low",
         })
 
-        # Set Temporary Matrix and
-        for temp_matrix_mapping in self._default_matrix:
-            logic_port = temp_matrix_mapping[0]
-            phy_porta = temp_matrix_mapping[1]
-            phy_portb = temp_matrix_mapping[2]
-            if config_in == None:
-                port = self.get_poe_port(logic_port)
-                result = port.set_all_params(default_param)
-                set_port_item["set_port_params"].append({
-                        "idx": logic_port,
-                        CMD_RESULT_RET: result
-                })
-            elif config_in == True:
-                # Preserve current state
-                pass
+        default_ports = []
+        if config_in == None:
+            default_ports = [mapping[0] for mapping in self._default_matrix]
+        elif config_in == True:
+            # Preserve current state
+            pass
 
-            if prog_global_matrix == True:
+        # Opration mode for each port
+        port_modes = OrderedDict()
+        for port_id in range(self.total_poe_port()):
+            if port_id <= 15:
+                port_modes[port_id] = 0x9
+            else:
+                port_modes[port_id] = 0x1
+
+        # Read current chip settings at once, only send what differs
+        state_ports = sorted(set(default_ports) | set(port_modes))
+        chip_state = self.run_batch_sections(OrderedDict([
+            ("ports", self.ports_state_calls(state_ports)),
+            ("power_banks", self.power_banks_calls(self._default_power_banks))
+        ]))
+        ports_state = self.ports_state_from_results(state_ports,
+                                                    chip_state["ports"])
+
+        # Set port default
+        (set_port_item["set_port_params"],
+         ret_item[INIT_SKIPPED]["set_port_params"]) = self.init_port_params(
+            default_param, OrderedDict((port_id, ports_state[port_id])
+                                       for port_id in default_ports))
+
+        # Set Temporary Matrix
+        if prog_global_matrix == True:
+            for temp_matrix_mapping in self._default_matrix:
+                logic_port = temp_matrix_mapping[0]
+                phy_porta = temp_matrix_mapping[1]
+                phy_portb = temp_matrix_mapping[2]
                 result = self.set_temp_matrix(logic_port, phy_porta, phy_portb)
                 set_port_item["set_temp_matrix"].append({
                     "idx": logic_port,
@@ -129,25 +151,14 @@ class PoePlatform_accton_as4564_26p(PoeDrv.PoeDriver_microsemi_pd69200):
         ret_item["set_port_item"] = set_port_item
 
         # Set Power Bank
-        for _power_bank in self._default_power_banks:
-            (bank, power_limit) = _power_bank
-            result = self.set_power_bank(bank, power_limit)
-            ret_item["set_power_bank"].append({
-                "setting": _power_bank,
-                CMD_RESULT_RET: result
-            })
+        (ret_item["set_power_bank"],
+         ret_item[INIT_SKIPPED]["set_power_bank"]) = self.init_power_banks(
+            self._default_power_banks, chip_state["power_banks"])
 
         # Set opration mode
-        for port_id in range(self.total_poe_port()):
-            if port_id <= 15:
-                result = self.set_bt_port_operation_mode(port_id, 0x9)
-            else:
-                result = self.set_bt_port_operation_mode(port_id, 0x1)
-            ret_item["set_op_mode"].append({
-                "idx": port_id,
-                CMD_RESULT_RET: result
-            })
-
+        (ret_item["set_op_mode"],
+         ret_item[INIT_SKIPPED]["set_op_mode"]) = self.init_bt_port_operation_mode(
+            port_modes, ports_state)
 
         if prog_global_matrix == True:
             print_stderr(
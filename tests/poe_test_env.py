@@ -0,0 +1,92 @@
+'''
+Copyright 2021 Delta Electronic Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Import paths of the poe agent, as set by the bin/poed and bin/poecli
+# wrappers
+import os
+import sys
+
+POEAGENT_ROOT = os.path.abspath(os.path.join(
+    os.path.dirname(__file__), "..", "dentos-poe-agent", "opt", "poeagent"))
+for sub_dir in ("platforms", "drivers", "lib", "inc", "bin"):
+    path = os.path.join(POEAGENT_ROOT, sub_dir)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from poe_common import *
+from poe_driver_pd69200_def import *
+from poe_driver_pd69200 import PoeDriver_microsemi_pd69200, PoeStaticCache
+from poe_trace import PoeTraceRecorder
+
+# PD69200 driver on a fake bus: every request is answered with a reply
+# carrying its echo and data byte 4 (the port of port requests).
+# fail: list of "write", "read", "read_write" or None, consumed one per
+# bus operation; a named operation raises OSError.
+class FakeBusDriver(PoeDriver_microsemi_pd69200):
+    def __init__(self, tmp_dir, pipelined=1, fail=None):
+        PoeDriver_microsemi_pd69200.__init__(self)
+        self._pipelined_xfer = pipelined
+        self._static_cache = PoeStaticCache(
+            os.path.join(tmp_dir, "static_cache.json"),
+            os.path.join(tmp_dir, "static_cache.lock"))
+        self._trace = PoeTraceRecorder(os.path.join(tmp_dir, "no_trace"))
+        self._msg_delay = 0
+        self._save_sys_delay = 0
+        self._clear_bus_buffer_delay = 0
+        self.fail = list(fail or [])
+        self.writes = []
+        self._pending = [0x00] * POE_PD69200_MSG_LEN
+
+    def total_poe_port(self):
+        return 48
+
+    def bus_lock(self, cost=1):
+        pass
+
+    def bus_unlock(self):
+        pass
+
+    def _fail(self, operation):
+        if len(self.fail) > 0 and self.fail.pop(0) == operation:
+            raise OSError(5, "Input/output error")
+
+    def _chip_write(self, msg):
+        self.writes.append(list(msg))
+        if msg[POE_PD69200_MSG_OFFSET_KEY] == POE_PD69200_MSG_KEY_REQUEST:
+            key = POE_PD69200_MSG_KEY_TELEMETRY
+        else:
+            key = POE_PD69200_MSG_KEY_REPORT
+        reply = [key, msg[POE_PD69200_MSG_OFFSET_ECHO], 0x4e, 0x4e, msg[4]] + [0x4e] * 8
+        self._pending = reply + self._calc_msg_csum(reply)
+
+    def _chip_read(self):
+        reply = self._pending
+        self._pending = [0x00] * POE_PD69200_MSG_LEN
+        return reply
+
+    def plat_poe_write(self, msg, delay):
+        self._fail("write")
+        self._chip_write(msg)
+
+    def plat_poe_read(self):
+        self._fail("read")
+        return self._chip_read()
+
+    def plat_poe_read_write(self, msg, delay):
+        self._fail("read_write")
+        reply = self._chip_read()
+        self._chip_write(msg)
+        return reply
@@ -0,0 +1,114 @@
+'''
+Copyright 2021 Delta Electronic Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import tempfile
+import threading
+import unittest
+
+from poe_test_env import *
+
+def port_queue(driver, ports):
+    return [("get_port_status",
+             [POE_PD69200_MSG_KEY_REQUEST, driver._calc_msg_echo(),
+              POE_PD69200_MSG_SUB_CHANNEL, 0x0e, port], 0, None)
+            for port in ports]
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def send(self, ports, pipelined=1, fail=None):
+        driver = FakeBusDriver(self.tmp.name, pipelined, fail)
+        rx_msgs = driver._communicate_batch(port_queue(driver, ports))
+        return driver, rx_msgs
+
+    def assertReplies(self, rx_msgs, ports):
+        self.assertEqual([rx_msg[4] for rx_msg in rx_msgs], ports)
+
+    def test_pipelined(self):
+        driver, rx_msgs = self.send([1, 2, 3, 4])
+        self.assertReplies(rx_msgs, [1, 2, 3, 4])
+        self.assertEqual(len(driver.writes), 4)
+        stats = driver.get_bus_stats()["total"]
+        self.assertEqual(stats[BUS_STAT_TRANS], 4)
+        self.assertEqual(stats[BUS_STAT_RETRIES], 0)
+
+    def test_serial(self):
+        driver, rx_msgs = self.send([5, 6, 7], pipelined=0)
+        self.assertReplies(rx_msgs, [5, 6, 7])
+
+    def test_first_write_error(self):
+        driver, rx_msgs = self.send([1, 2, 3], fail=["write"])
+        self.assertReplies(rx_msgs, [1, 2, 3])
+        stats = driver.get_bus_stats()["total"]
+        self.assertEqual(stats[BUS_STAT_TRANS], 3)
+        self.assertEqual(stats[BUS_STAT_RETRIES], 1)
+
+    def test_pipelined_exchange_error(self):
+        # write(1), read(1)+write(2) fails, then one request at a time
+        driver, rx_msgs = self.send([1, 2, 3, 4], fail=[None, "read_write"])
+        self.assertReplies(rx_msgs, [1, 2, 3, 4])
+        stats = driver.get_bus_stats()["total"]
+        self.assertEqual(stats[BUS_STAT_TRANS], 4)
+        self.assertEqual(stats[BUS_STAT_RETRIES], 1)
+
+    def test_cleanup_read_error(self):
+        # The failed exchange and the read dropping its reply both fail
+        driver, rx_msgs = self.send([1, 2, 3], fail=[None, "read_write", "read"])
+        self.assertReplies(rx_msgs, [1, 2, 3])
+
+    def test_last_read_error(self):
+        driver, rx_msgs = self.send([1, 2], fail=[None, None, "read"])
+        self.assertReplies(rx_msgs, [1, 2])
+
+    def test_retries_exhausted(self):
+        fail = ["write", "read"] * POE_PD69200_COMM_RETRY_TIMES
+        for pipelined in (0, 1):
+            with self.assertRaises(RuntimeError):
+                self.send([1, 2], pipelined, list(fail))
+
+    def test_batch_queue_per_thread(self):
+        driver = FakeBusDriver(self.tmp.name)
+        collecting = threading.Event()
+        resume = threading.Event()
+        results = dict()
+
+        def slow_status(port):
+            collecting.set()
+            resume.wait()
+            return driver.get_port_status(port)
+
+        def batch():
+            results["batch"] = driver.run_batch([
+                (driver.get_port_status, (1,)), (slow_status, (2,))])
+
+        thread = threading.Thread(target=batch)
+        thread.start()
+        collecting.wait()
+        # Sent right away, not collected into the other thread's batch
+        results["single"] = driver.get_port_status(9)
+        resume.set()
+        thread.join()
+        self.assertIsNotNone(results["single"])
+        self.assertEqual([tx_msg[4] for tx_msg in driver.writes], [9, 1, 2])
+        self.assertEqual(len(results["batch"]), 2)
+        self.assertNotIn(None, results["batch"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+'''
+Copyright 2021 Delta Electronic Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import tempfile
+import types
+import unittest
+
+from poe_test_env import *
+import poe_bus
+from poe_bus import PoeBusBudget
+
+class TestBusBudget(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.now = 1000.0
+        self.sleeps = []
+        # Only poe_bus sees the fake clock
+        self.time = poe_bus.time
+        poe_bus.time = types.SimpleNamespace(monotonic=lambda: self.now,
+                                             sleep=self.sleep)
+        self.budget = self.new_budget()
+
+    def tearDown(self):
+        poe_bus.time = self.time
+        self.tmp.cleanup()
+
+    def new_budget(self):
+        return PoeBusBudget(os.path.join(self.tmp.name, "budget"),
+                            rate=20, burst=100)
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def test_burst_then_rate(self):
+        self.assertEqual(self.budget._take(100, False), 0)
+        self.assertAlmostEqual(self.budget._take(10, False), 0.5)
+        self.now += 0.5
+        self.assertEqual(self.budget._take(10, False), 0)
+
+    def test_shared_between_users(self):
+        self.assertEqual(self.budget._take(90, False), 0)
+        self.assertAlmostEqual(self.new_budget()._take(20, False), 0.5)
+
+    def test_refill_capped_at_burst(self):
+        self.budget._take(100, False)
+        self.now += 3600
+        self.assertEqual(self.budget._take(100, False), 0)
+        self.assertGreater(self.budget._take(1, False), 0)
+
+    def test_charge_shrinks_bulk_share(self):
+        self.budget.charge(500)
+        # Down to -burst at most: 110 tokens to refill
+        self.assertAlmostEqual(self.budget._take(10, False), 5.5)
+
+    def test_cost_above_burst(self):
+        self.assertEqual(self.budget._take(250, False), 0)
+        self.assertAlmostEqual(self.budget._take(250, False), 10.0)
+
+    def test_acquire_waits(self):
+        self.budget.acquire(100)
+        self.budget.acquire(40)
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertAlmostEqual(self.sleeps[0], 2.0)
+
+    def test_broken_file(self):
+        with open(self.budget.path, 'w') as f:
+            f.write("garbage")
+        self.assertEqual(self.budget._take(100, False), 0)
+
+    def test_unusable_file(self):
+        budget = PoeBusBudget(os.path.join(self.tmp.name, "none", "budget"),
+                              rate=20, burst=100)
+        budget.acquire(1000)
+        self.assertEqual(self.sleeps, [])
+
+if __name__ == '__main__':
+    unittest.main()
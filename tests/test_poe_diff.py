@@ -0,0 +1,92 @@
+'''
+Copyright 2021 Delta Electronic Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import tempfile
+import unittest
+from collections import OrderedDict
+
+from poe_test_env import *
+
+class TestDiffPortsState(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.driver = FakeBusDriver(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def chip_state(self, endis, priority, power_limit):
+        return {ENDIS: TBL_ENDIS_TO_DRV[endis],
+                PRIORITY: TBL_PRIORITY_TO_DRV[priority],
+                POWER_LIMIT: power_limit}
+
+    def test_no_changes(self):
+        wanted = {0: {ENDIS: "enable", PRIORITY: "low", POWER_LIMIT: 30000}}
+        ports_state = {0: self.chip_state("enable", "low", 30000)}
+        self.assertEqual(self.driver.diff_ports_state(wanted, ports_state), [])
+
+    def test_changed_fields_only(self):
+        wanted = OrderedDict([
+            (0, {ENDIS: "disable", PRIORITY: "low", POWER_LIMIT: 30000}),
+            (1, {ENDIS: "enable", PRIORITY: "crit", POWER_LIMIT: 15400})])
+        ports_state = {0: self.chip_state("enable", "low", 30000),
+                       1: self.chip_state("enable", "high", 30000)}
+        self.assertEqual(self.driver.diff_ports_state(wanted, ports_state), [
+            (0, ENDIS, TBL_ENDIS_TO_DRV["disable"]),
+            (1, PRIORITY, TBL_PRIORITY_TO_DRV["crit"]),
+            (1, POWER_LIMIT, 15400)])
+
+    def test_partial_and_unknown_ports(self):
+        wanted = OrderedDict([(0, {PRIORITY: "high"}),
+                              (5, {ENDIS: "enable"})])
+        ports_state = {0: self.chip_state("disable", "high", 30000)}
+        self.assertEqual(self.driver.diff_ports_state(wanted, ports_state), [
+            (5, ENDIS, TBL_ENDIS_TO_DRV["enable"])])
+
+    def test_bt_firmware_skips_power_limit(self):
+        self.driver._4wire_bt = 1
+        wanted = {0: {ENDIS: "enable", POWER_LIMIT: 15400}}
+        ports_state = {0: self.chip_state("enable", "low", 30000)}
+        self.assertEqual(self.driver.diff_ports_state(wanted, ports_state), [])
+
+class TestPortsCfgToWanted(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.driver = FakeBusDriver(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_port_ids_from_zero(self):
+        port_configs = [
+            {PORT_ID: 1, ENDIS: "enable", PRIORITY: "low", POWER_LIMIT: 30000},
+            {PORT_ID: 48, ENDIS: "disable"}]
+        wanted = self.driver.ports_cfg_to_wanted(port_configs)
+        self.assertEqual(list(wanted.keys()), [0, 47])
+        self.assertIs(wanted[47], port_configs[1])
+
+    def test_invalid_entries(self):
+        for params in ({PORT_ID: 0}, {PORT_ID: 49}, {PORT_ID: "1"}, {},
+                       {PORT_ID: 1, ENDIS: "on"},
+                       {PORT_ID: 1, PRIORITY: "medium"},
+                       {PORT_ID: 1, POWER_LIMIT: -1},
+                       {PORT_ID: 1, POWER_LIMIT: 0x10000},
+                       {PORT_ID: 1, POWER_LIMIT: "30000"}):
+            with self.assertRaises(RuntimeError):
+                self.driver.ports_cfg_to_wanted([params])
+
+if __name__ == '__main__':
+    unittest.main()
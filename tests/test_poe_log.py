@@ -0,0 +1,88 @@
+'''
+Copyright 2021 Delta Electronic Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import io
+import time
+import types
+import unittest
+from collections import OrderedDict
+from contextlib import redirect_stderr
+
+from poe_test_env import *
+import poe_common
+
+class TestLogLimiter(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        # Only poe_common sees the fake clock
+        self.time = poe_common.time
+        poe_common.time = types.SimpleNamespace(
+            monotonic=lambda: self.now, time=time.time, sleep=time.sleep,
+            strftime=time.strftime)
+        self.limiter = PoeLogLimiter(interval=10, burst=3)
+
+    def tearDown(self):
+        poe_common.time = self.time
+
+    def test_burst_per_site(self):
+        self.assertEqual([self.limiter.check("a") for i in range(5)],
+                         [0, 0, 0, None, None])
+        self.assertEqual(self.limiter.check("b"), 0)
+
+    def test_dropped_count_on_next_window(self):
+        for i in range(5):
+            self.limiter.check("a")
+        self.now += 10
+        self.assertEqual(self.limiter.check("a"), 2)
+        self.assertEqual(self.limiter.check("a"), 0)
+
+    def test_expired_reports_quiet_sites(self):
+        for i in range(5):
+            self.limiter.check("a")
+        for i in range(4):
+            self.limiter.check("b")
+        self.assertEqual(self.limiter.expired(), [])
+        self.assertEqual(sorted(self.limiter.expired(force=True)),
+                         [("a", 2), ("b", 1)])
+        # Counts are reset once reported
+        self.now += 10
+        self.assertEqual(self.limiter.expired(), [])
+        self.assertEqual(self.limiter.check("a"), 0)
+
+    def test_expired_after_window(self):
+        for i in range(4):
+            self.limiter.check("a")
+        self.now += 10
+        self.assertEqual(self.limiter.expired(), [("a", 1)])
+
+class TestLogFields(unittest.TestCase):
+    def test_format(self):
+        fields = OrderedDict([("port", 3), ("err", 'bad "reply"'), ("tag", "")])
+        self.assertEqual(format_log_fields("Port set failed", fields),
+                         'Port set failed port=3 err="bad \\"reply\\"" tag=""')
+        self.assertEqual(format_log_fields("Started", None), "Started")
+
+    def test_print_stderr_limited(self):
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            for i in range(LOG_RATE_BURST + 2):
+                print_stderr_limited("Bus error", cnt=i)
+        lines = stderr.getvalue().splitlines()
+        self.assertEqual(lines, ["Bus error cnt={0}".format(i)
+                                 for i in range(LOG_RATE_BURST)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+'''
+Copyright 2021 Delta Electronic Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import tempfile
+import unittest
+from collections import OrderedDict
+
+from poe_test_env import *
+from poe_metrics import *
+
+class TestMetrics(unittest.TestCase):
+    def test_suffixes_and_types(self):
+        metrics = PoeMetrics()
+        metrics.family("poe_port_power_watts", METRIC_GAUGE, "Port power")
+        metrics.family("poe_bus_failures", METRIC_COUNTER, "Bus failures")
+        metrics.family("poe_agent", METRIC_INFO, "Agent versions")
+        metrics.add("poe_port_power_watts", 3.5, OrderedDict([("port", 1)]))
+        metrics.add("poe_bus_failures", 7)
+        metrics.add("poe_agent", 1, OrderedDict([("firmware", "24.1.5.3")]))
+        self.assertEqual(metrics.render(), "\n".join([
+            "# HELP poe_port_power_watts Port power",
+            "# TYPE poe_port_power_watts gauge",
+            'poe_port_power_watts{port="1"} 3.5',
+            "# HELP poe_bus_failures_total Bus failures",
+            "# TYPE poe_bus_failures_total counter",
+            "poe_bus_failures_total 7",
+            "# HELP poe_agent_info Agent versions",
+            "# TYPE poe_agent_info gauge",
+            'poe_agent_info{firmware="24.1.5.3"} 1']) + "\n")
+
+    def test_escaping(self):
+        metrics = PoeMetrics()
+        metrics.family("poe_agent", METRIC_INFO, 'Agent "info"\\\nversions')
+        metrics.add("poe_agent", 1, OrderedDict([("cfg", 'a "b"\\c\nd')]))
+        lines = metrics.render().splitlines()
+        self.assertEqual(lines[0], '# HELP poe_agent_info Agent "info"\\\\\\nversions')
+        self.assertEqual(lines[2], 'poe_agent_info{cfg="a \\"b\\"\\\\c\\nd"} 1')
+
+    def test_values(self):
+        metrics = PoeMetrics()
+        metrics.family("poe_value", METRIC_GAUGE, "Value")
+        for value in (True, False, 3, 0.25, float('nan'), float('inf'),
+                      float('-inf'), None):
+            metrics.add("poe_value", value)
+        self.assertEqual(metrics.render().splitlines()[2:], [
+            "poe_value 1", "poe_value 0", "poe_value 3", "poe_value 0.25",
+            "poe_value NaN", "poe_value +Inf", "poe_value -Inf"])
+
+    def test_empty_family_left_out(self):
+        metrics = PoeMetrics()
+        metrics.family("poe_value", METRIC_GAUGE, "Value")
+        metrics.add("poe_value", None)
+        self.assertEqual(metrics.render(), "\n")
+
+    def test_save(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "poe.prom")
+            self.assertTrue(save_metrics("poe_value 1\n", path))
+            with open(path, 'r') as f:
+                self.assertEqual(f.read(), "poe_value 1\n")
+            self.assertFalse(os.path.exists(path + ".tmp"))
+
+if __name__ == '__main__':
+    unittest.main()
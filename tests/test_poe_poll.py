@@ -0,0 +1,58 @@
+'''
+Copyright 2021 Delta Electronic Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import unittest
+
+from poe_test_env import *
+from poed import PoePollScheduler
+
+class TestPollScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = PoePollScheduler(tick=1)
+        self.chunks = []
+        self.scheduler.add_task("config", 60, 12, list(range(48)),
+                                self.chunks.append)
+
+    def run_ticks(self, start, count):
+        for now in range(start, start + count):
+            self.scheduler.run_tick(now)
+
+    def test_sweep_spread_over_interval(self):
+        self.run_ticks(1000, 60)
+        self.assertEqual(sum(self.chunks, []), list(range(48)))
+        self.assertEqual(max(len(chunk) for chunk in self.chunks), 1)
+        self.assertEqual(self.scheduler.tasks["config"].sweeps, 1)
+
+    def test_request_restarts_sweep_at_budget(self):
+        self.run_ticks(1000, 3)
+        del self.chunks[:]
+        self.scheduler.request("config")
+        self.run_ticks(1003, 10)
+        self.assertEqual([len(chunk) for chunk in self.chunks], [12] * 4)
+        self.assertEqual(sum(self.chunks, []), list(range(48)))
+
+    def test_on_demand_only(self):
+        self.scheduler.add_task("versions", 0, 1, [None], self.chunks.append)
+        del self.chunks[:]
+        self.scheduler.tasks.pop("config")
+        self.run_ticks(1000, 5)
+        self.assertEqual(self.chunks, [])
+        self.scheduler.request("versions")
+        self.run_ticks(1005, 5)
+        self.assertEqual(self.chunks, [[None]])
+
+if __name__ == '__main__':
+    unittest.main()
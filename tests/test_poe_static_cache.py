@@ -0,0 +1,96 @@
+'''
+Copyright 2021 Delta Electronic Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import json
+import tempfile
+import unittest
+
+from poe_test_env import *
+import poe_driver_pd69200
+
+class TestStaticCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "static_cache.json")
+        self.lock_path = os.path.join(self.tmp.name, "static_cache.lock")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def cache(self):
+        return PoeStaticCache(self.path, self.lock_path)
+
+    def test_shared_between_processes(self):
+        writer, reader = self.cache(), self.cache()
+        self.assertIsNone(reader.get(SW_VERSION))
+        writer.set(SW_VERSION, "24.1.5.3")
+        writer.update(INDV_MASKS, {"0x00": 1})
+        writer.update(INDV_MASKS, {"0x01": 0})
+        self.assertEqual(reader.get(SW_VERSION), "24.1.5.3")
+        self.assertEqual(reader.get(INDV_MASKS), {"0x00": 1, "0x01": 0})
+
+    def test_drop_and_clear(self):
+        cache = self.cache()
+        cache.update(INDV_MASKS, {"0x00": 1, "0x01": 0})
+        cache.set(SW_VERSION, "24.1.5.3")
+        cache.drop(INDV_MASKS, "0x00")
+        self.assertEqual(cache.get(INDV_MASKS), {"0x01": 0})
+        cache.drop(INDV_MASKS)
+        self.assertIsNone(cache.get(INDV_MASKS))
+        cache.clear()
+        self.assertIsNone(self.cache().get(SW_VERSION))
+
+    def test_broken_file(self):
+        with open(self.path, 'w') as f:
+            f.write("{")
+        cache = self.cache()
+        self.assertIsNone(cache.get(SW_VERSION))
+        cache.set(SW_VERSION, "24.1.5.3")
+        self.assertEqual(self.cache().get(SW_VERSION), "24.1.5.3")
+
+class TestFirmwareCheck(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cap_path = poe_driver_pd69200.POE_CAPABILITY_PATH
+        poe_driver_pd69200.POE_CAPABILITY_PATH = os.path.join(
+            self.tmp.name, "capability.json")
+        self.driver = FakeBusDriver(self.tmp.name)
+        self.version = self.driver.init_capability()[SW_VERSION]
+        self.driver._static_cache.update(ACTIVE_MATRIX, {"0": [0, 2]})
+
+    def tearDown(self):
+        poe_driver_pd69200.POE_CAPABILITY_PATH = self.cap_path
+        self.tmp.cleanup()
+
+    def test_same_firmware(self):
+        self.assertEqual(self.driver.check_firmware_version(), self.version)
+        self.assertIsNotNone(self.driver._static_cache.get(ACTIVE_MATRIX))
+
+    def test_firmware_changed(self):
+        # Cache and descriptor written for an older firmware
+        self.driver._static_cache.set(SW_VERSION, "24.1.5.3")
+        with open(poe_driver_pd69200.POE_CAPABILITY_PATH, 'r') as f:
+            cap = json.loads(f.read())
+        cap[SW_VERSION] = "24.1.5.3"
+        with open(poe_driver_pd69200.POE_CAPABILITY_PATH, 'w') as f:
+            f.write(json.dumps(cap))
+        self.assertEqual(self.driver.check_firmware_version(), self.version)
+        self.assertIsNone(self.driver._static_cache.get(ACTIVE_MATRIX))
+        self.assertEqual(self.driver._static_cache.get(SW_VERSION), self.version)
+        self.assertEqual(self.driver._load_capability()[SW_VERSION], self.version)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+'''
+Copyright 2021 Delta Electronic Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import unittest
+
+from poe_test_env import *
+from poe_telemetry import PoePortRing, PoeTelemetry, TELEMETRY_TIME
+
+class TestPortRing(unittest.TestCase):
+    def fill(self, ring, samples):
+        for timestamp, power in samples:
+            ring.append(timestamp, power, 53.5, 100, 0x80)
+
+    def test_empty(self):
+        ring = PoePortRing(4)
+        self.assertEqual(ring.last(3), [])
+        self.assertIsNone(ring.latest_time())
+        self.assertIsNone(ring.stats(POWER_CONSUMP, 60))
+        self.assertIsNone(ring.rate(POWER_CONSUMP, 60))
+
+    def test_wraps_around(self):
+        ring = PoePortRing(3)
+        self.fill(ring, [(t, t * 10) for t in range(1, 6)])
+        self.assertEqual(ring.count, 3)
+        self.assertEqual([s[TELEMETRY_TIME] for s in ring.last(5)], [3, 4, 5])
+        self.assertEqual([s[POWER_CONSUMP] for s in ring.last(2)], [40, 50])
+        self.assertEqual(ring.latest_time(), 5)
+
+    def test_stats_window(self):
+        ring = PoePortRing(10)
+        self.fill(ring, [(100, 1000), (110, 4000), (120, 2000), (130, 3000)])
+        stats = ring.stats(POWER_CONSUMP, 20)
+        self.assertEqual((stats["min"], stats["max"], stats["count"]),
+                         (2000, 4000, 3))
+        self.assertEqual(stats["avg"], 3000)
+        self.assertEqual(ring.stats(POWER_CONSUMP, 10, now=125)["count"], 2)
+        self.assertIsNone(ring.stats(POWER_CONSUMP, 10, now=200))
+
+    def test_missing_values(self):
+        ring = PoePortRing(4)
+        ring.append(100, 1000, None, None, None)
+        ring.append(110, None, None, None, 0x80)
+        ring.append(120, 3000, None, None, 0x80)
+        sample = ring.last()[0]
+        self.assertIsNone(sample[VOLTAGE])
+        self.assertEqual(ring.last(3)[0][STATUS], None)
+        self.assertEqual(ring.stats(POWER_CONSUMP, 60)["count"], 2)
+        self.assertIsNone(ring.stats(VOLTAGE, 60))
+
+    def test_rate(self):
+        ring = PoePortRing(8)
+        self.fill(ring, [(100, 1000), (110, 1500), (120, None), (130, 4000)])
+        self.assertEqual(ring.rate(POWER_CONSUMP, 60), 100.0)
+        self.assertEqual(ring.rate(POWER_CONSUMP, 25), 125.0)
+        self.assertIsNone(ring.rate(POWER_CONSUMP, 5))
+        ring.append(130, 5000, None, None, None)
+        self.assertIsNone(ring.rate(POWER_CONSUMP, 0))
+
+class TestTelemetry(unittest.TestCase):
+    def test_per_port(self):
+        telemetry = PoeTelemetry([0, 1], 4)
+        telemetry.add(0, 100, 1000, 53.5, 19, 0x80)
+        telemetry.add(1, 100, 2000, 53.5, 38, 0x80)
+        self.assertEqual(telemetry.port_ids(), [0, 1])
+        self.assertEqual(telemetry.last(1)[0][POWER_CONSUMP], 2000)
+        self.assertEqual(telemetry.stats(0, POWER_CONSUMP, 60)["max"], 1000)
+        self.assertIsNone(telemetry.rate(0, POWER_CONSUMP, 60))
+
+if __name__ == '__main__':
+    unittest.main()